@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/1.8/ref/settings/
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+import tempfile
 from tzlocal import get_localzone
 from django.conf import global_settings
 
@@ -134,6 +135,35 @@ DATABASES = {
 
 ATOMIC_REQUESTS = True
 
+# Caches
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+#
+# Leaderboard snapshots are expensive to build and are cached server wide in the
+# "leaderboards" cache (see Session.leaderboard_snapshot). It is file based so that 
+# it is shared by all the server processes. Entries don't expire, they are invalidated 
+# explicitly when a game's rating history changes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'leaderboards': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'CoGs', 'leaderboards'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000
+        }
+    }
+}
+
+# Counts of list views (see django_generic_view_extensions.queryset.cached_count) are cached 
+# in the shared cache too, so that a write in any process invalidates them in all of them.
+GENERIC_VIEW_COUNT_CACHE = 'leaderboards'
+
+# Bookkeeping models that no list counts depend on, written to often (by rating jobs and
+# rebuilds), whose writes should not invalidate the cached counts.
+GENERIC_VIEW_COUNT_IGNORE = ['Leaderboards.RatingJob', 'Leaderboards.PlayCount', 'Leaderboards.Rebuild_Log', 'Leaderboards.Backup_Rating']
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
 
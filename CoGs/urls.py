@@ -56,6 +56,8 @@ urlpatterns = [
     # Specific URLS first
     path('json/leaderboards/', views.ajax_Leaderboards, name='json_leaderboards'),
     path('json/game/<pk>', views.ajax_Game_Properties, name='get_game_props'),
+    path('json/ratingjobs/', views.ajax_Rating_Jobs, name='json_rating_jobs'),
+    path('json/ratinghistory/', views.ajax_Rating_History, name='json_rating_history'),
     
     # General patterns next
     path('json/<model>', views.ajax_List, name='get_list_html'),
@@ -0,0 +1,94 @@
+'''
+Leaderboards
+
+Vectorised TrueSkill session analysis
+
+A session analysis predicts a ranking from the expected performances of the rankers (players or
+teams), and reports the probability of that prediction and how accurate it proved. Done one
+session at a time, with a Python loop over rankers, that is slow on a page of leaderboards. Here
+it is done for any number of sessions at once, with NumPy arrays.
+
+See my doc "Understanding Trueskill" for the math on this.
+
+TODO: This should really be in the trueskill package
+'''
+import numpy as np
+from scipy.stats import norm
+
+def predict(group, ranker, rank, mu, sigma, weight, tau, beta, delta=0) -> tuple:
+    '''
+    Predicts the ranking of rankers in a number of sessions (groups) from their expected
+    performances.
+
+    Takes one value per player in each array (so that team performances can be built):
+
+    :param group:   The index of the session (0, 1, 2 ...) the player played in
+    :param ranker:  The index of the ranker (0, 1, 2 ...) in that session the player played as.
+                    Ties in expected performance are predicted in this order.
+    :param rank:    The rank that ranker achieved
+    :param mu:      The player's TrueSkill mean (µ)
+    :param sigma:   The player's TrueSkill standard deviation (σ)
+    :param weight:  The player's partial play weighting (ω)
+    :param tau:     The TrueSkill dynamics factor (τ)
+    :param beta:    The TrueSkill skill factor (ß)
+    :param delta:   The TrueSkill draw margin (δ)
+
+    Returns a tuple of arrays (order, mu, sigma, probability, accuracy):
+
+        order:       groups x rankers, the ranker indices in predicted order (padded on the right
+                     with the indices of non-existent rankers where a session has fewer)
+        mu, sigma:   groups x rankers, the expected performance of each ranker
+        probability: one per group, the probability of the predicted ranking
+        accuracy:    one per group, the proportion of ranker pairs the prediction placed in the
+                     same order as the actual result (0 if there are none)
+    '''
+    group = np.asarray(group, dtype=int)
+    ranker = np.asarray(ranker, dtype=int)
+    rank = np.asarray(rank, dtype=float)
+    mu = np.asarray(mu, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+    weight = np.asarray(weight, dtype=float)
+    tau = np.asarray(tau, dtype=float)
+    beta = np.asarray(beta, dtype=float)
+
+    groups = group.max() + 1 if group.size else 0
+    rankers = ranker.max() + 1 if ranker.size else 0
+
+    # The expected performance of each ranker, the weighted sum of its players' performances
+    MU = np.zeros((groups, rankers))
+    VAR = np.zeros((groups, rankers))
+    np.add.at(MU, (group, ranker), weight * mu)
+    np.add.at(VAR, (group, ranker), weight**2 * (sigma**2 + tau**2 + beta**2))
+    SIGMA = np.sqrt(VAR)
+
+    # Sessions with fewer rankers are padded, padding sorts last in both orders
+    exists = np.zeros((groups, rankers), dtype=bool)
+    exists[group, ranker] = True
+    RANK = np.full((groups, rankers), np.inf)
+    RANK[group, ranker] = rank
+    count = exists.sum(axis=1)
+
+    # Stable sorts so that ties keep the ranker order, as Python's sorted() does
+    predicted = np.argsort(np.where(exists, -MU, np.inf), axis=1, kind='stable')
+    actual = np.argsort(RANK, axis=1, kind='stable')
+
+    # The probability of the predicted ranking is the product of the probabilities that
+    # each ranker outperforms the next one in it.
+    mu_p = np.take_along_axis(MU, predicted, axis=1)
+    sigma_p = np.take_along_axis(SIGMA, predicted, axis=1)
+    adjacent = np.arange(rankers - 1) < (count - 1)[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (mu_p[:, :-1] - mu_p[:, 1:] - delta) / np.sqrt(sigma_p[:, :-1]**2 + sigma_p[:, 1:]**2)
+    probability = np.where(adjacent, norm.cdf(x), 1).prod(axis=1)
+
+    # The accuracy is the proportion of ranker pairs that are in the same order in both rankings
+    actual_position = np.argsort(actual, axis=1)
+    predicted_position = np.argsort(predicted, axis=1)
+    pairs = np.triu(np.ones((rankers, rankers), dtype=bool), 1) & exists[:, :, np.newaxis] & exists[:, np.newaxis, :]
+    agree = ((actual_position[:, :, np.newaxis] < actual_position[:, np.newaxis, :])
+             == (predicted_position[:, :, np.newaxis] < predicted_position[:, np.newaxis, :]))
+    total = pairs.sum(axis=(1, 2))
+    right = (agree & pairs).sum(axis=(1, 2))
+    accuracy = np.where(total > 0, right / np.maximum(total, 1), 0)
+
+    return (predicted, MU, SIGMA, probability, accuracy)
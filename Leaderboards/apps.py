@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class LeaderboardsConfig(AppConfig):
     name = 'Leaderboards'
+
+    def ready(self):
+        # Plan the fields the detail views collect (an introspection of the models that
+        # doesn't change while we run) now, rather than on the first request for each. 
+        from django_generic_view_extensions.model import warm_field_plans
+        warm_field_plans(self.get_models())
@@ -0,0 +1,60 @@
+'''
+Leaderboards
+
+Bulk updates for Django 2.1
+
+Rebuilding ratings rewrites thousands of Performances and Ratings at once. Saving them one at a
+time is a query apiece. QuerySet.bulk_update would do it in a few, but arrived in Django 2.2:
+
+    https://docs.djangoproject.com/en/2.2/ref/models/querysets/#bulk-update
+
+and CoGs runs on Django 2.1. This is an equivalent, built the same way.
+'''
+from django.db import connection, transaction
+from django.db.models import Case, When, Value, Expression
+from django.db.models.functions import Cast
+
+def bulk_update(model, objects, fields, batch_size=None):
+    '''
+    Saves the named fields of the given objects with one UPDATE per batch, as 
+    QuerySet.bulk_update does in Django 2.2.
+    
+    Each field is set with a CASE on the primary key (cast on PostgreSQL, which
+    can't otherwise infer the type of the parameters). No signals are sent and 
+    save() is not called.
+    
+    Returns the number of rows updated.
+    
+    :param model:      The model the objects are instances of
+    :param objects:    An iterable of saved objects (with a pk)
+    :param fields:     A list of field names to write
+    :param batch_size: The number of objects per UPDATE (all of them in one, if None)
+    '''
+    objects = list(objects)
+    if not objects:
+        return 0
+
+    fields = [model._meta.get_field(name) for name in fields]
+    batch_size = batch_size or len(objects)
+
+    updated = 0
+    with transaction.atomic(savepoint=False):
+        for b in range(0, len(objects), batch_size):
+            batch = objects[b:b + batch_size]
+            updates = {}
+            for field in fields:
+                # A relation is written by its id, of its target's type
+                output_field = field.target_field if field.is_relation else field
+                whens = []
+                for obj in batch:
+                    value = getattr(obj, field.attname)
+                    if not isinstance(value, Expression):
+                        value = Value(value, output_field=output_field)
+                    whens.append(When(pk=obj.pk, then=value))
+                case = Case(*whens, output_field=output_field)
+                if connection.vendor == 'postgresql':
+                    case = Cast(case, output_field=output_field)
+                updates[field.attname] = case
+            updated += model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+
+    return updated
@@ -0,0 +1,77 @@
+'''
+Leaderboards
+
+An identity map (unit of work) for the Leaderboards models
+
+Rendering leaderboards, or rebuilding ratings, looks up the same players' ratings at the same 
+games over and over, from different sessions. Each lookup, as a rule, loads its own copy of the 
+Rating from the database. With an identity map in place there is one copy of each, and 
+Rating.get and Performance.rating find it in the map before turning to the database.
+
+The map's scope is ratings. Sessions loaded with their results (SessionQuerySet.with_results) 
+put the Ratings of their players at their games in it, in one query, and share one instance 
+of each of those players. Other related objects (a performance's session, a rank's player and 
+the like) are read as usual, from the prefetched results or the database.
+
+It is opt-in, the map only exists inside a with block:
+
+    with IdentityMap():
+        for session in Session.objects.filter(...).with_results():
+            ...
+
+and it is local to the thread, so a request (or rebuild) has its own that is gone when it ends.
+'''
+import threading
+
+_local = threading.local()
+
+def identity_map():
+    '''
+    Returns the active IdentityMap or None if there isn't one.
+    '''
+    return getattr(_local, 'identity_map', None)
+
+class IdentityMap:
+    '''
+    Keeps the Ratings, keyed on player and game, and one instance of each object added, 
+    keyed on its model and primary key.
+    '''
+    def __init__(self):
+        self.objects = {}
+        self.ratings = {}
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = identity_map()
+        _local.identity_map = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.identity_map = self.previous
+        self.previous = None
+
+    def add(self, obj):
+        '''
+        Adds an object to the map, unless it holds one already.
+
+        Returns the instance held in the map, which callers should use in place of obj.
+        '''
+        if obj is None or obj.pk is None:
+            return obj
+        return self.objects.setdefault((obj._meta.label, obj.pk), obj)
+
+    def add_rating(self, rating):
+        '''
+        Adds a Rating to the map, unless it holds one for that player and game already.
+
+        Returns the instance held in the map.
+        '''
+        return self.ratings.setdefault((rating.player_id, rating.game_id), rating)
+
+    def get_rating(self, player, game):
+        '''
+        Returns the Rating for a player and game (objects or pks) or None if the map doesn't hold it.
+        '''
+        player = getattr(player, 'pk', player)
+        game = getattr(game, 'pk', game)
+        return self.ratings.get((player, game), None)
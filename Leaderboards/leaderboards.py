@@ -1327,3 +1327,54 @@ class leaderboard_options:
         # Map self.compare_back_to number to self.compare_back_to datetime
         if self.is_enabled('compare_back_to') and isinstance(self.compare_back_to, numbers.Real):
             self.compare_back_to = self.last_event_start_time(self.compare_back_to, as_ExpressionWrapper=False)            
+
+# The columns of a compact leaderboard and the index of each in a leaderboard row (see Game.leaderboard),
+# rank_prev being the previous rank that ajax_Leaderboards adds to some rows. 
+CompactColumns = OrderedDict((("rank", 0),
+                              ("pk", 1),
+                              ("eta", 6),
+                              ("mu", 7),
+                              ("sigma", 8),
+                              ("plays", 9),
+                              ("victories", 10),
+                              ("last_play", 11),
+                              ("rank_prev", 13)))
+
+def compact_leaderboard(leaderboard, players):
+    '''
+    Encodes a game's leaderboards (a Tier1 tuple as ajax_Leaderboards describes it) compactly
+    for the wire. Each row of a leaderboard repeats the player's names, BGG name and leagues
+    in every snapshot of every game, and full precision floats and datetimes too. 
+    
+    In the compact form the leaderboard of each snapshot is a dict of columns (named as in
+    CompactColumns), the floats rounded and last_play a POSIX timestamp. The player details
+    are sent once per response, as a dict keyed on player pk of [BGGname, nick, full name, 
+    complete name, leagues] lists, appended to the Tier1 tuple. It describes only players that
+    earlier Tier1 tuples (in the same response) did not.  
+    
+    :param leaderboard: A Tier1 tuple (game.pk, game.BGGid, game.name, snapshots)
+    :param players:     A set of the pks of players described already in this response,
+                        which is updated with those this tuple describes. 
+    '''
+    (pk, BGGid, name, snapshots) = leaderboard
+    
+    new_players = {}
+    compact_snapshots = []
+    for snapshot in snapshots:
+        columns = OrderedDict((column, []) for column in CompactColumns)
+        for row in snapshot[8] or []:
+            if not row[1] in players:
+                players.add(row[1])
+                new_players[row[1]] = [row[2], row[3], row[4], row[5], row[12]]
+            
+            for column, i in CompactColumns.items():
+                value = row[i] if i < len(row) else None
+                if isinstance(value, float):
+                    value = round(value, 3)
+                elif isinstance(value, datetime):
+                    value = int(value.timestamp())
+                columns[column].append(value)
+            
+        compact_snapshots.append(snapshot[0:8] + (columns,))
+    
+    return (pk, BGGid, name, compact_snapshots, new_players)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Place this file in:
+#     myapp/management/commands/benchmark_indexes.py
+#
+# and it should then be available as:
+#
+# ./manage.py benchmark_indexes [--games n] [--players n] [--sessions n] [--runs n]
+#
+# Use a development database, not the live one. Nothing is kept, but the indexes under test
+# are dropped (inside a transaction) while it runs, which locks the tables.
+u'''
+
+Management command to benchmark the composite and partial indexes of migrations 0008 and 0009
+on the hot query paths (previous sessions, session performances, last performances, leaderboards,
+victories and session ranks).
+
+Fills the database with a synthetic (and large) history of sessions, then reports the EXPLAIN
+ANALYZE plan and the best execution time of each query with the indexes (after) and without
+them (before). All inside a transaction that is rolled back, leaving the database as it was.
+
+Usage: manage.py benchmark_indexes [--games n] [--players n] [--sessions n] [--runs n]
+'''
+import logging
+import random
+import re
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from Leaderboards.models import Game, Player, Session, Rank, Performance, Rating
+
+# The indexes added by migrations 0008 and 0009
+INDEXES = ['session_game_time_idx',
+           'rank_session_player_idx',
+           'rank_session_rank_idx',
+           'performance_session_player_idx',
+           'performance_player_session_idx',
+           'rating_game_eta_idx',
+           'rank_victory_player_idx',
+           'rank_victory_team_idx',
+           'rank_victory_session_idx',
+           'performance_history_idx',
+           'performance_game_time_idx']
+
+def build_history(games, players, sessions):
+    '''
+    Bulk creates a synthetic history of sessions between random players at random games.
+
+    Returns the lists of Games, Players and Sessions created.
+    '''
+    random.seed(0)
+
+    game_objects = Game.objects.bulk_create([Game(name=f"Benchmark Game {g}", BGGid=g) for g in range(games)])
+    player_objects = Player.objects.bulk_create([Player(name_nickname=f"Benchmark Player {p}", name_personal=f"Personal {p}", name_family=f"Family {p}") for p in range(players)])
+
+    start = timezone.now() - timedelta(minutes=sessions)
+    session_objects = Session.objects.bulk_create([Session(game=random.choice(game_objects), date_time=start + timedelta(minutes=s)) for s in range(sessions)])
+
+    ranks = []
+    performances = []
+    ratings = {}
+    for session in session_objects:
+        for r, player in enumerate(random.sample(player_objects, random.randint(2, 6))):
+            ranks.append(Rank(session=session, rank=r + 1, player=player))
+            performances.append(Performance(session=session, player=player, game=session.game, date_time=session.date_time, rank=r + 1, is_victory=r == 0))
+            ratings[(player.pk, session.game.pk)] = Rating(player=player, game=session.game, trueskill_eta=random.gauss(10, 5))
+
+    Rank.objects.bulk_create(ranks, batch_size=5000)
+    Performance.objects.bulk_create(performances, batch_size=5000)
+    Rating.objects.bulk_create(ratings.values(), batch_size=5000)
+
+    return game_objects, player_objects, session_objects
+
+def query_paths(game, player, session):
+    '''
+    Returns a list of (name, queryset) tuples, for the query paths under test.
+    '''
+    played = Q(ranks__player=player) | Q(ranks__team__players=player)
+    return [
+        ("Session.previous_sessions", Session.objects.filter(Q(date_time__lte=session.date_time) & Q(game=game) & played).order_by('-date_time')),
+        ("Session.performance", Performance.objects.filter(session=session, player=player)),
+        ("Game.last_performances", game.last_performances(asat=session.date_time)),
+        ("Game.leaderboard", Rating.objects.filter(game=game)),
+        ("Player victories", Session.objects.filter(Q(game=game) & Q(ranks__rank=1) & played).order_by('-date_time')),
+        ("Session.ranks", Rank.objects.filter(session=session).order_by('rank')),
+    ]
+
+def explain(queryset, runs):
+    '''
+    Returns the EXPLAIN ANALYZE plan of a queryset and its best execution time (ms) over a number of runs.
+    '''
+    sql, params = queryset.query.sql_with_params()
+    best = None
+    with connection.cursor() as cursor:
+        for _ in range(runs):
+            cursor.execute("EXPLAIN ANALYZE " + sql, params)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+            time = float(re.search(r"Execution Time: ([\d.]+) ms", plan).group(1))
+            best = time if best is None else min(best, time)
+    return plan, best
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=50, help='The number of games to create (defaults to 50).')
+        parser.add_argument('--players', type=int, default=1000, help='The number of players to create (defaults to 1000).')
+        parser.add_argument('--sessions', type=int, default=100000, help='The number of sessions to create (defaults to 100000).')
+        parser.add_argument('--runs', type=int, default=5, help='The number of times to run each query, the best time is reported (defaults to 5).')
+
+    def handle(self, *args, **options):
+        rootLogger = logging.getLogger('')
+        rootLogger.setLevel(logging.INFO)
+
+        if connection.vendor != 'postgresql':
+            raise CommandError('The indexes being benchmarked are PostgreSQL specific, not for %r.' % connection.vendor)
+
+        runs=options['runs']
+        if runs < 1:
+            raise CommandError('At least one run is needed, not %r.' % runs)
+
+        with transaction.atomic():
+            logging.info('Building a history of %d sessions...' % options['sessions'])
+            games, players, sessions = build_history(options['games'], options['players'], options['sessions'])
+
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+            # A busy game, a regular of it and one of their late sessions
+            session = sessions[-1]
+            game = session.game
+            player = session.performances.all()[0].player
+            paths = query_paths(game, player, session)
+
+            after = {name: explain(qs, runs) for name, qs in paths}
+
+            with connection.cursor() as cursor:
+                for index in INDEXES:
+                    cursor.execute(f'DROP INDEX {index}')
+                cursor.execute('ANALYZE')
+
+            before = {name: explain(qs, runs) for name, qs in paths}
+
+            for name, _ in paths:
+                logging.info('%s: %.3f ms before, %.3f ms after' % (name, before[name][1], after[name][1]))
+                logging.info('Before:\n%s' % before[name][0])
+                logging.info('After:\n%s' % after[name][0])
+
+            transaction.set_rollback(True)
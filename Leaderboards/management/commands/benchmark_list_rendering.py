@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# Place this file in:
+#     myapp/management/commands/benchmark_list_rendering.py
+#
+# and it should then be available as:
+#
+# ./manage.py benchmark_list_rendering [--model name] [--rows n] [--runs n] [--elements format]
+#
+# Reads the database only, nothing is written.
+u'''
+
+Management command to benchmark the rendering of list views, the compiled row renderer
+(django_generic_view_extensions.html.list_row_renderer) against rendering each row from
+scratch as list_html_output used to (reversing three URLs, formatting the filters and
+the menu, index and key HTML and calling odm_str for every object).
+
+The objects are loaded before timing, so that only rendering is measured, and the best
+time per 1,000 rows over a number of runs is reported for each, in each of the layouts
+with text and button menus. If the two ever render differently the command fails.
+
+Usage: manage.py benchmark_list_rendering [--model name] [--rows n] [--runs n] [--elements format]
+'''
+import logging
+import timeit
+
+from itertools import cycle, islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import six
+from django.utils.safestring import mark_safe
+
+from django_generic_view_extensions.html import odm_str, list_html_rows
+from django_generic_view_extensions.options import list_display_format, odm, osf, lmf
+from django_generic_view_extensions.filterset import format_filterset
+from django_generic_view_extensions.util import class_from_string
+
+from Leaderboards.views import view_List
+
+def render_per_row(self, LDF=None):
+    '''
+    Renders the rows of a list as list_html_output did before the row renderer was compiled,
+    working everything out again for each row. The baseline to compare against, and so the 
+    code of list_html_output (django_generic_view_extensions.html) as it was, unchanged.
+    '''
+    if LDF is None:
+        LDF = self.format.complete
+        
+    LMF = self.format.menus
+    LIF = self.format.index
+    LKF = self.format.key
+
+    # Define the standard HTML strings for supported formats    
+    if LDF == odm.as_table:
+        normal_row = "<tr>{menu:s}{index:s}{key:s}<td class='list_item'>{value:s}</td></tr>"
+    elif LDF == odm.as_ul:
+        normal_row = "<li class='list_item'>{menu:s}{index:s}{key:s}{value:s}</li>"
+    elif LDF == odm.as_p:
+        normal_row = "<p class='list_item'>{menu:s}{index:s}{key:s}{value:s}</p>"
+    elif LDF == odm.as_br:
+        normal_row = '{menu:s}{index:s}{key:s}{value:s}<br>'
+    else:
+        raise ValueError("Internal Error: format must always contain one of the object layout modes.")                
+
+    # Menu support is for three menu items against each list item
+    #    View for a DetailView
+    #    Edit for an UpdateView
+    #    Delete for a DeleteView
+
+    if LMF == lmf.none:
+        menu = ""
+    elif LMF == lmf.text:
+        text = "<span class='list_menu_text'>[<a href={} class='list_menu_link'>{}</a>] </span>"
+        menu = text.format("'{view:s}'", 'view')
+        if self.request.user.is_authenticated:
+            menu += text.format("'{edit:s}'", 'edit') + text.format("'{delete:s}'", 'delete')
+        if LDF == odm.as_table:
+            menu = "<td class='list_menu_cell'>{}</td>".format(menu)                    
+    elif LMF == lmf.buttons:
+        button = "<input type='button' onclick='location.href={};' value='{}' class='list_menu_button' /> "
+        menu = button.format('"{view:s}"', 'view')
+        if self.request.user.is_authenticated:
+            menu += button.format('"{edit:s}"', 'edit') + button.format('"{delete:s}"', 'delete')
+        if LDF == odm.as_table:
+            menu = "<td class='list_menu_cell'>{}</td>".format(menu)                    
+
+    # Index support is for one index running down page
+    if LIF:
+        index = "<span class='list_index_text'>{index}</span>"
+        if LDF == odm.as_table:
+            index = "<td class='list_index_cell'>{}</td>".format(index)                    
+    else:
+        index = ""
+
+    # Key support is for one index running down page
+    if LKF:
+        key = "<span class='list_key_text'>{key}</span>"
+        if LDF == odm.as_table:
+            key = "<td class='list_key_cell'>{}</td>".format(key)
+    else:
+        key = ""
+
+    # Collect output lines in a list
+    output = []
+
+    # This evaluates the queryset (the index continues from earlier pages, if any) 
+    i = getattr(self, 'start', 0) + 1
+    for o in self.queryset:
+        url_view = reverse('view', kwargs={'model': self.kwargs['model'], 'pk': o.pk})
+        url_edit = reverse('edit', kwargs={'model': self.kwargs['model'], 'pk': o.pk})
+        url_delete = reverse('delete', kwargs={'model': self.kwargs['model'], 'pk': o.pk})
+        
+        # The view url is special. It should conserve filters and ordering so that the 
+        # detail view browses (prior/next links) within the ordered filtered view.
+        if getattr(self, 'filterset', False):
+            filters = format_filterset(self.filterset, as_text=False)
+            url_view += "?" + "&".join(filters)                
+        
+        if self.request.user.is_authenticated:
+            html_menu = menu.format(view=url_view, edit=url_edit, delete=url_delete)
+        else:        
+            html_menu = menu.format(view=url_view)
+            
+        html_index = index.format(index=i)
+        i += 1
+
+        html_key = key.format(key=o.pk)
+        
+        html_value = six.text_type(odm_str(o, self.format))
+        row = normal_row.format(menu=html_menu, index=html_index, key=html_key, value=html_value)
+        output.append(row)
+
+    return mark_safe('\n'.join(output))
+
+def render_compiled(view):
+    '''
+    Renders the rows of a list with the compiled row renderer.
+    '''
+    return '\n'.join(list_html_rows(view))
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default='Session', help='The model to list (defaults to Session).')
+        parser.add_argument('--rows', type=int, default=1000, help='The number of rows to render (defaults to 1000, objects are repeated if there are fewer).')
+        parser.add_argument('--runs', type=int, default=5, help='The number of times to render the rows, the best time is reported (defaults to 5).')
+        parser.add_argument('--elements', default='brief', help='The object summary format, brief, verbose, rich or detail (defaults to brief).')
+
+    def handle(self, *args, **options):
+        rootLogger = logging.getLogger('')
+        rootLogger.setLevel(logging.INFO)
+
+        runs = options['runs']
+        if runs < 1:
+            raise CommandError('At least one run is needed, not %r.' % runs)
+
+        elements = getattr(osf, options['elements'], None)
+        if not isinstance(elements, int):
+            raise CommandError('Unknown object summary format %r.' % options['elements'])
+
+        view = view_List()
+        view.request = RequestFactory().get('/')
+        view.request.user = AnonymousUser()
+        view.kwargs = {'model': options['model']}
+        view.model = class_from_string(view, options['model'])
+        view.filterset = None
+        view.start = 0
+
+        objects = list(view.model.objects.all()[:options['rows']])
+        if not objects:
+            raise CommandError('There are no %s objects to render.' % options['model'])
+        view.queryset = list(islice(cycle(objects), options['rows']))
+
+        for layout in ('as_table', 'as_ul', 'as_p', 'as_br'):
+            for menus in ('text', 'buttons'):
+                view.format = list_display_format()
+                view.format.complete = getattr(odm, layout)
+                view.format.menus = getattr(lmf, menus)
+                view.format.elements = elements
+                view.format.index = True
+                view.format.key = True
+
+                if render_per_row(view) != render_compiled(view):
+                    raise CommandError('%s with %s menus: the renderers disagree!' % (layout, menus))
+
+                times = {}
+                for name, render in (('per row', render_per_row), ('compiled', render_compiled)):
+                    best = min(timeit.repeat(lambda: render(view), number=1, repeat=runs))
+                    times[name] = best * 1000 / len(view.queryset) * 1000
+
+                logging.info('%s with %s menus: %.3f ms per 1,000 rows per row, %.3f ms compiled (%.1fx)' % (layout, menus, times['per row'], times['compiled'], times['per row'] / times['compiled']))
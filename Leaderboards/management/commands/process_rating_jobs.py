@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# Place this file in:
+#     myapp/management/commands/process_rating_jobs.py
+#
+# and it should then be available as:
+#
+# ./manage.py process_rating_jobs [--once] [--sleep seconds]
+u'''
+
+Management command to work through the queue of rating updates (RatingJob) that saving sessions
+leaves behind.
+
+Runs until stopped, checking the queue every --sleep seconds when it's empty. With --once it
+stops as soon as the queue is empty instead (handy from cron). Any number of these can be run
+at once, each job is only run by one of them. A job left running by a worker that died is
+queued again. 
+
+Usage: manage.py process_rating_jobs [--once] [--sleep seconds]
+'''
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Leaderboards.models import RatingJob
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Stop when the queue is empty, rather than wait for more jobs.')
+        parser.add_argument('--sleep', type=float, default=5, help='The number of seconds to wait between checks of an empty queue (defaults to 5).')
+
+    def handle(self, *args, **options):
+        rootLogger = logging.getLogger('')
+        rootLogger.setLevel(logging.INFO)
+
+        sleep=options['sleep']
+        if sleep <= 0:
+            raise CommandError('Need a positive time to sleep, not %r.' % sleep)
+
+        while True:
+            job=RatingJob.run_next()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(sleep)
+            elif job.status == RatingJob.FAILED:
+                logging.error('%s: failed after %s with %s' % (job.game.name, job.finished - job.started, job.error))
+            else:
+                logging.info('%s: rebuilt ratings since %s in %s' % (job.game.name, job.since, job.finished - job.started))
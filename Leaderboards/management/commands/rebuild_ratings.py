@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Place this file in:
+#     myapp/management/commands/rebuild_ratings.py
+#
+# and it should then be available as:
+#
+# ./manage.py rebuild_ratings [--processes n] [--game game] [--since datetime]
+u'''
+
+Management command to rebuild TrueSkill ratings from the recorded session history.
+
+Ratings are independent across games and so with --processes greater than 1 the games are
+rebuilt in parallel, each in its own worker process with its own database connection.
+
+Reports the time taken to rebuild each game.
+
+With --game and/or --since only the ratings affected by that game's sessions and/or the
+sessions played since that time are rebuilt, starting from the ratings as they were before
+them.
+
+Usage: manage.py rebuild_ratings [--processes n] [--game game] [--since datetime]
+'''
+import logging
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_aware, make_aware
+
+from Leaderboards.models import Game, Rating
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='The number of worker processes to rebuild games with (defaults to the number of CPUs).')
+        parser.add_argument('--game', help='The name or primary key of a game, to rebuild only ratings at that game.')
+        parser.add_argument('--since', help='A date and time, to rebuild only ratings affected by sessions played since then.')
+
+    def handle(self, *args, **options):
+        rootLogger = logging.getLogger('')
+        rootLogger.setLevel(logging.INFO)
+
+        processes=options['processes']
+        if processes < 1:
+            raise CommandError('At least one process is needed, not %r.' % processes)
+
+        game=options['game']
+        if game:
+            games=Game.objects.filter(pk=game) if game.isdigit() else Game.objects.filter(name=game)
+            if games.count() != 1:
+                raise CommandError('No unique game found: %r' % game)
+            game=games[0]
+
+        since=options['since']
+        if since:
+            since=parse_datetime(since)
+            if since is None:
+                raise CommandError('Not a valid date and time: %r' % options['since'])
+            if not is_aware(since):
+                since=make_aware(since)
+
+        if game or since:
+            ratings=Rating.rebuild(game=game, since=since)
+            logging.info('Rebuilt %d ratings.' % len(ratings))
+        else:
+            timings=Rating.rebuild_all(processes)
+
+            for game, (ratings, duration) in timings.items():
+                logging.info('%s: %d ratings in %s' % (game.name, ratings, duration))
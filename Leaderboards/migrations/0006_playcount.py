@@ -0,0 +1,81 @@
+# Generated by Django 2.1.1 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_play_counts(apps, schema_editor):
+    '''
+    Builds the play counts for all games from the recorded performances.
+    
+    This is PlayCount.update (rebuilding all counts) over the historic models, as a migration 
+    can't rely on the current ones matching the tables at this point.
+    '''
+    Game = apps.get_model('Leaderboards', 'Game')
+    League = apps.get_model('Leaderboards', 'League')
+    Performance = apps.get_model('Leaderboards', 'Performance')
+    PlayCount = apps.get_model('Leaderboards', 'PlayCount')
+
+    player_leagues = {}
+    for player, league in League.players.through.objects.values_list('player', 'league'):
+        player_leagues.setdefault(player, []).append(league)
+
+    for game in Game.objects.filter(sessions__isnull=False).distinct().values_list('pk', flat=True):
+        performances = list(Performance.objects
+                            .filter(session__game=game)
+                            .order_by('session__date_time', 'session')
+                            .values_list('session', 'session__date_time', 'session__league', 'player', 'play_number'))
+
+        # The counts (total, max, players, sessions) keyed on league (None for all leagues) 
+        counts = {}
+        new_rows = []
+        changed = set()
+        for i, (session, date_time, league, player, play_number) in enumerate(performances):
+            for key in [None] + player_leagues.get(player, []):
+                pc = counts.setdefault(key, [0, 0, 0, 0])
+                pc[0] += 1
+                pc[1] = max(pc[1], play_number)
+                if play_number == 1:
+                    pc[2] += 1
+                changed.add(key)
+
+            if i + 1 == len(performances) or performances[i + 1][0] != session:
+                changed.add(league)
+                for key in changed:
+                    pc = counts.setdefault(key, [0, 0, 0, 0])
+                    if key is None or key == league:
+                        pc[3] += 1
+                    new_rows.append(PlayCount(game_id=game, league_id=key, session_id=session, date_time=date_time,
+                                              total=pc[0], max=pc[1], players=pc[2], sessions=pc[3]))
+                changed = set()
+
+        PlayCount.objects.bulk_create(new_rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0005_auto_20190422_2157'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_time', models.DateTimeField(editable=False, verbose_name='Time of the Session')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Total number of plays')),
+                ('max', models.PositiveIntegerField(default=0, verbose_name='Largest play count of any player')),
+                ('players', models.PositiveIntegerField(default=0, verbose_name='Number of players who played')),
+                ('sessions', models.PositiveIntegerField(default=0, verbose_name='Number of sessions played')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='play_count_history', to='Leaderboards.Game', verbose_name='Game')),
+                ('league', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='play_count_history', to='Leaderboards.League', verbose_name='League')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='play_counts', to='Leaderboards.Session', verbose_name='Session')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='playcount',
+            index=models.Index(fields=['game', 'league', '-date_time'], name='playcount_as_at_idx'),
+        ),
+        migrations.RunPython(build_play_counts, migrations.RunPython.noop),
+    ]
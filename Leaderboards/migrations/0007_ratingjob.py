@@ -0,0 +1,31 @@
+# Generated by Django 2.1.1 on 2026-10-18 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0006_playcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('since', models.DateTimeField(verbose_name='Rebuild Ratings from')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10, verbose_name='Status')),
+                ('queued', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Time Queued')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Time Started')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Time Finished')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_jobs', to='Leaderboards.Game', verbose_name='Game')),
+            ],
+            options={
+                'ordering': ['-queued'],
+            },
+        ),
+    ]
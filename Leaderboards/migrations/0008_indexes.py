@@ -0,0 +1,55 @@
+# Generated by Django 2.1.1 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    '''
+    Composite indexes for the common query paths, and partial indexes on victories (ranks of 1).
+    
+    Django 2.1 can't declare partial indexes on a model (Index.condition arrived in 2.2) and 
+    so they are created here with SQL (PostgreSQL). 
+    '''
+
+    dependencies = [
+        ('Leaderboards', '0007_ratingjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['game', '-date_time'], name='session_game_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rank',
+            index=models.Index(fields=['session', 'player'], name='rank_session_player_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rank',
+            index=models.Index(fields=['session', 'rank'], name='rank_session_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='performance',
+            index=models.Index(fields=['session', 'player'], name='performance_session_player_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='performance',
+            index=models.Index(fields=['player', 'session'], name='performance_player_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['game', '-trueskill_eta'], name='rating_game_eta_idx'),
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX rank_victory_player_idx ON "Leaderboards_rank" (player_id) WHERE rank = 1;',
+            'DROP INDEX rank_victory_player_idx;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX rank_victory_team_idx ON "Leaderboards_rank" (team_id) WHERE rank = 1;',
+            'DROP INDEX rank_victory_team_idx;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX rank_victory_session_idx ON "Leaderboards_rank" (session_id) WHERE rank = 1;',
+            'DROP INDEX rank_victory_session_idx;',
+        ),
+    ]
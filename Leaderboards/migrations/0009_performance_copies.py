@@ -0,0 +1,61 @@
+# Generated by Django 2.1.1 on 2026-10-18 13:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Q, Subquery
+import django.db.models.deletion
+
+
+def copy_session_results(apps, schema_editor):
+    '''
+    Copies each Performance's session game and time, and the player's rank in it, onto the Performance.
+    '''
+    Session = apps.get_model('Leaderboards', 'Session')
+    Rank = apps.get_model('Leaderboards', 'Rank')
+    Performance = apps.get_model('Leaderboards', 'Performance')
+
+    session = Session.objects.filter(pk=OuterRef('session'))
+    rank = Rank.objects.filter(Q(session=OuterRef('session')) & (Q(player=OuterRef('player')) | Q(team__players=OuterRef('player'))))
+
+    Performance.objects.update(game=Subquery(session.values('game')[:1]),
+                               date_time=Subquery(session.values('date_time')[:1]),
+                               rank=Subquery(rank.values('rank')[:1]))
+    Performance.objects.filter(rank=1).update(is_victory=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0008_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='performance',
+            name='game',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='performances', to='Leaderboards.Game', verbose_name='Game'),
+        ),
+        migrations.AddField(
+            model_name='performance',
+            name='date_time',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Time'),
+        ),
+        migrations.AddField(
+            model_name='performance',
+            name='rank',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Rank'),
+        ),
+        migrations.AddField(
+            model_name='performance',
+            name='is_victory',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Victory'),
+        ),
+        migrations.RunPython(copy_session_results, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='performance',
+            index=models.Index(fields=['player', 'game', '-date_time'], name='performance_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='performance',
+            index=models.Index(fields=['game', '-date_time'], name='performance_game_time_idx'),
+        ),
+    ]
@@ -1,34 +1,42 @@
 # Python packages
 import trueskill
+import multiprocessing
 import html
 import re
+import uuid
 import pytz
 from collections import OrderedDict
+from functools import partial
+from bisect import bisect_left, insort
 from math import isclose
-from scipy.stats import norm
 from datetime import datetime, timedelta
 from builtins import str
 
 # Django packages
-from django.db import models, DataError, IntegrityError #, connection, 
-from django.db.models import Sum, Max, Avg, Count, Q, OuterRef, Subquery
+import django
+from django.db import models, transaction, connection, DataError, IntegrityError
+from django.db.models import Sum, Max, Avg, Count, Q, OuterRef, Subquery, Prefetch
+from django.db.models.functions import Coalesce
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.core.exceptions import NON_FIELD_ERRORS, ValidationError, ObjectDoesNotExist, MultipleObjectsReturned #, PermissionDenied
 from django.core.validators import RegexValidator
+from django.core.cache import caches
 from django.urls import reverse_lazy
 from django.contrib import admin
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.utils.formats import localize
-from django.utils.timezone import localtime
+from django.utils.timezone import localtime, get_current_timezone_name
 from django.utils.safestring import mark_safe
 from django.conf import settings
 
+from cuser.middleware import CuserMiddleware
 from bitfield import BitField
 from bitfield.forms import BitFieldCheckboxSelectMultiple
 from timezone_field import TimeZoneField
 
 from django_model_admin_fields import AdminModel
-from django_model_privacy_mixin import PrivacyMixIn
+from django_model_privacy_mixin import PrivacyMixIn, PrivacyQuerySet
 
 from django_generic_view_extensions.options import flt, osf
 from django_generic_view_extensions.model import field_render, link_target_url, TimeZoneMixIn
@@ -37,6 +45,10 @@ from django_generic_view_extensions.datetime import time_str
 from django_generic_view_extensions.debug import print_debug 
 from _ctypes import ArgumentError
 
+from Leaderboards.bulk import bulk_update
+from Leaderboards.identity import identity_map
+from Leaderboards.analysis import predict
+
 # CoGs Leaderboard Server Data Model
 #
 # The underlying model of data is designed designed to allow:
@@ -53,12 +65,34 @@ from _ctypes import ArgumentError
 MAX_NAME_LENGTH = 200                       # The maximum length of a name in the database, i.e. the char fields for player, game, team names and so on.
 FLOAT_TOLERANCE = 0.0000000000001           # Tolerance used for comparing float values of Trueskill settings and results between two objects when checking integrity.
 NEVER = pytz.utc.localize(datetime.min)     # Used for times to indicat if there is no last play or victory that has a time
+LEADERBOARD_CACHE = "leaderboards"          # The name of the (server wide) cache in settings.CACHES that leaderboard snapshots are stored in
+DATA_VERSION_KEY = "data_version"           # The key in the leaderboard cache of the data version (see data_version)
 
 # Some reserved names for ALL objects in a model (note ID=0 is reserved for the same meaning).
 ALL_LEAGUES = "Global"                      # A reserved key in leaderboard dictionaries used to represent "all leagues" in some requests
 ALL_PLAYERS = "Everyone"                    # A reserved key for leaderboard filtering representing all players
 ALL_GAMES = "All Games"                     # A reserved key for leaderboard filtering representing all games
 
+def data_version() -> datetime:
+    '''
+    Returns the data version, the time at which the data behind leaderboards and lists last 
+    changed (as recorded by bump_data_version). It's a cheap stamp (it costs no database query) 
+    for conditional responses, that is ETag and Last-Modified headers. 
+    
+    If it's not in the cache (evicted, or the cache was cleared) it starts again from now, which 
+    is safe, as it's a version never seen before.
+    '''
+    return caches[LEADERBOARD_CACHE].get_or_set(DATA_VERSION_KEY, timezone.now, None)
+
+def bump_data_version():
+    '''
+    Records a change in the data behind leaderboards and lists (see data_version). 
+    
+    Inside a transaction this happens when it commits, so that no response built from the 
+    data before the change is stamped with the new version.
+    '''
+    transaction.on_commit(lambda: caches[LEADERBOARD_CACHE].set(DATA_VERSION_KEY, timezone.now(), None))
+
 #===============================================================================
 # The support models, that store all the play records that are needed to
 # calculate and maintain TruesKill ratings for players.
@@ -158,24 +192,14 @@ class Rating(RatingModel):
         '''
         Returns the latest performance object that this player played this game in. 
         '''
-        game = self.game
-        player = self.player
-        
-        plays = Session.objects.filter(Q(game=game) & (Q(ranks__player=player) | Q(ranks__team__players=player))).order_by('-date_time')
-
-        return None if (plays is None or plays.count() == 0) else plays[0].performance(player) 
+        return Performance.objects.filter(game=self.game, player=self.player).order_by('-date_time').first()
 
     @property
     def last_winning_performance(self) -> 'Performance':
         '''
         Returns the latest performance object that this player played this game in and won. 
         '''
-        game = self.game
-        player = self.player
-        
-        wins = Session.objects.filter(Q(game=game) & Q(ranks__rank=1) & (Q(ranks__player=player) | Q(ranks__team__players=player))).order_by('-date_time')
-
-        return None if (wins is None or wins.count() == 0) else wins[0].performance(player) 
+        return Performance.objects.filter(game=self.game, player=self.player, is_victory=True).order_by('-date_time').first()
 
     @property
     def link_internal(self) -> str:
@@ -199,7 +223,7 @@ class Rating(RatingModel):
             self.last_victory = session.date_time
         else:
             last_victory = session.previous_victory(performance.player)
-            self.last_victory = None if last_victory is None else last_victory.session.date_time   
+            self.last_victory = NEVER if last_victory is None else last_victory.session.date_time   
         
         self.trueskill_mu = performance.trueskill_mu_after
         self.trueskill_sigma = performance.trueskill_sigma_after
@@ -266,12 +290,19 @@ class Rating(RatingModel):
         '''
         TS = TrueskillSettings()
         
-        try:
-            r = Rating.objects.get(player=player, game=game)
-        except ObjectDoesNotExist:
-            r = Rating.create(player=player, game=game)
-        except MultipleObjectsReturned:
-            raise IntegrityError("Integrity error: more than one rating for {} at {}".format(player.name_nickname, game.name))
+        im = identity_map()
+        r = im.get_rating(player, game) if im else None
+        
+        if r is None:
+            try:
+                r = Rating.objects.get(player=player, game=game)
+            except ObjectDoesNotExist:
+                r = Rating.create(player=player, game=game)
+            except MultipleObjectsReturned:
+                raise IntegrityError("Integrity error: more than one rating for {} at {}".format(player.name_nickname, game.name))
+            
+            if im:
+                r = im.add_rating(r)
         
         if not (isclose(r.trueskill_mu0, TS.mu0, abs_tol=FLOAT_TOLERANCE)  
          and isclose(r.trueskill_sigma0, TS.sigma0, abs_tol=FLOAT_TOLERANCE)
@@ -298,6 +329,9 @@ class Rating(RatingModel):
         '''
         TS = TrueskillSettings()
         
+        # Any cached leaderboards for this game may now be out of date
+        session.game.clear_leaderboard_cache()
+        
         # Check to see if this is the latest play for each player
         # And capture the current rating for each player (which we ill update) 
         is_latest = True
@@ -368,9 +402,223 @@ class Rating(RatingModel):
             if not fs is None: 
                 for s in fs:
                     Rating.update(s, feign_latest=True)
+
+        # The play counts from this session on may have changed too
+        if not feign_latest:
+            PlayCount.update(session.game, since=session.date_time)
     
     @classmethod
-    def rebuild_all(self):
+    def replay(cls, sessions, ratings=None, batch_size=500):
+        '''
+        Replays the provided sessions in chronological order, in memory, and writes
+        the resulting Performance and Rating updates back to the database in bulk.
+
+        This is a much faster equivalent of calling Rating.update(session, feign_latest=True)
+        on each session in turn. Rather than walking the database for each session (previous
+        performances, ranks, teams, ratings etc.) it loads all the Sessions, Ranks, Team
+        memberships and Performances involved up front and carries the rating of each
+        player at each game forward in memory. The calculations are identical to those in
+        Session.build_trueskill_data() and Session.calculate_trueskill_impacts() and so
+        produce identical Performance and Rating values.
+
+        Admin fields are not updated (bulk writes bypass the save() overrides) which is
+        consistent with a rebuild being an administrative task.
+
+        :param sessions: A Session queryset, the sessions to replay.
+        :param ratings: Optionally a dict keyed on (player.pk, game.pk) of the Rating objects
+                        to start from. Any player/game combination not in it starts from a fresh
+                        Rating. Defaults to an empty dict, that is rebuilding from scratch.
+        :param batch_size: The number of objects written per query in bulk writes.
+
+        Returns the dict of (player.pk, game.pk) keyed Ratings after the replay.
+        '''
+        TSS = TrueskillSettings()
+
+        if ratings is None:
+            ratings = {}
+
+        sessions = sessions.order_by('date_time')
+
+        # Load everything we need in a handful of queries.
+        session_list = list(sessions.select_related('game'))
+
+        ranks = {}
+        for r in Rank.objects.filter(session__in=sessions).order_by('session', 'rank').values('session_id', 'rank', 'player_id', 'team_id'):
+            ranks.setdefault(r['session_id'], []).append(r)
+
+        # Team members are listed in the same order that team.players.all() would list them.
+        team_ids = set(r['team_id'] for rs in ranks.values() for r in rs if not r['team_id'] is None)
+        team_players = {}
+        for t in Team.players.through.objects.filter(team_id__in=team_ids).order_by('player__name_nickname').values('team_id', 'player_id'):
+            team_players.setdefault(t['team_id'], []).append(t['player_id'])
+
+        performances = {}
+        for p in Performance.objects.filter(session__in=sessions):
+            performances[(p.session_id, p.player_id)] = p
+
+        # One TrueSkill environment per game
+        environments = {}
+
+        for session in session_list:
+            game = session.game
+
+            if not game.pk in environments:
+                game.clear_leaderboard_cache()
+                environments[game.pk] = trueskill.TrueSkill(mu=TSS.mu0, sigma=TSS.sigma0, beta=game.trueskill_beta, tau=game.trueskill_tau, draw_probability=game.trueskill_p)
+            TS = environments[game.pk]
+
+            # Build the data structures that trueskill.rate needs, as Session.build_trueskill_data() does.
+            RGs = []
+            Weights = {}
+            Ranking = []
+            victors = set()
+            for rank in ranks.get(session.pk, []):
+                if session.team_play:
+                    players = team_players.get(rank['team_id'], [])
+                else:
+                    players = [rank['player_id']]
+
+                RG = {}
+                RGs.append(RG)
+                for player in players:
+                    try:
+                        performance = performances[(session.pk, player)]
+                    except KeyError:
+                        raise IntegrityError("Integrity error: Session has a ranked player without a matching performance. Session id: {}, Player id: {}".format(session.pk, player))
+
+                    rating = ratings.get((player, game.pk), None)
+                    is_victory = rank['rank'] == 1
+
+                    # Initialise the Performance, as Performance.initialise() does.
+                    if rating is None or rating.plays == 0:
+                        performance.play_number = 1
+                        performance.victory_count = 1 if is_victory else 0
+                        performance.trueskill_mu_before = TSS.mu0
+                        performance.trueskill_sigma_before = TSS.sigma0
+                        performance.trueskill_eta_before = 0
+                    else:
+                        performance.play_number = rating.plays + 1
+                        performance.victory_count = rating.victories + 1 if is_victory else rating.victories
+                        performance.trueskill_mu_before = rating.trueskill_mu
+                        performance.trueskill_sigma_before = rating.trueskill_sigma
+                        performance.trueskill_eta_before = rating.trueskill_eta
+
+                    performance.trueskill_mu0 = TSS.mu0
+                    performance.trueskill_sigma0 = TSS.sigma0
+                    performance.trueskill_delta = TSS.delta
+                    performance.trueskill_beta = game.trueskill_beta
+                    performance.trueskill_tau = game.trueskill_tau
+                    performance.trueskill_p = game.trueskill_p
+
+                    # And the copies of the session's game, time and result
+                    performance.game = game
+                    performance.date_time = session.date_time
+                    performance.rank = rank['rank']
+                    performance.is_victory = is_victory
+
+                    if is_victory:
+                        victors.add(player)
+
+                    RG[player] = trueskill.Rating(mu=performance.trueskill_mu_before, sigma=performance.trueskill_sigma_before)
+                    Weights[(len(RGs) - 1, player)] = performance.partial_play_weighting
+                Ranking.append(rank['rank'])
+
+            if not RGs:
+                continue
+
+            NewRGs = TS.rate(RGs, Ranking, Weights, TSS.delta)
+
+            # Record the results, as Session.calculate_trueskill_impacts() and Rating.update() do.
+            for t in NewRGs:
+                for player in t:
+                    performance = performances[(session.pk, player)]
+
+                    mu = t[player].mu
+                    sigma = t[player].sigma
+
+                    performance.trueskill_mu_after = mu
+                    performance.trueskill_sigma_after = sigma
+                    performance.trueskill_eta_after = mu - TSS.mu0 / TSS.sigma0 * sigma  # µ − (µ0 ÷ σ0) × σ
+
+                    previous_trueskill_eta_before = performance.trueskill_eta_before
+                    performance.trueskill_eta_before = performance.trueskill_mu_before - TSS.mu0 / TSS.sigma0 * performance.trueskill_sigma_before
+                    assert isclose(performance.trueskill_eta_before, previous_trueskill_eta_before, abs_tol=FLOAT_TOLERANCE), "Integrity error: suspiscious change in a TrueSkill rating."
+
+                    key = (player, game.pk)
+                    if not key in ratings:
+                        ratings[key] = cls(player_id=player, game_id=game.pk)
+                    r = ratings[key]
+
+                    r.trueskill_mu = mu
+                    r.trueskill_sigma = sigma
+                    r.trueskill_eta = r.trueskill_mu - TSS.mu0 / TSS.sigma0 * r.trueskill_sigma  # µ − (µ0 ÷ σ0) × σ
+
+                    r.trueskill_mu0 = TSS.mu0
+                    r.trueskill_sigma0 = TSS.sigma0
+                    r.trueskill_delta = TSS.delta
+                    r.trueskill_beta = game.trueskill_beta
+                    r.trueskill_tau = game.trueskill_tau
+                    r.trueskill_p = game.trueskill_p
+
+                    r.plays = performance.play_number
+                    r.victories = performance.victory_count
+
+                    r.last_play = session.date_time
+                    if player in victors:
+                        r.last_victory = session.date_time
+
+        # Write it all back in bulk
+        performance_fields = ['game', 'date_time', 'rank', 'is_victory',
+                              'play_number', 'victory_count',
+                              'trueskill_mu_before', 'trueskill_sigma_before', 'trueskill_eta_before',
+                              'trueskill_mu_after', 'trueskill_sigma_after', 'trueskill_eta_after',
+                              'trueskill_mu0', 'trueskill_sigma0', 'trueskill_delta',
+                              'trueskill_beta', 'trueskill_tau', 'trueskill_p']
+        bulk_update(Performance, performances.values(), performance_fields, batch_size=batch_size)
+
+        rating_fields = ['plays', 'victories',
+                         'last_play', 'last_play_tz', 'last_victory', 'last_victory_tz',
+                         'trueskill_mu', 'trueskill_sigma', 'trueskill_eta',
+                         'trueskill_mu0', 'trueskill_sigma0', 'trueskill_delta',
+                         'trueskill_beta', 'trueskill_tau', 'trueskill_p']
+        new_ratings = []
+        old_ratings = []
+        for r in ratings.values():
+            r.update_timezone_fields()
+            if r.pk is None:
+                new_ratings.append(r)
+            else:
+                old_ratings.append(r)
+
+        cls.objects.bulk_create(new_ratings, batch_size=batch_size)
+        bulk_update(cls, old_ratings, rating_fields, batch_size=batch_size)
+
+        return ratings
+
+    @classmethod
+    def rebuild_all(self, processes=1):
+        '''
+        Rebuilds all ratings from scratch by replaying the recorded session history.
+
+        Ratings are independent across games and so the history is replayed one game
+        at a time. Serially, all the games are rebuilt (and the ratings of games with no 
+        sessions deleted) in one transaction.
+        
+        If processes is greater than 1 the games are distributed across a pool of that 
+        many worker processes, each with its own database connection, and each game is 
+        rebuilt in its own transaction. The rebuild as a whole is then not atomic: if a 
+        worker fails, the games rebuilt by the others stay rebuilt, and the ratings of 
+        games with no sessions are deleted in a transaction of their own when all are done.
+        
+        The workers are spawned by running sys.executable, which must be python (not, for
+        example, uwsgi). So only the management command (manage.py rebuild_ratings) uses 
+        them, never a view.
+
+        :param processes: The number of worker processes to use. 1 rebuilds all games serially in this process.
+
+        Returns an OrderedDict keyed on Game, with a (ratings built, duration) tuple as a value, 
+        in descending order of duration.
+        '''
         # Walk through the history of sessions to rebuild all ratings
         # If ever performed keep a record of duration overall and per 
         # session tp permit a cost esitmate should it happen again. 
@@ -382,13 +630,7 @@ class Rating(RatingModel):
         
         # TODO:        
         # Copy the whole Ratings table to a backup table
-        # Erase the current table
-        # Walk through the sessions in chronological order rebuilding it.
-        # Create a single abstract model and have both of your models inherit from there: 
-        # https://docs.djangoproject.com/en/1.10/topics/db/models/#abstract-base-classes
-        
         # Create an entry in Rebuild_Log
-        # Start timer and counter
         # Copy all ratings to Backup_Rating
         
         # Bypass admin field updates for a rating rebuild
@@ -396,19 +638,89 @@ class Rating(RatingModel):
 
         print("Rebuilding all leaderboard ratings...", flush=False)
 
-        self.objects.all().delete()
-        sessions = Session.objects.all().order_by('date_time')
+        # Clear the ordering, or Session's Meta ordering (-date_time) joins the SELECT DISTINCT 
+        # and we get a game per session, not per game.
+        games = list(Session.objects.exclude(game=None).order_by().values_list('game', flat=True).distinct())
+
+        if processes > 1:
+            # Spawn (rather than fork) the workers so that each sets up Django and opens
+            # its own database connection rather than sharing this process's.
+            with multiprocessing.get_context('spawn').Pool(processes, initializer=django.setup) as pool:
+                results = pool.map(rebuild_game_ratings, games)
+
+            # Ratings for games that no longer have any sessions are simply stale
+            with transaction.atomic():
+                self.objects.exclude(game__in=games).delete()
+        else:
+            with transaction.atomic():
+                results = [rebuild_game_ratings(game) for game in games]
+                self.objects.exclude(game__in=games).delete()  # Stale, as above
+
+        game_objects = Game.objects.in_bulk(games)
+        timings = OrderedDict()
+        for game, ratings, duration in sorted(results, key=lambda r: r[2], reverse=True):
+            timings[game_objects[game]] = (ratings, duration)
+
+        print(f"Done. Rebuilt {sum([r[1] for r in results])} ratings for {len(games)} games.", flush=False)
+
+        return timings
+
+    @classmethod
+    def rebuild(cls, game=None, since=None):
+        '''
+        Rebuilds the ratings affected by the sessions of one game and/or played since a given time.
+
+        Each affected rating (that is, for a player and game that appear in those sessions) is 
+        rolled back with Rating.reset to what it was after that player's last session at that game 
+        before since, and then only the sessions in scope are replayed. Ratings with no play before 
+        since are rebuilt from scratch. 
         
-        # Traverse sessions in chronological order (order_by is the time of the session) and update ratings from each session
-        for s in sessions:
-            print(s.pk, s.date_time, s.game.name, flush=False)
-            self.update(s, feign_latest=True)
-            
-        print("Done.", flush=False)
+        Useful after changing the TrueSkill settings of one game, or fixing an old session, when a 
+        full rebuild would be overkill.
 
-        # Stop timer
-        # Update the  entry in Rebuild_Log with performance results
-        pass
+        :param game: A Game, only its sessions are replayed. If None, sessions of all games are.
+        :param since: A datetime, only sessions played at or after this time are replayed. If None, all are. 
+
+        Returns the dict of (player.pk, game.pk) keyed Ratings that were rebuilt.
+        '''
+        sessions = Session.objects.all()
+        if not game is None:
+            sessions = sessions.filter(game=game)
+        if not since is None:
+            sessions = sessions.filter(date_time__gte=since)
+
+        print(f"Rebuilding leaderboard ratings for {game.name if game else ALL_GAMES} since {since if since else 'the beginning'}...", flush=False)
+
+        with transaction.atomic():
+            affected = set(Performance.objects.filter(session__in=sessions).values_list('player', 'session__game').distinct())
+    
+            ratings = {}
+            stale = []
+            for r in cls.objects.filter(game__in=set(a[1] for a in affected), player__in=set(a[0] for a in affected)):
+                key = (r.player_id, r.game_id)
+                if key in affected:
+                    if since is None:
+                        previous = None
+                    else:
+                        previous = Session.objects.filter(Q(game=r.game_id) & Q(date_time__lt=since) & (Q(ranks__player=r.player_id) | Q(ranks__team__players=r.player_id))).order_by('-date_time').first()
+
+                    if previous is None:
+                        stale.append(r.pk)
+                    else:
+                        r.reset(previous)
+                        ratings[key] = r
+    
+            # Ratings with no play before since are rebuilt from scratch
+            cls.objects.filter(pk__in=stale).delete()
+    
+            ratings = cls.replay(sessions, ratings)
+
+            for g in set(a[1] for a in affected):
+                PlayCount.update(g, since)
+
+        print(f"Done. Rebuilt {len(ratings)} ratings from {sessions.count()} sessions.", flush=False)
+
+        return ratings
 
     def check_integrity(self):
         '''
@@ -458,6 +770,28 @@ class Rating(RatingModel):
         # Rating should match the last performance
         # TODO: When do we land here? And how do we sync with self.update? 
 
+    class Meta(RatingModel.Meta):
+        indexes = [models.Index(fields=['game', '-trueskill_eta'], name='rating_game_eta_idx')]
+
+def rebuild_game_ratings(game):
+    '''
+    Rebuilds all the ratings (and play counts) for one game from scratch, in a transaction.
+
+    Lives at module level so that Rating.rebuild_all can dispatch it to worker processes.
+
+    :param game: The primary key of a Game.
+
+    Returns a (game, ratings built, duration) tuple.
+    '''
+    start = timezone.now()
+
+    with transaction.atomic():
+        Rating.objects.filter(game=game).delete()
+        ratings = Rating.replay(Session.objects.filter(game=game))
+        PlayCount.update(game)
+
+    return (game, len(ratings), timezone.now() - start)
+
 class Backup_Rating(RatingModel):
     '''
     A simple container for a complete backup of Rating.
@@ -638,12 +972,25 @@ class Team(AdminModel):
         detail += "</UL>"
         return detail
 
+class PlayerManager(models.Manager.from_queryset(PrivacyQuerySet)):
+    '''
+    The manager of Player.objects. Players are loaded with their user, who owns them (see Player.owner) and 
+    whom privacy rules check, and their privacy is enforced as a batch (see PrivacyQuerySet), so that a list
+    of players costs a few queries not a few per player. 
+    
+    Player.objects.with_privacy(user) enforces privacy for a given user rather than the request's.
+    '''
+    def get_queryset(self):
+        return super().get_queryset().select_related('user')
+
 class Player(PrivacyMixIn, AdminModel):
     '''
     A player who is presumably collecting Ratings on Games and participating in leaderboards in one or more Leagues.
 
     Players can be Registrars, meaning they are permitted to record session results, or Staff meaning they can access the admin site.
     '''
+    objects = PlayerManager()
+
     # Basic Player fields
     name_nickname = models.CharField('Nickname', max_length=MAX_NAME_LENGTH, unique=True)
     name_personal = models.CharField('Personal Name', max_length=MAX_NAME_LENGTH)
@@ -750,16 +1097,14 @@ class Player(PrivacyMixIn, AdminModel):
 
         # Include a GLOBAL league only if this player is in more than one league, else
         # Global is identical to their one league anyhow. 
-        multiple_leagues = self.leagues.all().count() > 1
-        if multiple_leagues:
-            positions[ALL_LEAGUES] = {}
-            for game in played:
-                positions[ALL_LEAGUES][game] = self.leaderboard_position(game)
+        leagues = list(self.leagues.all())
+        if len(leagues) > 1:
+            lps = self.leaderboard_positions_at(played)
+            positions[ALL_LEAGUES] = {game: lps.get(game.pk, None) for game in played}
         
-        for league in self.leagues.all():
-            positions[league] = {}
-            for game in played:
-                positions[league][game] = self.leaderboard_position(game, league)
+        for league in leagues:
+            lps = self.leaderboard_positions_at(played, league)
+            positions[league] = {game: lps.get(game.pk, None) for game in played}
         
         return positions
 
@@ -770,24 +1115,8 @@ class Player(PrivacyMixIn, AdminModel):
         is winning the leaderboard on. 
         '''
         result = {}
-
-        played = [] if self.games_played is None else self.games_played
-        
-        # Include a GLOBAL league only if this player is in more than one league, else
-        # Global is identical to their one league anyhow. 
-        multiple_leagues = self.leagues.all().count() > 1
-        if multiple_leagues:
-            result[ALL_LEAGUES] = []
-            for game in played:
-                if self.is_at_top_of_leaderbard(game):
-                    result[ALL_LEAGUES].append(game)
-        
-        for league in self.leagues.all():
-            result[league] = []
-            for game in played:
-                if self.is_at_top_of_leaderbard(game, league):
-                    result[league].append(game)
-        
+        for league, positions in self.leaderboard_positions.items():
+            result[league] = [game for game, position in positions.items() if position == 1]        
         return result
 
     @property
@@ -830,11 +1159,39 @@ class Player(PrivacyMixIn, AdminModel):
             raise ValueError("Database error: more than one rating for {} at {}".format(self.name_nickname, game.name))
         return r
     
+    def leaderboard_positions_at(self, games, leagues=[]):
+        '''
+        Returns a dictionary keyed on game pk of the position this player holds on the 
+        leaderboards of the specified games (for the specified leagues or all leagues if 
+        none are specified). Games this player has no rating on are missing.
+        
+        Positions are as Game.leaderboard would list them (players with the same eta share 
+        a position), but rather than building each leaderboard, they are all read in one query 
+        that counts, for each of this player's ratings, the ratings at that game with a higher 
+        eta (an index range scan on rating_game_eta_idx).
+        
+        :param games:   A list or queryset of games
+        :param leagues: A league or list of leagues (instances or pks)
+        '''
+        if not isinstance(leagues, (list, tuple, set, models.QuerySet)):
+            leagues = [leagues] if leagues else []
+            
+        mine = Rating.objects.filter(game__in=games, player=self)
+        higher = Rating.objects.filter(game=OuterRef('game'), trueskill_eta__gt=OuterRef('trueskill_eta'))
+        if leagues:
+            # Filter on a subquery rather than a join so that players in more than one
+            # of the leagues are not counted more than once.
+            in_leagues = Player.objects.filter(leagues__in=leagues)
+            mine = mine.filter(player__in=in_leagues)
+            higher = higher.filter(player__in=in_leagues)
+        
+        higher = higher.order_by().values('game').annotate(count=Count('pk')).values('count')
+        ratings = mine.annotate(higher=Coalesce(Subquery(higher, output_field=models.IntegerField()), 0)).order_by().values_list('game', 'higher')
+        
+        return {game: higher + 1 for game, higher in ratings}
+
     def leaderboard_position(self, game, leagues=[]):
-        lb = game.leaderboard(leagues, simple=False)
-        for entry in lb:
-            if entry[1] == self.pk:
-                return entry[0]
+        return self.leaderboard_positions_at([game], leagues).get(game.pk, None)
     
     def is_at_top_of_leaderbard(self, game, leagues=[]):
         return self.leaderboard_position(game, leagues) == 1
@@ -1043,29 +1400,31 @@ class Game(AdminModel):
         :param player: The player or players to consider when finding the last_performances. All players considered if none specified.
         :param asat: Optionally, the last performance as at this date/time
         '''
-        pfilter = Q(session__game=self) 
+        pfilter = Q(game=self) 
         if leagues:
             pfilter &= Q(player__leagues__in=leagues)
         if players:
             pfilter &= Q(player__in=players)
         if not asat is None:
-            pfilter &= Q(session__date_time__lte=asat)
-        
-        # Aggregate for max date_time for a given player. That is we want a Performance 
-        # per player, the one with the greatest date_time (that is before asat if specified) 
-        
-        pfilter = Q(
-            session__date_time=Subquery(
-                (Performance.objects
-                    .filter(Q(player__in=OuterRef('player')) & pfilter)
-                    .values('player')
-                    .annotate(max_date=Max('session__date_time'))
-                    .values('max_date')[:1]
-                ), output_field=models.DateField()
-            )
-        )
-        
-        return Performance.objects.filter(pfilter).order_by('-trueskill_eta_after')
+            pfilter &= Q(date_time__lte=asat)
+        
+        # We want a Performance per player, the one with the greatest date_time (that is 
+        # before asat if specified). On PostgreSQL that is a DISTINCT ON (player) with 
+        # performances ordered latest first for each player. One pass over the performances
+        # of this game (as opposed to a correlated subquery per player) and one row per 
+        # player even if they are in more than one of the leagues. 
+        latest = (Performance.objects
+                    .filter(pfilter)
+                    .order_by('player', '-date_time')
+                    .distinct('player')
+                    .values('pk'))
+        
+        # The Performance carries all we need for a leaderboard as at that time (the play 
+        # number and victory count and via the session, the time of last play) 
+        return (Performance.objects
+                    .filter(pk__in=Subquery(latest))
+                    .select_related('session', 'player')
+                    .order_by('-trueskill_eta_after'))
 
     @property_method
     def session_list(self, leagues=[], asat=None) -> list:
@@ -1139,7 +1498,11 @@ class Game(AdminModel):
             elif not ((isinstance(leagues[l], str) and leagues[l].isdigit()) or isinstance(leagues[l], int)):
                 raise ValueError(f"Unexpected league: {leagues[l]}.")
             
-        if asat is None:
+        # The counts for all leagues or any one league are maintained in PlayCount. Those 
+        # for a number of leagues are not, as the leagues can share players.
+        if len(leagues) <= 1:
+            pc = PlayCount.as_at(self, leagues[0] if leagues else None, asat)
+        elif asat is None:
             if leagues:
                 ratings = Rating.objects.filter(game=self, player__leagues__in=leagues)
             else:
@@ -1242,8 +1605,21 @@ class Game(AdminModel):
             # (descending skill rating). The Rating model ensures this
             ratings = Rating.objects.filter(lb_filter).distinct()        
                  
+        # Fetch the players along with the ratings (Player privacy is still applied as they load)
+        ratings = list(ratings.select_related('player'))
+                 
         print_debug(f"\t\tBuilt ratings queryset.")
         
+        # The league memberships of all the players on the board, in one query.
+        if not simple:
+            player_leagues = {}
+            memberships = (League.players.through.objects
+                            .filter(player__in=[r.player_id for r in ratings])
+                            .order_by('league__name')
+                            .values_list('player', 'league'))
+            for player, league in memberships:
+                player_leagues.setdefault(player, []).append(league)
+        
         # Now build a leaderboard from all the ratings for players (in this league) at this game. 
         lb = []
         for i, r in enumerate(ratings):
@@ -1260,34 +1636,124 @@ class Game(AdminModel):
                 trueskill_eta = r.trueskill_eta_after
                 trueskill_mu = r.trueskill_mu_after
                 trueskill_sigma = r.trueskill_sigma_after
-                plays = r.rating.plays
-                victories = r.rating.victories
-                last_play = r.rating.last_play
+                plays = r.play_number
+                victories = r.victory_count
+                last_play = r.session.date_time
             else:
                 raise ValueError(f"Progamming error in Game.leaderboard().")
             
+            player = r.player
             if simple:
-                lb_entry = (r.player.name(names), trueskill_eta, plays, victories) 
+                lb_entry = (player.name(names), trueskill_eta, plays, victories) 
             else:
                 lb_entry = (i+1,
-                            r.player.pk, 
-                            r.player.BGGname, 
-                            r.player.name('nick'), 
-                            r.player.name('full'),
-                            r.player.name('complete'),
+                            player.pk, 
+                            player.BGGname, 
+                            player.name('nick'), 
+                            player.name('full'),
+                            player.name('complete'),
                             trueskill_eta, 
                             trueskill_mu, 
                             trueskill_sigma, 
                             plays, 
                             victories,                                
                             last_play, 
-                            [l.pk for l in r.player.leagues.all()])
+                            player_leagues.get(player.pk, []))
             lb.append(lb_entry)
 
         print_debug(f"\t\tBuilt leaderboard.")
                             
         return None if len(lb) == 0 else lb
 
+    @property
+    def leaderboard_cache_version(self) -> str:
+        '''
+        The current version of this game's leaderboard history in the (server wide) leaderboard
+        cache. Cached leaderboard snapshots are keyed on it and so invalidating them is just a
+        matter of replacing it (see clear_leaderboard_cache).
+        
+        Versions are random (not counted) so that if one is evicted from the cache, its 
+        replacement is a version never seen before and no stale snapshot comes back with it. 
+        '''
+        return caches[LEADERBOARD_CACHE].get_or_set(f"game_{self.pk}_version", lambda: uuid.uuid4().hex, None)
+
+    def clear_leaderboard_cache(self):
+        '''
+        Invalidates all the cached leaderboard snapshots for this game (and bumps the data
+        version). To be called whenever the game's rating history changes.
+        
+        Inside a transaction this happens when it commits. Else a leaderboard built from the 
+        data before the change, while the transaction runs, is cached under the new version.  
+        '''
+        bump_data_version()
+
+        key = f"game_{self.pk}_version"
+        transaction.on_commit(lambda: caches[LEADERBOARD_CACHE].set(key, uuid.uuid4().hex, None))
+
+    def rating_history(self, players=None):
+        '''
+        A generator of the rating history of this game, for charting the evolution of skill
+        and of leaderboard positions over time.
+
+        Yields (date_time, player pk, mu, sigma, eta, rank) tuples in time order, where rank
+        is the player's position on the leaderboard after that session. There is one for each
+        play of the game and, when players are specified, one for each change in position of
+        those players (as others overtake them or fall behind).
+
+        Rather than building a leaderboard for each session (as leaderboard(asat=...) would)
+        this reads the Performances in one ordered pass and keeps the leaderboard as a sorted
+        list, so the cost is near linear in the length of the history.
+
+        :param players: An optional list of Players (or pks) to report, else all are reported.
+        '''
+        if players:
+            players = {getattr(p, 'pk', p) for p in players}
+
+        performances = (Performance.objects.filter(game=self, player__isnull=False)
+                        .order_by('date_time', 'session')
+                        .values_list('session', 'date_time', 'player', 'trueskill_mu_after', 'trueskill_sigma_after', 'trueskill_eta_after'))
+
+        board = []     # Sorted list of (-eta, player pk), the leaderboard
+        rating = {}    # Current (mu, sigma, eta) of each player, to find them on the board
+        reported = {}  # Last reported rank of each player, when players are specified
+
+        def rank(player):
+            return bisect_left(board, (-rating[player][2], player)) + 1
+
+        def session_rows(session):
+            # Update the board first, so that ranks are those after the session
+            for (s, date_time, player, mu, sigma, eta) in session:
+                if player in rating:
+                    del board[rank(player) - 1]
+                rating[player] = (mu, sigma, eta)
+                insort(board, (-eta, player))
+
+            played = set()
+            for (s, date_time, player, mu, sigma, eta) in session:
+                played.add(player)
+                if not players or player in players:
+                    r = rank(player)
+                    reported[player] = r
+                    yield (date_time, player, mu, sigma, eta, r)
+
+            if players:
+                for player in players - played:
+                    if player in rating:
+                        r = rank(player)
+                        if r != reported.get(player, None):
+                            reported[player] = r
+                            yield (date_time, player) + rating[player] + (r,)
+
+        session = []
+        for row in performances.iterator():
+            if session and row[0] != session[0][0]:
+                yield from session_rows(session)
+                session = []
+            session.append(row)
+
+        if session:
+            yield from session_rows(session)
+
     def rating(self, player, asat=None):
         '''
         Returns the Trueskill rating for this player at the specified game
@@ -1420,10 +1886,55 @@ class Location(AdminModel):
     class Meta(AdminModel.Meta):
         ordering = ['name']
 
+class SessionQuerySet(models.QuerySet):
+    '''
+    The QuerySet of Session.objects, which can load the results of many sessions in bulk.
+    '''
+    def with_results(self):
+        '''
+        Prefetches the results of these sessions, that is their ranks (with player, team and
+        team players) and performances (with player), in a fixed number of queries however 
+        many sessions there are. The Session properties that read results (ranked_players, 
+        players, teams, victors, relationships, trueskill_impacts and the like) then read 
+        them from the prefetched caches and don't query the database again.
+        
+        With an IdentityMap active the Ratings of their players at their games are added to
+        it as they load (in one more query), and the players are shared across sessions.
+        '''
+        return (self.select_related('game', 'league', 'location')
+                    .prefetch_related(Prefetch('ranks', queryset=Rank.objects.select_related('player', 'team').prefetch_related('team__players')),
+                                      Prefetch('performances', queryset=Performance.objects.select_related('player'))))
+
+    def _fetch_all(self):
+        super()._fetch_all()
+        
+        im = identity_map()
+        if im and not getattr(self, '_in_identity_map', False):
+            self._in_identity_map = True
+            sessions = [s for s in self._result_cache if isinstance(s, Session)]
+
+            ratings = set()
+            for session in sessions:
+                results = getattr(session, '_prefetched_objects_cache', {})
+                for rank in results.get('ranks', []):
+                    if not rank.player is None:
+                        rank.player = im.add(rank.player)
+                for performance in results.get('performances', []):
+                    if not performance.player is None:
+                        performance.player = im.add(performance.player)
+                        if im.get_rating(performance.player_id, session.game_id) is None:
+                            ratings.add((performance.player_id, session.game_id))
+
+            if ratings:
+                for r in Rating.objects.filter(player__in={r[0] for r in ratings}, game__in={r[1] for r in ratings}):
+                    im.add_rating(r)
+
 class Session(TimeZoneMixIn, AdminModel):
     '''
     The record, with results (Ranks), of a particular Game being played competitively.
     '''
+    objects = SessionQuerySet.as_manager()
+
     date_time = models.DateTimeField('Time', default=timezone.now)                                          # When the game session was played
     date_time_tz = TimeZoneField('Timezone', default=settings.TIME_ZONE, editable=False)
     
@@ -1505,7 +2016,7 @@ class Session(TimeZoneMixIn, AdminModel):
         in a dictionary.
         '''
         players = OrderedDict()
-        ranks = Rank.objects.filter(session=self.id)
+        ranks = self.ranks.all()
         
         # a quick loop through to check for ties as they will demand some
         # special handling when we collect the list of players into the 
@@ -1555,9 +2066,7 @@ class Session(TimeZoneMixIn, AdminModel):
         
         '''
         players = set()
-        performances = Performance.objects.filter(session=self.pk)
-        
-        for performance in performances:
+        for performance in self.performances.all():
             players.add(performance.player)
                 
         return players
@@ -1576,7 +2085,7 @@ class Session(TimeZoneMixIn, AdminModel):
         '''
         teams = OrderedDict()
         if self.team_play:
-            ranks = Rank.objects.filter(session=self.id)
+            ranks = self.ranks.all()
 
             # a quick loop through to check for ties as they will demand some
             # special handling when we collect the list of players into the 
@@ -1609,7 +2118,7 @@ class Session(TimeZoneMixIn, AdminModel):
         Returns the victors, a list of players or teams. Plural because of possible draws.
         '''
         victors = []
-        ranks = Rank.objects.filter(session=self.id)
+        ranks = self.ranks.all()
 
         for rank in ranks:
             # rank is the rank object, rank.rank is the integer rank (1, 2, 3).
@@ -1689,45 +2198,6 @@ class Session(TimeZoneMixIn, AdminModel):
         code.append("</pre>")
         return "\n".join(code)
 
-    def _get_future_sessions(self, sessions_so_far):
-        '''
-        Internal support for the future_session property, this is a recursive method
-        that takes a list of sessions found so far so as to avoid duplicating any 
-        sessions in the search.
-        
-        sessions_so_far: A list of sessions found so far, that is augmented  and returned
-        '''
-        # We want session in the future only of course
-        dfilter = Q(date_time__gt=self.date_time)
-        
-        # We want only sessions for this sessions game
-        gfilter = Q(game=self.game)
-        
-        # For each player we find all future sessions playing this game
-        pfilter = Q(ranks__player__in=self.players) | Q(ranks__team__players__in=self.players)
-            
-        # Combine the filters
-        filters = dfilter & gfilter & pfilter
-        
-        # Get the list of PKs to exclude
-        exclude_pks = list(map(lambda s: s.pk, sessions_so_far))
-            
-        new_future_sessions = Session.objects.filter(filters).exclude(pk__in=exclude_pks).distinct().order_by('date_time')
-        
-        if new_future_sessions.count() > 0:
-            # augment sessions_so far
-            sessions_so_far += list(new_future_sessions)
-              
-            # The new future sessions may involve new players which 
-            # requires that we scan them for new future sessions too 
-            for session in new_future_sessions:
-                new_sessions_so_far = session._get_future_sessions(sessions_so_far)
-                
-                if len(new_sessions_so_far) > len(sessions_so_far):
-                    sessions_so_far = sorted(new_sessions_so_far, key=lambda s: s.date_time)
-
-        return sessions_so_far                
-        
     @property
     def future_sessions(self) -> list:
         '''
@@ -1737,7 +2207,27 @@ class Session(TimeZoneMixIn, AdminModel):
         Namely every session that needs to be re-evaluated because this one has been inserted before
         it, or edited in some way. 
         '''
-        return self._get_future_sessions([])
+        # A rating only ever propagates forward in time. So we can find the closure of 
+        # impacted sessions by sweeping through all the later sessions of this game in 
+        # chronological order, collecting each one that involves an impacted player, and 
+        # adding its players to the impacted set as we go.
+        #
+        # The players of each later session, are all loaded in one query. A rank 
+        # has a player in individual play and a team (with players) in team play.
+        later_sessions = OrderedDict()
+        ranks = Rank.objects.filter(session__game=self.game, session__date_time__gt=self.date_time).order_by('session__date_time')
+        for session, player, team_player in ranks.values_list('session', 'player', 'team__players'):
+            later_sessions.setdefault(session, set()).update(p for p in (player, team_player) if not p is None)
+        
+        impacted_players = set(self.performances.values_list('player', flat=True))
+        
+        future_sessions = []
+        for session, players in later_sessions.items():
+            if players & impacted_players:
+                future_sessions.append(session)
+                impacted_players |= players
+
+        return list(Session.objects.filter(pk__in=future_sessions).order_by('date_time'))
 
     @property
     def link_internal(self) -> str:
@@ -1754,6 +2244,56 @@ class Session(TimeZoneMixIn, AdminModel):
         rankers = sorted(self.ranks.all(), key=lambda r: r.rank)
         return rankers
 
+    @classmethod
+    def predictions(cls, sessions, after=False) -> dict:
+        '''
+        Returns the TrueSkill predictions for a number of sessions, computed together in one
+        vectorised pass (see Leaderboards.analysis.predict).
+        
+        A dict keyed on session pk with a tuple (ranks, performances, probability, accuracy):
+            ranks:        the Rank objects of the session in predicted order
+            performances: the expected performance (mu, sigma) of each of those ranks
+            probability:  the probability associated with that prediction
+            accuracy:     a number from 0 to 1 being the proportion of ranker relationships 
+                          the prediction got right
+        
+        Sessions are best loaded with_results() else each costs a few queries.
+        
+        :param sessions: An iterable of sessions
+        :param after: if true predicts with ratings after the session. Else before. 
+        '''
+        sessions = list(sessions)
+        
+        session_ranks = []
+        group, ranker, rank, mu, sigma, weight, tau, beta = [], [], [], [], [], [], [], []
+        for g, session in enumerate(sessions):
+            ranks = list(session.ranks.all())
+            session_ranks.append(ranks)
+            performances = {p.player_id: p for p in session.performances.all()}
+            for r, ranking in enumerate(ranks):
+                for player in ranking.players:
+                    performance = performances[player.pk]
+                    group.append(g)
+                    ranker.append(r)
+                    rank.append(ranking.rank)
+                    mu.append(performance.trueskill_mu_after if after else performance.trueskill_mu_before)
+                    sigma.append(performance.trueskill_sigma_after if after else performance.trueskill_sigma_before)
+                    weight.append(performance.partial_play_weighting)
+                    tau.append(performance.trueskill_tau)
+                    beta.append(performance.trueskill_beta)
+        
+        (order, MU, SIGMA, probability, accuracy) = predict(group, ranker, rank, mu, sigma, weight, tau, beta, trueskill.DELTA)
+        
+        predictions = {}
+        for g, session in enumerate(sessions):
+            ranks = session_ranks[g]
+            predicted = order[g][:len(ranks)]
+            predictions[session.pk] = ([ranks[r] for r in predicted],
+                                       [(float(MU[g][r]), float(SIGMA[g][r])) for r in predicted],
+                                       float(probability[g]),
+                                       float(accuracy[g]))
+        return predictions
+
     @property
     def predicted_ranking(self) -> tuple:
         '''
@@ -1761,25 +2301,9 @@ class Session(TimeZoneMixIn, AdminModel):
         element in a tuple.
         
         The second is the probability associated with that prediction.
-        
-        TODO: This should really be in the trueskill package
         '''
-        # Rank.performance returns a (mu, sigma) tuple for the ranker
-        # TrueSkill modeled performance. And the expected ranking is
-        # ranking by expected performance which is mu of the performance.
-        rankers = sorted(self.ranks.all(), key=lambda r: r.performance[0], reverse=True)
-        
-        # TODO: This should be in the trueskill package
-        # See my doc "Understanding Trueskill" for the math on this
-        prob = 1
-        for r in range(len(rankers)-1): 
-            perf1 = rankers[r].performance
-            perf2 = rankers[r+1].performance
-            x = (perf1[0] - perf2[0] - trueskill.DELTA) / (perf1[1]**2 + perf2[1]**2)**0.5
-            p = norm.cdf(x)
-            prob *= p            
-        
-        return (rankers, prob)
+        (ranks, performances, probability, accuracy) = Session.predictions([self])[self.pk]
+        return (ranks, probability)
 
     @property
     def predicted_ranking_after(self) -> tuple:
@@ -1788,25 +2312,9 @@ class Session(TimeZoneMixIn, AdminModel):
         element in a tuple.
         
         The second is the probability associated with that prediction.
-        
-        TODO: This should really be in the trueskill package
         '''
-        # Ranks.performance returns a (mu, sigma) tuple for the rankers
-        # TrueSkill modeled performance. And the expected ranking is
-        # ranking by expected performance which is mu of the performance.
-        rankers = sorted(self.ranks.all(), key=lambda r: r.performance_after[0], reverse=True)
-        
-        # TODO: This should be in the trueskill package
-        # See my doc "Understanding Trueskill" for the math on this
-        prob = 1
-        for r in range(len(rankers)-1):
-            perf1 = rankers[r].performance
-            perf2 = rankers[r+1].performance
-            x = (perf1[0] - perf2[0] - trueskill.DELTA) / (perf1[1]**2 + perf2[1]**2)**0.5
-            p = norm.cdf(x)
-            prob *= p            
-        
-        return (rankers, prob)
+        (ranks, performances, probability, accuracy) = Session.predictions([self], after=True)[self.pk]
+        return (ranks, probability)
                             
     @property
     def relationships(self) -> set:
@@ -1863,33 +2371,8 @@ class Session(TimeZoneMixIn, AdminModel):
         provided. A number from 0 to 1. 0 being got it all wrong, 1 being got 
         it all right. 
         '''
-        def dictify(ordered_ranks):
-            '''
-            Give a list of ranks in any order will return a dictionary keyed on ranker with
-            a new nominal rank based on that order. Thus by ordering a list of ranke a new
-            ordering can be determined on basis of the list in that order.
-            '''
-            rank_dict = {}
-            r = 1
-            for rank in ordered_ranks:
-                rank_dict[rank.ranker] = r
-                r += 1
-            return rank_dict   
-        
-        actual_rank = dictify(self.actual_ranking)
-        predicted_rank = dictify(self.predicted_ranking_after[0]) if after else dictify(self.predicted_ranking[0])
-        total = 0
-        right = 0
-        for relationship in self.relationships:
-            ranker1 = relationship[0]
-            ranker2 = relationship[1]
-            real_result = actual_rank[ranker1] < actual_rank[ranker2]
-            pred_result = predicted_rank[ranker1] < predicted_rank[ranker2]
-            total += 1
-            if pred_result == real_result:
-                right +=1
-                                                               
-        return right/total if total > 0 else 0    
+        (ranks, performances, probability, accuracy) = Session.predictions([self], after)[self.pk]
+        return accuracy
 
     @property
     def prediction_quality(self) -> int:
@@ -2001,7 +2484,8 @@ class Session(TimeZoneMixIn, AdminModel):
         
         :param ordered_ranks:           Rank objects in order we'd like them listed. 
         :param use_rank:                Use Rank.rank to permit ties, else use the row number
-        :param expected_performance:    Name of Rank method that returns a Predicted Performance summary
+        :param expected_performance:    Name of Rank method that returns a Predicted Performance summary,
+                                        or a list of those summaries in the order of ordered_ranks
         :param name_style:              The style in which to render names
         :param ol_style:                A style to apply to the OL if any
         '''
@@ -2014,7 +2498,7 @@ class Session(TimeZoneMixIn, AdminModel):
 
         rankers = OrderedDict()
         row = 1
-        for r in ordered_ranks:
+        for i, r in enumerate(ordered_ranks):
             if self.team_play:
                 # Teams we can render with the default format
                 # TODO: Check this, they should also respect 
@@ -2039,7 +2523,10 @@ class Session(TimeZoneMixIn, AdminModel):
             # Add expected performance to the ranker string if requested                
             eperf = ""
             if not expected_performance is None:
-                perf = getattr(r, expected_performance, None) # (mu, sigma)
+                if isinstance(expected_performance, str):
+                    perf = getattr(r, expected_performance, None) # (mu, sigma)
+                else:
+                    perf = expected_performance[i] # (mu, sigma)
                 if not perf is None:
                     eperf = perf[0] # mu
                     
@@ -2091,7 +2578,7 @@ class Session(TimeZoneMixIn, AdminModel):
         
         return (detail, data)         
 
-    def leaderboard_analysis(self, name_style="flexi"):
+    def leaderboard_analysis(self, name_style="flexi", prediction=None):
         '''
         Returns a HTML header that can be used on leaderboards.
 
@@ -2113,19 +2600,22 @@ class Session(TimeZoneMixIn, AdminModel):
         3) A quality measure of that prediction
                 
         :param name_style: Must be supplied
+        :param prediction: This session's entry in Session.predictions(), if it was computed in bulk 
         '''
-        (ordered_ranks, confidence) = self.predicted_ranking
+        if prediction is None:
+            prediction = Session.predictions([self])[self.pk]
+        (ordered_ranks, performances, confidence, accuracy) = prediction
         
         tip_sure = "<span class='tooltiptext' style='width: 500%;'>Given the expected performance of players, the probability that this predicted ranking would happen.</span>"
         tip_accu = "<span class='tooltiptext' style='width: 300%;'>Compared with the actual result, what percentage of relationships panned out as expected performances predicted.</span>"
-        detail = f"Predicted ranking (<div class='tooltip'>{confidence:.0%} sure{tip_sure}</div>, <div class='tooltip'>{self.prediction_quality:.0%} accurate){tip_accu}</div>: <br><br>"
-        (ol, data) = self._html_rankers_ol(ordered_ranks, False, "performance", name_style, "margin-left: 8ch;")        
+        detail = f"Predicted ranking (<div class='tooltip'>{confidence:.0%} sure{tip_sure}</div>, <div class='tooltip'>{accuracy:.0%} accurate){tip_accu}</div>: <br><br>"
+        (ol, data) = self._html_rankers_ol(ordered_ranks, False, performances, name_style, "margin-left: 8ch;")        
         
         detail += ol
         
         return (mark_safe(detail), data)
     
-    def leaderboard_analysis_after(self, name_style="flexi"):
+    def leaderboard_analysis_after(self, name_style="flexi", prediction=None):
         '''
         Returns a HTML header that can be used on leaderboards.
 
@@ -2147,21 +2637,33 @@ class Session(TimeZoneMixIn, AdminModel):
         3) A quality measure of that prediction
                 
         :param name_style: Must be supplied
+        :param prediction: This session's entry in Session.predictions(after=True), if it was computed in bulk 
         '''
-        (ordered_ranks, confidence) = self.predicted_ranking_after
+        if prediction is None:
+            prediction = Session.predictions([self], after=True)[self.pk]
+        (ordered_ranks, performances, confidence, accuracy) = prediction
 
         tip_sure = "<span class='tooltiptext' style='width: 500%;'>Given the expected performance of players, the probability that this predicted ranking would happen.</span>"
         tip_accu = "<span class='tooltiptext' style='width: 300%;'>Compared with the actual result, what percentage of relationships panned out as expected performances predicted.</span>"
-        detail = f"Predicted ranking (<div class='tooltip'>{confidence:.0%} sure{tip_sure}</div>, <div class='tooltip'>{self.prediction_quality_after:.0%} accurate){tip_accu}</div>: <br><br>"
-        (ol, data) = self._html_rankers_ol(ordered_ranks, False, "performance_after", name_style, "margin-left: 8ch;")
+        detail = f"Predicted ranking (<div class='tooltip'>{confidence:.0%} sure{tip_sure}</div>, <div class='tooltip'>{accuracy:.0%} accurate){tip_accu}</div>: <br><br>"
+        (ol, data) = self._html_rankers_ol(ordered_ranks, False, performances, name_style, "margin-left: 8ch;")
         detail += ol
         
         return (mark_safe(detail), data)                  
 
-    def leaderboard_snapshot(self):
+    def leaderboard_snapshot(self, use_cache=True):
         '''
         Prepares a leaderboard snapshot for passing to a view for rendering. 
         
+        Snapshots are expensive to build and are cached server wide, keyed on the session
+        and the version of its game's rating history (so that they are invalidated whenever
+        that history changes). use_cache=False builds one from scratch regardless.
+        
+        Player names in a snapshot are subject to Player privacy settings and so depend on 
+        who is viewing them. All anonymous visitors share cached snapshots, while logged in 
+        users each have their own. Snapshot times are localised, so the cache is partitioned
+        by the active timezone as well.
+        
         A snapshot is defined by a tuple with these entries in order:
         
         session.pk, 
@@ -2174,6 +2676,15 @@ class Session(TimeZoneMixIn, AdminModel):
         session.leaderboard_analysis_after(), 
         game.leaderboard()
         '''        
+        if use_cache:
+            cache = caches[LEADERBOARD_CACHE]
+            key = self.leaderboard_cache_key()
+            snapshot = cache.get(key)
+            if snapshot is None:
+                snapshot = self.leaderboard_snapshot(use_cache=False)
+                cache.set(key, snapshot, None)
+            return snapshot
+        
         # Get the leaderboard asat the time of this board.
         # We request an annotated version which supplies us with the information 
         # needed for player filtering and renderig, the leaderboard returned is 
@@ -2196,6 +2707,173 @@ class Session(TimeZoneMixIn, AdminModel):
                     lb)
         
         return snapshot
+
+    def leaderboard_cache_key(self, version=None) -> str:
+        '''
+        The key this session's leaderboard snapshot is cached under for the current viewer 
+        and timezone (see leaderboard_snapshot). 
+        
+        :param version: The game's leaderboard_cache_version if the caller already has it 
+        '''
+        if version is None:
+            version = self.game.leaderboard_cache_version
+        user = CuserMiddleware.get_user()
+        viewer = user.pk if getattr(user, 'is_authenticated', False) else 0
+        return f"snapshot_{self.pk}_{version}_{viewer}_{get_current_timezone_name()}"
+
+    @classmethod
+    def leaderboard_snapshots(cls, sessions, leagues=[]) -> tuple:
+        '''
+        Bulk equivalent of leaderboard_snapshot() and game.play_counts() for many sessions, 
+        possibly of many games, as needed to render a page of leaderboards.
+        
+        Rather than a handful of queries per session this replays the performance history of 
+        all the games involved in one pass (from a single query), noting the leaderboard and 
+        play counts as they stand after each of the requested sessions. Player metadata is 
+        fetched in two more queries. Snapshots already in the server wide cache are used as 
+        they are and those built are cached. 
+        
+        Returns a tuple of two dicts, keyed on session pk:
+            snapshots:  the leaderboard_snapshot() of each session
+            counts:     the game.play_counts(leagues, asat=session.date_time) of each session
+        
+        :param sessions: Session objects (with their game) or a queryset of them
+        :param leagues:  The league or leagues to constrain the counts to, as per play_counts 
+        '''
+        sessions = list(sessions)
+
+        # If a single league was provided make a list with one entry.
+        if not isinstance(leagues, list):
+            if leagues:
+                leagues = [leagues]
+            else:
+                leagues = []
+
+        # We can accept leagues as League instances or PKs but want a set of PKs to test against.
+        league_pks = set()
+        for l in leagues:
+            if isinstance(l, League):
+                league_pks.add(l.pk)
+            elif (isinstance(l, str) and l.isdigit()) or isinstance(l, int):
+                league_pks.add(int(l))
+            else:
+                raise ValueError(f"Unexpected league: {l}.")
+
+        if not sessions:
+            return {}, {}
+
+        # Whatever snapshots we have in the cache already
+        cache = caches[LEADERBOARD_CACHE]
+        versions = {}
+        keys = {}
+        for s in sessions:
+            if not s.game_id in versions:
+                versions[s.game_id] = s.game.leaderboard_cache_version
+            keys[s.pk] = s.leaderboard_cache_key(versions[s.game_id])
+        cached = cache.get_many(list(keys.values()))
+        snapshots = {pk: cached[key] for pk, key in keys.items() if key in cached}
+        
+        # The performance history of all the games up to the last of the sessions, in time order 
+        # (less those of deleted players, who have no rating and so are not on leaderboards) 
+        history = (Performance.objects
+                    .filter(game__in=list(versions), date_time__lte=max(s.date_time for s in sessions), player__isnull=False)
+                    .order_by('date_time', 'session')
+                    .values_list('game', 'session', 'date_time', 'session__league', 'player',
+                                 'play_number', 'victory_count',
+                                 'trueskill_eta_after', 'trueskill_mu_after', 'trueskill_sigma_after'))
+
+        history_by_game = {}
+        for row in history:
+            history_by_game.setdefault(row[0], []).append(row)
+
+        # All the players involved and their league memberships (Player privacy is applied as they load)
+        player_pks = {row[4] for row in history}
+        players = Player.objects.in_bulk(list(player_pks))
+        player_leagues = {}
+        memberships = (League.players.through.objects
+                        .filter(player__in=player_pks)
+                        .order_by('league__name')
+                        .values_list('player', 'league'))
+        for player, league in memberships:
+            player_leagues.setdefault(player, []).append(league)
+
+        def play_counts(latest, sessions):
+            plays = [p[3] for p in latest.values()]
+            return {'total': sum(plays),
+                    'max': max(plays, default=0),
+                    'average': sum(plays) / len(plays) if plays else 0,
+                    'players': len(plays),
+                    'sessions': len(sessions)}
+
+        # The sessions we need to build snapshots for, with their results (for the headers and analyses)
+        results = {s.pk: s for s in Session.objects.filter(pk__in=[s.pk for s in sessions if not s.pk in snapshots]).with_results()}
+        
+        # And their analyses, computed together 
+        predictions = Session.predictions(results.values())
+        predictions_after = Session.predictions(results.values(), after=True)
+
+        counts = {}
+        built = {}
+        for game, rows in history_by_game.items():
+            # Replay the game's history noting the state after each requested session 
+            latest = {}             # player pk: (eta, mu, sigma, plays, victories, last_play)
+            league_latest = {}      # the same but only for players in the leagues 
+            played = set()          # sessions played
+            league_played = set()   # sessions played in the leagues
+            session_players = {}    # session pk: [player pks]
+            
+            boards = sorted((s for s in sessions if s.game_id == game), key=lambda s: s.date_time)
+            r = 0
+            for board in boards:
+                while r < len(rows) and rows[r][2] <= board.date_time:
+                    _, session, _, league, player, plays, victories, eta, mu, sigma = rows[r]
+                    state = (eta, mu, sigma, plays, victories, rows[r][2])
+                    latest[player] = state
+                    played.add(session)
+                    session_players.setdefault(session, []).append(player)
+                    if league_pks:
+                        if league_pks.intersection(player_leagues.get(player, [])):
+                            league_latest[player] = state
+                        if league in league_pks:
+                            league_played.add(session)
+                    r += 1
+
+                full_counts = play_counts(latest, played) 
+                counts[board.pk] = play_counts(league_latest, league_played) if league_pks else full_counts
+
+                if board.pk in snapshots:
+                    continue
+
+                board = results.get(board.pk, board)
+
+                # The leaderboard as at this session, in the form of Game.leaderboard(asat, simple=False)
+                lb = []
+                for i, (pk, state) in enumerate(sorted(latest.items(), key=lambda item: -item[1][0])):
+                    player = players[pk]
+                    eta, mu, sigma, plays, victories, last_play = state
+                    lb.append((i+1,
+                               player.pk,
+                               player.BGGname,
+                               player.name('nick'),
+                               player.name('full'),
+                               player.name('complete'),
+                               eta, mu, sigma,
+                               plays, victories, last_play,
+                               player_leagues.get(player.pk, [])))
+
+                built[keys[board.pk]] = snapshots[board.pk] = (board.pk, 
+                                                               localize(localtime(board.date_time)),
+                                                               full_counts['total'], 
+                                                               full_counts['sessions'], 
+                                                               session_players.get(board.pk, []), 
+                                                               board.leaderboard_header(), 
+                                                               board.leaderboard_analysis(prediction=predictions.get(board.pk, None)), 
+                                                               board.leaderboard_analysis_after(prediction=predictions_after.get(board.pk, None)), 
+                                                               lb if lb else None)
+
+        cache.set_many(built, None)
+
+        return snapshots, counts
    
     def previous_sessions(self, player):
         '''
@@ -2207,7 +2885,7 @@ class Session(TimeZoneMixIn, AdminModel):
         
         # Get the list of previous sessions including the current session! So the list must be at least length 1 (the current session).
         # The list is sorted in descending date_time order, so that the first entry is the current sessions.
-        prev_sessions = Session.objects.filter(Q(date_time__lte=time_limit) & Q(game=self.game) & (Q(ranks__player=player) | Q(ranks__team__players=player))).order_by('-date_time')
+        prev_sessions = Session.objects.filter(game=self.game, date_time__lte=time_limit, performances__player=player).order_by('-date_time')
 
         return prev_sessions
 
@@ -2239,7 +2917,7 @@ class Session(TimeZoneMixIn, AdminModel):
         
         # Get the list of previous sessions including the current session! So the list must be at least length 1 (the current session).
         # The list is sorted in descening date_time order, so that the first entry is the current sessions.
-        prev_sessions = Session.objects.filter(Q(date_time__lte=time_limit) & Q(game=self.game) & Q(ranks__rank=1) & (Q(ranks__player=player) | Q(ranks__team__players=player))).order_by('-date_time')
+        prev_sessions = Session.objects.filter(game=self.game, date_time__lte=time_limit, performances__player=player, performances__is_victory=True).order_by('-date_time')
 
         return prev_sessions
 
@@ -2247,7 +2925,13 @@ class Session(TimeZoneMixIn, AdminModel):
         '''
         Returns the Rank object for the nominated player in this session
         '''
-        if self.team_play:
+        # Use the prefetched ranks if we have them (see SessionQuerySet.with_results)
+        if 'ranks' in getattr(self, '_prefetched_objects_cache', {}):
+            if self.team_play:
+                ranks = [r for r in self.ranks.all() if not r.team is None and getattr(player, 'pk', player) in [p.pk for p in r.team.players.all()]]
+            else:
+                ranks = [r for r in self.ranks.all() if r.player_id == getattr(player, 'pk', player)]
+        elif self.team_play:
             ranks = self.ranks.filter(team__players=player)
         else:
             ranks = self.ranks.filter(player=player)
@@ -2263,10 +2947,40 @@ class Session(TimeZoneMixIn, AdminModel):
         Returns the Performance object for the nominated player in this session
         '''
         assert player != None, f"Coding error: Cannot fetch the performance of 'no player'. Session pk: {self.pk}"
-        performances = self.performances.filter(player=player)
-        assert len(performances) == 1, "Database error: {} Performance objects in database for session={}, player={} sql={}".format(len(performances), self.pk, player.pk, performances.query)
+        
+        # Use the prefetched performances if we have them (see SessionQuerySet.with_results)
+        if 'performances' in getattr(self, '_prefetched_objects_cache', {}):
+            performances = [p for p in self.performances.all() if p.player_id == getattr(player, 'pk', player)]
+        else:
+            performances = self.performances.filter(player=player)
+        assert len(performances) == 1, "Database error: {} Performance objects in database for session={}, player={} sql={}".format(len(performances), self.pk, player.pk, getattr(performances, 'query', None))
         return performances[0]
 
+    def update_performances(self):
+        '''
+        Copies this session's game, time and results onto its Performances (see Performance.game).
+        
+        Needed when a session is saved, as the ratings (which would update them too) are updated
+        later. 
+        '''
+        ranks = {}
+        for rank in self.ranks.all():
+            if self.team_play:
+                if not rank.team is None:
+                    for player in rank.team.players.all():
+                        ranks[player.pk] = rank.rank
+            else:
+                ranks[rank.player_id] = rank.rank
+        
+        performances = list(self.performances.all())
+        for performance in performances:
+            performance.game = self.game
+            performance.date_time = self.date_time
+            performance.rank = ranks.get(performance.player_id, None)
+            performance.is_victory = performance.rank == 1
+            
+        bulk_update(Performance, performances, ['game', 'date_time', 'rank', 'is_victory'])
+
     def previous_performance(self, player):
         '''
         Returns the previous Performance object for the nominate player in the game of this session
@@ -2281,10 +2995,8 @@ class Session(TimeZoneMixIn, AdminModel):
         # TODO: Test thoroughly. Tricky Query. 
         time_limit = self.date_time
         
-        # Get the list of previous sessions including the current session! So the list must be at least length 1 (the current session).
-        # The list is sorted in descening date_time order, so that the first entry is the current sessions.
-        prev_victory = Session.objects.filter(Q(date_time__lte=time_limit) & Q(game=self.game) & Q(ranks__rank=1) & (Q(ranks__player=player) | Q(ranks__team__players=player))).order_by('-date_time')
-        return None if (prev_victory is None or prev_victory.count() == 0) else prev_victory[0].performance(player)
+        # The latest victory including the current session (so it may be this one). 
+        return Performance.objects.filter(game=self.game, player=player, date_time__lte=time_limit, is_victory=True).order_by('-date_time').first()
               
     def build_trueskill_data(self, save=False):
         '''Builds a the data structures needed by trueskill.rate
@@ -2657,6 +3369,7 @@ class Session(TimeZoneMixIn, AdminModel):
 
     class Meta(AdminModel.Meta):
         ordering = ['-date_time']
+        indexes = [models.Index(fields=['game', '-date_time'], name='session_game_time_idx')]
 
 class Rank(AdminModel):
     '''
@@ -2739,7 +3452,7 @@ class Rank(AdminModel):
         Returns a list of one one or more players.
         '''
         # TODO should be a set not a list really. No order.
-        session = Session.objects.get(id=self.session.id)
+        session = self.session
         if session.team_play:
             if self.team is None:
                 raise ValueError("Rank '{}' is associated with a team play session but has no team.".format(self.id))
@@ -2759,7 +3472,7 @@ class Rank(AdminModel):
         Returns True or False, indicating whether or not more than one rank object on this session has the same rank
         (i.e. if this rank object is one part of a recorded draw).
         '''       
-        ranks = Rank.objects.filter(session=self.session, rank=self.rank)
+        ranks = [r for r in self.session.ranks.all() if r.rank == self.rank]
         return len(ranks) > 1
 
     @property
@@ -2858,6 +3571,8 @@ class Rank(AdminModel):
 
     class Meta(AdminModel.Meta):
         ordering = ['rank']
+        indexes = [models.Index(fields=['session', 'player'], name='rank_session_player_idx'),
+                   models.Index(fields=['session', 'rank'], name='rank_session_rank_idx')]
 
 class Performance(AdminModel):
     '''
@@ -2907,53 +3622,45 @@ class Performance(AdminModel):
     trueskill_tau = models.FloatField('TrueSkill Dynamics Factor (τ)', default=trueskill.TAU, editable=False)
     trueskill_p = models.FloatField('TrueSkill Draw Probability (p)', default=trueskill.DRAW_PROBABILITY, editable=False)
 
-    @property
-    def game(self) -> Game:
-        '''
-        The game this performance relates to
-        '''
-        return self.session.game
-
-    @property
-    def date_time(self) -> datetime:
-        '''
-        The game this performance relates to
-        '''
-        return self.session.date_time
-
-    @property
-    def rank(self) -> int:
-        '''
-        The rank of this player in this session. Most certainly a component of a player's
-        performance, but not stored in the Performance model because it is associated either
-        with a player or whole team depending on the play mode (Individual or Team). So this
-        property fetches the rank from the Rank model where it's stored.
-        '''
-        team_play = self.session.team_play
-        if team_play:
-            ranks = Rank.objects.filter(session=self.session.id)
-            for rank in ranks:
-                if not rank.team is None:  # Play it safe in case of database integrity issue
-                    team = Team.objects.get(pk=rank.team.id)
-                    players = team.players.all()
-                    if self.player in players:
-                        return rank.rank
+    # Copies of the session's game and time and of this player's rank in it (which is recorded 
+    # against the player or their team depending on the play mode, Individual or Team), so that
+    # a player's history at a game can be read from this table alone, without joining Session, 
+    # Rank and Team. Kept in sync by Performance.save(), Session.update_performances() (whenever 
+    # a Session, Rank or Team membership changes, see sync_session_performances), 
+    # Performance.initialise() and Rating.replay().
+    game = models.ForeignKey(Game, verbose_name='Game', related_name='performances', null=True, editable=False, on_delete=models.SET_NULL)
+    date_time = models.DateTimeField('Time', null=True, editable=False)
+    rank = models.PositiveIntegerField('Rank', null=True, editable=False)
+    is_victory = models.BooleanField('Victory', default=False, editable=False)
+
+    def save(self, *args, **kwargs):
+        '''
+        Copies the session's game and time, and this player's rank in it, before saving (see 
+        Performance.game), so that a Performance saved on its own is in sync too.
+        '''
+        self.game_id = self.session.game_id
+        self.date_time = self.session.date_time
+        if self.player_id is None:
+            self.rank = None
         else:
-            rank = Rank.objects.get(session=self.session.id, player=self.player.id).rank
-            return rank
-
-    @property
-    def is_victory(self) -> bool:
-        '''
-        True if this performance records a victory for the player, False if not.
-        '''
-        return self.rank == 1
+            self.rank = (Rank.objects
+                         .filter(Q(session=self.session_id) & (Q(player=self.player_id) | Q(team__players=self.player_id)))
+                         .values_list('rank', flat=True)
+                         .first())
+        self.is_victory = self.rank == 1
+        super().save(*args, **kwargs)
 
     @property
     def rating(self) -> Rating:
         '''
         Returns the rating object associated with this performance. That is for the same player/game combo. 
         '''
+        im = identity_map()
+        if im:
+            r = im.get_rating(self.player_id, self.session.game_id)
+            if not r is None:
+                return r
+            
         try:
             r = Rating.objects.get(player=self.player, game=self.session.game)
         except ObjectDoesNotExist:
@@ -2993,6 +3700,11 @@ class Performance(AdminModel):
 
         previous = self.session.previous_performance(self.player)
         
+        self.game = self.session.game
+        self.date_time = self.session.date_time
+        self.rank = self.session.rank(self.player).rank
+        self.is_victory = self.rank == 1
+        
         if previous is None:
             TSS = TrueskillSettings()
             self.play_number = 1
@@ -3056,7 +3768,14 @@ class Performance(AdminModel):
             assert isclose(performance.trueskill_p, previous.trueskill_p, abs_tol=FLOAT_TOLERANCE), "Integrity error: Performance p mismatch. Before at {} is {} and After on previous at {} is {}".format(performance.session.date_time, performance.trueskill_p_before, previous.session.date_time, previous.trueskill_p_after)
         
         # Check that there is an associate Rank
-        assert not self.rank is None, "Integrity error: Apparently no rank avalaible for a Performance (id: {})".format(self.id)  
+        rank = self.session.rank(self.player)
+        assert not rank is None, "Integrity error: Apparently no rank avalaible for a Performance (id: {})".format(self.id)  
+
+        # Check that the copies of the session's game, time and result are up to date
+        assert self.game == self.session.game, "Integrity error: Game on Performance is wrong. Performance id: {}, Game: {}, Expected: {}.".format(self.id, self.game, self.session.game)
+        assert self.date_time == self.session.date_time, "Integrity error: Time on Performance is wrong. Performance id: {}, Time: {}, Expected: {}.".format(self.id, self.date_time, self.session.date_time)
+        assert self.rank == rank.rank, "Integrity error: Rank on Performance is wrong. Performance id: {}, Rank: {}, Expected: {}.".format(self.id, self.rank, rank.rank)
+        assert self.is_victory == (rank.rank == 1), "Integrity error: Victory on Performance is wrong. Performance id: {}, Victory: {}, Expected: {}.".format(self.id, self.is_victory, rank.rank == 1)
 
         # Check that play number and victory count reflect early records
         expected_play_number = self.session.previous_sessions(self.player).count()      # Includes the current sessions
@@ -3168,11 +3887,382 @@ class Performance(AdminModel):
 
     class Meta(AdminModel.Meta):
         ordering = ['session', 'player']
+        indexes = [models.Index(fields=['session', 'player'], name='performance_session_player_idx'),
+                   models.Index(fields=['player', 'session'], name='performance_player_session_idx'),
+                   models.Index(fields=['player', 'game', '-date_time'], name='performance_history_idx'),
+                   models.Index(fields=['game', '-date_time'], name='performance_game_time_idx')]
+
+def update_session_performances(session_pk):
+    '''
+    Copies a session's game, time and results onto its Performances (if it still exists).
+    '''
+    session = Session.objects.filter(pk=session_pk).first()
+    if not session is None:
+        session.update_performances()
+
+def sync_performances_on_commit(session_pk):
+    '''
+    Copies a session's game, time and results onto its Performances when the transaction 
+    commits (at once outside of one). However many of the session's parts are saved in the
+    transaction, as when a session form with all its ranks is saved, it's done once.
+    '''
+    queued = any(isinstance(callback, partial) and callback.func is update_session_performances and callback.args == (session_pk,)
+                 for savepoints, callback in connection.run_on_commit)
+    if not queued:
+        transaction.on_commit(partial(update_session_performances, session_pk))
+
+def sync_session_performances(sender, instance, **kwargs):
+    '''
+    A signal receiver that syncs a session's Performances whenever the Session or one of its 
+    Ranks is saved or deleted, however that happens (in the admin or through the ORM, not only 
+    in the views and rating jobs).
+    '''
+    session_pk = instance.pk if sender is Session else instance.session_id
+    if not session_pk is None:
+        sync_performances_on_commit(session_pk)
+
+def sync_team_performances(sender, instance, action, reverse, pk_set, **kwargs):
+    '''
+    A signal receiver that syncs the Performances of the sessions a team played in whenever
+    its players change, as the players' ranks are recorded against the team.
+    '''
+    if action in ('post_add', 'post_remove'):
+        teams = pk_set if reverse else [instance.pk]
+    elif action == 'post_clear' and not reverse:
+        teams = [instance.pk]
+    elif action == 'pre_clear' and reverse:
+        # Clearing a player's teams, which we won't know after
+        teams = list(instance.member_of_teams.values_list('pk', flat=True))
+    else:
+        return
+    
+    for session_pk in Rank.objects.filter(team__in=teams).order_by().values_list('session', flat=True).distinct():
+        sync_performances_on_commit(session_pk)
+
+post_save.connect(sync_session_performances, sender=Session, dispatch_uid="sync_performances_on_session_save")
+post_save.connect(sync_session_performances, sender=Rank, dispatch_uid="sync_performances_on_rank_save")
+post_delete.connect(sync_session_performances, sender=Rank, dispatch_uid="sync_performances_on_rank_delete")
+m2m_changed.connect(sync_team_performances, sender=Team.players.through, dispatch_uid="sync_performances_on_team_change")
+
+def session_deleted(sender, instance, **kwargs):
+    '''
+    A signal receiver that clears the cached leaderboards of a deleted session's game, which
+    include it (and so do all those after it), recounts the plays from its time on and queues 
+    a rebuild of the ratings from then.
+    '''
+    game = Game.objects.filter(pk=instance.game_id).first()
+    if not game is None:
+        game.clear_leaderboard_cache()
+        PlayCount.update(game, since=instance.date_time)
+        RatingJob.queue(game, instance.date_time)
+
+post_delete.connect(session_deleted, sender=Session, dispatch_uid="session_deleted")
+
+def session_moving(sender, instance, **kwargs):
+    '''
+    A signal receiver that, when a session's game or time is about to change, queues a rebuild 
+    of the ratings at the game it was played at, from the time it was played. The ratings where 
+    it moves to are queued once it's saved (see RatingJob.enqueue). 
+    '''
+    if not instance.pk is None:
+        was = Session.objects.filter(pk=instance.pk).values_list('game', 'date_time').first()
+        if not was is None and not was[0] is None and was != (instance.game_id, instance.date_time):
+            RatingJob.queue(*was)
+
+pre_save.connect(session_moving, sender=Session, dispatch_uid="session_moving")
+
+#===============================================================================
+# Aggregates maintained to speed up common queries
+#===============================================================================
+
+class PlayCount(models.Model):
+    '''
+    The cumulative play counts at a game (as returned by Game.play_counts) as they stood after 
+    a given session, for all leagues (league is None) and for each league.  
+    
+    A row is recorded only when the counts change. That is for all leagues after every session, 
+    and for a league after any session it hosted or that one of its players played in. So the 
+    counts as at any time are on the latest row at or before that time, a single indexed lookup.
+    
+    Like Game.play_counts, a league's counts consider the players who are members of it now, 
+    and so they are rebuilt for the games a player played when their league memberships change. 
+    
+    Maintained by PlayCount.update() whenever ratings are updated or rebuilt, and when a 
+    session is deleted (see session_deleted).
+    '''
+    game = models.ForeignKey(Game, verbose_name='Game', related_name='play_count_history', on_delete=models.CASCADE)
+    league = models.ForeignKey(League, verbose_name='League', related_name='play_count_history', null=True, on_delete=models.CASCADE)
+    session = models.ForeignKey(Session, verbose_name='Session', related_name='play_counts', on_delete=models.CASCADE)
+    date_time = models.DateTimeField('Time of the Session', editable=False)
+    
+    total = models.PositiveIntegerField('Total number of plays', default=0)
+    max = models.PositiveIntegerField('Largest play count of any player', default=0)
+    players = models.PositiveIntegerField('Number of players who played', default=0)
+    sessions = models.PositiveIntegerField('Number of sessions played', default=0)
+
+    add_related = None
+    def __unicode__(self): return u'{} ({}) after {}: {} plays by {} players in {} sessions'.format(self.game, self.league if self.league else ALL_LEAGUES, self.date_time, self.total, self.players, self.sessions)
+    def __str__(self): return self.__unicode__()
+
+    @classmethod
+    def as_at(cls, game, league=None, asat=None) -> dict:
+        '''
+        Returns the play counts at a game in the form of Game.play_counts. 
+        
+        :param game: A Game or its pk
+        :param league: A League or its pk, or None for the counts across all leagues 
+        :param asat: Optionally, the counts as at this date/time rather than now
+        '''
+        counts = cls.objects.filter(game=game, league=league)
+        if not asat is None:
+            counts = counts.filter(date_time__lte=asat)
+            
+        pc = counts.order_by('-date_time', '-session').values('total', 'max', 'players', 'sessions').first()
+        if pc is None:
+            pc = {'total': 0, 'max': 0, 'players': 0, 'sessions': 0}
+            
+        pc['average'] = pc['total'] / pc['players'] if pc['players'] else 0
+        return pc
+
+    @classmethod
+    def update(cls, game, since=None):
+        '''
+        Brings the play counts at a game up to date with its recorded performances. 
+        
+        The counts recorded before since are kept and the rest are rebuilt from them, in one pass 
+        over the performances since then.
+        
+        :param game: A Game or its pk
+        :param since: Optionally, the time of the earliest session that changed. If None all counts are rebuilt. 
+        '''
+        rows = cls.objects.filter(game=game)
+        performances = Performance.objects.filter(session__game=game)
+        if not since is None:
+            rows = rows.filter(date_time__gte=since)
+            performances = performances.filter(session__date_time__gte=since)
+        rows.delete()
+
+        # The counts (total, max, players, sessions) standing before since, keyed on league (None for all leagues) 
+        counts = {}
+        if not since is None:
+            previous = (cls.objects
+                        .filter(game=game, date_time__lt=since)
+                        .order_by('league', '-date_time', '-session')
+                        .distinct('league'))
+            for pc in previous:
+                counts[pc.league_id] = [pc.total, pc.max, pc.players, pc.sessions]
+
+        performances = list(performances
+                            .order_by('session__date_time', 'session')
+                            .values_list('session', 'session__date_time', 'session__league', 'player', 'play_number'))
+        
+        player_leagues = {}
+        memberships = (League.players.through.objects
+                        .filter(player__in={p[3] for p in performances})
+                        .values_list('player', 'league'))
+        for player, league in memberships:
+            player_leagues.setdefault(player, []).append(league)
+
+        game_pk = game.pk if isinstance(game, Game) else game
+        new_rows = []
+        changed = set()
+        for i, (session, date_time, league, player, play_number) in enumerate(performances):
+            # Every performance adds a play to all leagues and to those its player is a member of  
+            for key in [None] + player_leagues.get(player, []):
+                pc = counts.setdefault(key, [0, 0, 0, 0])
+                pc[0] += 1
+                pc[1] = max(pc[1], play_number)
+                if play_number == 1:
+                    pc[2] += 1
+                changed.add(key)
+            
+            # After the last performance of a session, count the session (for all leagues and the 
+            # league that hosted it) and record the counts that changed  
+            if i + 1 == len(performances) or performances[i + 1][0] != session:
+                changed.add(league)
+                for key in changed:
+                    pc = counts.setdefault(key, [0, 0, 0, 0])
+                    if key is None or key == league:
+                        pc[3] += 1
+                    new_rows.append(cls(game_id=game_pk, league_id=key, session_id=session, date_time=date_time,
+                                        total=pc[0], max=pc[1], players=pc[2], sessions=pc[3]))
+                changed = set()
+
+        cls.objects.bulk_create(new_rows)
+
+    class Meta:
+        indexes = [models.Index(fields=['game', 'league', '-date_time'], name='playcount_as_at_idx')]
 
 #===============================================================================
 # Administrative models
 #===============================================================================
 
+class RatingJob(models.Model):
+    '''
+    A queue of pending rating updates. 
+    
+    Updating ratings after a session is saved can take a while, notably when it is entered
+    retrospectively and all the sessions of that game played since need replaying too. So 
+    saving a session just queues a job to rebuild the ratings at its game since it was played,
+    and a worker (manage.py process_rating_jobs) takes them off the queue.
+    
+    Jobs for a game coalesce. While one is waiting, another save at the same game just moves
+    its start time back if need be, so that one replay covers both. 
+    
+    A worker holds an advisory lock on a job (a PostgreSQL session lock, keyed on LOCK_SPACE
+    and the job's pk) for as long as it runs it. If the worker dies its connection closes and 
+    the lock is freed. So a running job whose lock is free was abandoned, and it is recovered 
+    (queued again) lest it hold up its game's queue for good. However long a job runs, while 
+    its worker lives, it is left alone.
+    '''
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = ((QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed'))
+    
+    LOCK_SPACE = 4081   # The first key of the advisory locks on jobs (the second is the job's pk)
+    
+    game = models.ForeignKey(Game, verbose_name='Game', related_name='rating_jobs', on_delete=models.CASCADE)
+    since = models.DateTimeField('Rebuild Ratings from')
+    status = models.CharField('Status', max_length=10, choices=STATUSES, default=QUEUED)
+    queued = models.DateTimeField('Time Queued', default=timezone.now)
+    started = models.DateTimeField('Time Started', null=True, blank=True)
+    finished = models.DateTimeField('Time Finished', null=True, blank=True)
+    error = models.TextField('Error', blank=True)
+
+    add_related = None
+    def __unicode__(self): return u'{} since {} ({})'.format(self.game, self.since, self.status)
+    def __str__(self): return self.__unicode__()
+
+    @classmethod
+    def enqueue(cls, session):
+        '''
+        Queues an update of the ratings affected by a session (that was just added or edited).
+        
+        Returns the (possibly existing) job that will do it.
+        '''
+        return cls.queue(session.game, session.date_time)
+
+    @classmethod
+    def queue(cls, game, since):
+        '''
+        Queues a rebuild of the ratings at a game since a given time, coalescing it with the
+        job already queued for that game if there is one.
+        
+        Returns the (possibly existing) job that will do it.
+        '''
+        with transaction.atomic():
+            # Lock the game, not the job. When there's no job queued there's no job to lock, 
+            # and two saves at once would queue two. 
+            Game.objects.select_for_update().filter(pk=getattr(game, 'pk', game)).exists()
+            
+            job = cls.objects.filter(game=game, status=cls.QUEUED).first()
+            if job is None:
+                job = cls.objects.create(game_id=getattr(game, 'pk', game), since=since)
+            elif since < job.since:
+                job.since = since
+                job.save()
+        
+        return job
+
+    @classmethod
+    def lock(cls, job) -> bool:
+        '''
+        Takes the advisory lock on a job, for this database connection. Returns True if it 
+        was free and is now held, False if another connection holds it.  
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", [cls.LOCK_SPACE, job.pk])
+            return cursor.fetchone()[0]
+        
+    @classmethod
+    def unlock(cls, job):
+        '''
+        Releases the advisory lock on a job taken by lock().
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [cls.LOCK_SPACE, job.pk])
+
+    @classmethod
+    def recover_stale(cls):
+        '''
+        Queues again the running jobs that no worker holds the lock on, abandoned by a worker
+        that died. 
+        
+        Returns the number of jobs recovered.
+        '''
+        recovered = 0
+        with transaction.atomic():
+            for job in cls.objects.select_for_update(skip_locked=True).filter(status=cls.RUNNING):
+                if cls.lock(job):
+                    cls.unlock(job)
+                    job.status = cls.FAILED
+                    job.finished = timezone.now()
+                    job.error = f"Abandoned, running since {job.started}, and queued again."
+                    job.save()
+                    cls.queue(job.game_id, job.since)
+                    recovered += 1
+                
+        return recovered
+
+    @classmethod
+    def run_next(cls):
+        '''
+        Runs the oldest queued job, if any, for a game that has no job running already. 
+        
+        Safe to run in any number of workers at once, as a job is claimed with a row lock that
+        the others skip, and is run holding its advisory lock (see recover_stale).  
+        
+        Returns the job run or None if there was none to run.
+        '''
+        cls.recover_stale()
+        
+        with transaction.atomic():
+            running = cls.objects.filter(status=cls.RUNNING).values('game')
+            job = (cls.objects
+                    .select_for_update(skip_locked=True)
+                    .filter(status=cls.QUEUED)
+                    .exclude(game__in=running)
+                    .order_by('queued')
+                    .first())
+            if job is None:
+                return None
+            
+            # Locked before it's seen to be running, so that it's never running and free
+            cls.lock(job)
+            job.status = cls.RUNNING
+            job.started = timezone.now()
+            job.save()
+            
+        try:
+            Rating.rebuild(game=job.game, since=job.since)
+            job.status = cls.DONE
+        except Exception as E:
+            job.status = cls.FAILED
+            job.error = repr(E)
+        finally:
+            job.finished = timezone.now()
+            job.save()
+            cls.unlock(job)
+        
+        return job
+
+    @classmethod
+    def pending(cls, games=None) -> list:
+        '''
+        Returns a list of the pks of games with ratings that are waiting on (queued or running) jobs.
+
+        :param games: Optionally, only consider these games
+        '''
+        jobs = cls.objects.filter(status__in=[cls.QUEUED, cls.RUNNING])
+        if not games is None:
+            jobs = jobs.filter(game__in=games)
+        return list(jobs.order_by().values_list('game', flat=True).distinct())
+
+    class Meta:
+        ordering = ['-queued']
+
 class Rebuild_Log(TimeZoneMixIn, models.Model):
     '''
     A log of rating rebuilds.
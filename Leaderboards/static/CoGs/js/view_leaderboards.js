@@ -773,40 +773,132 @@ function copy_if_empty(me, to) { if ($(to).val() == '') $(to).val(me.value); }
 function show_url() { const url = url_leaderboards.replace(/\/$/, "") + URLopts(); window.history.pushState("","", url); copyStringToClipboard(url); }
 function show_url_static() { refetchLeaderboards(true); }
 
-function got_new_leaderboards() {
-	if (this.readyState === 4 && this.status === 200){
-		// the request is complete, parse data
-		const response = JSON.parse(this.responseText);
-
-		// Capture response in leaderboards
-		$('#title').html(response[0]); 
-		$('#subtitle').html(response[1]); 
-		options =  response[2]
-		leaderboards = response[3];
-		
-		// Get the max and total for rendering
-		get_and_report_metrics(leaderboards);
+// Leaderboards are streamed from the server as NDJSON (newline delimited JSON): a first
+// line with the title, subtitle and options and then one line per game, sent as soon 
+// as the server has built it. We draw them as they arrive, at most once per frame.
+let redraw_pending = false;
+let fetch_controller = null;
+
+// We ask for the compact encoding (see Leaderboards.leaderboards.compact_leaderboard)
+// in which each game comes with the details of players it introduces, collected here,  
+// and each snapshot has its leaderboard in columns. 
+let player_details = {};
+
+// Expand a compact game leaderboard into the form LBtable() expects (rows, not columns)
+function expand_leaderboard(LB) {
+	if (LB.length > 4) {
+		Object.assign(player_details, LB[4]);
+		LB.length = 4;
+	}
+
+	for (const snapshot of LB[3]) {
+		const columns = snapshot[8];
+		if (columns && !Array.isArray(columns)) {
+			const rows = [];
+			for (let i = 0; i < columns.pk.length; i++) {
+				const p = player_details[columns.pk[i]];
+				const row = [columns.rank[i], columns.pk[i], p[0], p[1], p[2], p[3], 
+				             columns.eta[i], columns.mu[i], columns.sigma[i], 
+				             columns.plays[i], columns.victories[i], columns.last_play[i], p[4]];
+				if (columns.rank_prev[i] != null) row.push(columns.rank_prev[i]);
+				rows.push(row);
+			}
+			snapshot[8] = rows;
+		}
+	}
+	return LB;
+}
+
+function redraw_leaderboards() {
+	redraw_pending = false;
+
+	// Get the max and total for rendering
+	get_and_report_metrics(leaderboards);
+
+	// redraw the leaderboards
+	DrawTables("tblLB");
+}
+
+function got_leaderboards_line(line, received) {
+	const data = JSON.parse(line);
+
+	if (received == null) {
+		// The first line has the title, subtitle and options
+		$('#title').html(data[0]); 
+		$('#subtitle').html(data[1]); 
+		options = data[2];
 
 		// Update options
 		InitControls(options);
-		
-		// redraw the leaderboards
-		DrawTables("tblLB");
-		
-		$("#reloading_icon").css("visibility", "hidden");		
+	} else {
+		// Then one leaderboard per line, we replace the old ones as the new ones arrive
+		received.push(expand_leaderboard(data));
+		leaderboards = received;
+
+		if (!redraw_pending) {
+			redraw_pending = true;
+			window.requestAnimationFrame(redraw_leaderboards);
+		}
 	}
-};
+}
 
-const REQUEST = new XMLHttpRequest();
-REQUEST.onreadystatechange = got_new_leaderboards;
-	
-function refetchLeaderboards(make_static) {
-	const url = url_json_leaderboards + URLopts(make_static);
+async function fetchLeaderboards(url) {
+	// A new fetch supersedes any that is still streaming in
+	if (fetch_controller) fetch_controller.abort();
+	const controller = new AbortController();
+	fetch_controller = controller;
 	
 	$("#reloading_icon").css("visibility", "visible");
 
-	REQUEST.open("GET", url, true);
-	REQUEST.send(null);
+	// Player details are sent once per response
+	player_details = {};
+
+	try {
+		const response = await fetch(url + (url.includes("?") ? "&" : "?") + "stream&compact", {signal: controller.signal, credentials: "same-origin"});
+		
+		// An error page is not NDJSON, report it and keep the leaderboards we have 
+		if (!response.ok) {
+			console.error(`Failed to fetch leaderboards: ${response.status} ${response.statusText}`);
+			return;
+		}
+		
+		const reader = response.body.getReader();
+		const decoder = new TextDecoder();
+
+		let buffer = "";
+		let received = null;
+		while (true) {
+			const {done, value} = await reader.read();
+			if (value) buffer += decoder.decode(value, {stream: true});
+
+			let newline;
+			while ((newline = buffer.indexOf("\n")) >= 0) {
+				const line = buffer.slice(0, newline);
+				buffer = buffer.slice(newline + 1);
+				if (line) {
+					got_leaderboards_line(line, received);
+					if (received == null) received = [];
+				}
+			}
+			
+			if (done) break;
+		}
+
+		// Draw the final set (which may be empty)
+		if (received != null) leaderboards = received;
+		redraw_leaderboards();
+	} catch (error) {
+		if (error.name !== "AbortError") throw error;
+	} finally {
+		if (fetch_controller === controller) {
+			fetch_controller = null;
+			$("#reloading_icon").css("visibility", "hidden");
+		}
+	}
+}
+
+function refetchLeaderboards(make_static) {
+	fetchLeaderboards(url_json_leaderboards + URLopts(make_static));
 }
 
 // Function to draw one leaderboard table
@@ -1383,4 +1475,6 @@ function DrawTables(target, links) {
 }
 
 InitControls(options);
-DrawTables("tblLB");
+
+// The leaderboards are not delivered with the page, we stream them in
+fetchLeaderboards(url_json_leaderboards + window.location.search);
@@ -1,5 +1,579 @@
-from django.test import TestCase
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from scipy.stats import norm
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.contrib.auth.models import User, AnonymousUser
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+
+from Leaderboards.models import League, Player, Team, Game, Rating, Session, Rank, Performance, PlayCount, RatingJob
+from Leaderboards.identity import IdentityMap, identity_map
+from Leaderboards.analysis import predict
+from Leaderboards.leaderboards import compact_leaderboard
+from Leaderboards.views import view_List, post_process_submitted_model
+
+from django_generic_view_extensions.queryset import keyset_ordering, seek
+from django_generic_view_extensions.html import odm_str, list_html_rows
+from django_generic_view_extensions.neighbours import get_neighbour_pks
+from django_generic_view_extensions.options import list_display_format, osf, odf
+from django_generic_view_extensions.model import field_plan
 
 # Create your tests here.
 
 # Commit of single file after a revert, but primarily a test of the pull request from clones local master
+
+class LeaderboardQueryTests(TestCase):
+    '''
+    Building a leaderboard should take a fixed number of queries, not one or more per player on it.
+    '''
+    def setUp(self):
+        self.league = League.objects.create(name="League")
+        self.game = Game.objects.create(name="Game", BGGid=1)
+        self.players = 0
+
+    def add_players(self, n):
+        for i in range(self.players, self.players + n):
+            player = Player.objects.create(name_nickname=f"Player {i}", name_personal=f"Personal {i}", name_family=f"Family {i}")
+            player.leagues.add(self.league)
+            Rating.objects.create(player=player, game=self.game, plays=i+1, trueskill_eta=i)
+        self.players += n
+
+    def count_queries(self, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            lb = self.game.leaderboard(**kwargs)
+        self.assertEqual(len(lb), self.players)
+        return len(context.captured_queries)
+
+    def test_leaderboard_query_count(self):
+        self.add_players(2)
+        few = self.count_queries(simple=False)
+        self.add_players(20)
+        many = self.count_queries(simple=False)
+        self.assertEqual(few, many)
+
+    def test_league_leaderboard_query_count(self):
+        self.add_players(2)
+        few = self.count_queries(leagues=[self.league.pk], simple=False)
+        self.add_players(20)
+        many = self.count_queries(leagues=[self.league.pk], simple=False)
+        self.assertEqual(few, many)
+
+    def test_leaderboard_order_and_leagues(self):
+        self.add_players(3)
+        lb = self.game.leaderboard(simple=False)
+        self.assertEqual([row[0] for row in lb], [1, 2, 3])
+        self.assertEqual([row[3] for row in lb], ["Player 2", "Player 1", "Player 0"])
+        self.assertTrue(all(row[12] == [self.league.pk] for row in lb))
+
+class PlayerPositionTests(TestCase):
+    '''
+    A player's leaderboard positions should count the players above them, at each game and in leagues.
+    '''
+    def test_positions(self):
+        league = League.objects.create(name="League")
+        games = [Game.objects.create(name=f"Game {g}", BGGid=g + 1) for g in range(2)]
+        players = [Player.objects.create(name_nickname=f"Player {i}", name_personal=f"Personal {i}", name_family=f"Family {i}") for i in range(3)]
+        for player in players[1:]:
+            player.leagues.add(league)
+
+        for (i, player) in enumerate(players):
+            Rating.objects.create(player=player, game=games[0], trueskill_eta=10 - i)
+        Rating.objects.create(player=players[2], game=games[1], trueskill_eta=0)
+
+        self.assertEqual(players[2].leaderboard_positions_at(games), {games[0].pk: 3, games[1].pk: 1})
+        self.assertEqual(players[2].leaderboard_positions_at(games, league), {games[0].pk: 2, games[1].pk: 1})
+        self.assertEqual(players[0].leaderboard_positions_at(games, league), {})
+
+class SessionResultsTests(TestCase):
+    '''
+    Sessions loaded with_results() should answer questions about their results without further queries.
+    '''
+    def setUp(self):
+        game = Game.objects.create(name="Game", BGGid=1)
+        for s in range(3):
+            session = Session.objects.create(game=game)
+            for r in range(4):
+                player = Player.objects.create(name_nickname=f"Player {s}.{r}", name_personal=f"Personal {r}", name_family=f"Family {s}")
+                Rank.objects.create(session=session, rank=r + 1, player=player)
+                Performance.objects.create(session=session, player=player)
+
+    def test_results_are_prefetched(self):
+        sessions = list(Session.objects.all().with_results())
+
+        with self.assertNumQueries(0):
+            for session in sessions:
+                self.assertEqual(len(session.ranked_players), 4)
+                self.assertEqual(len(session.players), 4)
+                self.assertEqual(len(session.victors), 1)
+                self.assertEqual(len(session.relationships), 6)
+
+class RatingHistoryTests(TestCase):
+    '''
+    The rating history of a game should report each play and the positions after it.
+    '''
+    def test_rating_history(self):
+        game = Game.objects.create(name="Game", BGGid=1)
+        players = [Player.objects.create(name_nickname=f"Player {i}", name_personal=f"Personal {i}", name_family=f"Family {i}") for i in range(3)]
+
+        # Player 0 leads after the first session, player 2 overtakes them in the second
+        for results in ([(0, 20), (1, 10)], [(2, 30), (1, 5)]):
+            session = Session.objects.create(game=game)
+            for (p, eta) in results:
+                Performance.objects.create(session=session, player=players[p], game=game, date_time=session.date_time, trueskill_eta_after=eta)
+
+        history = [(row[1], row[4], row[5]) for row in game.rating_history()]
+        self.assertEqual(history, [(players[0].pk, 20, 1), (players[1].pk, 10, 2), (players[2].pk, 30, 1), (players[1].pk, 5, 3)])
+
+        history = [(row[1], row[5]) for row in game.rating_history([players[0]])]
+        self.assertEqual(history, [(players[0].pk, 1), (players[0].pk, 2)])
+
+class IdentityMapTests(SimpleTestCase):
+    '''
+    An identity map holds one instance of each object, and only inside its with block.
+    '''
+    def test_one_instance_per_object(self):
+        with IdentityMap() as im:
+            game = Game(pk=1, name="Game")
+            self.assertIs(im.add(game), game)
+            self.assertIs(im.add(Game(pk=1, name="Game")), game)
+            self.assertIsNot(im.add(League(pk=1, name="League")), game)
+
+    def test_ratings(self):
+        with IdentityMap() as im:
+            rating = Rating(player_id=1, game_id=2)
+            self.assertIs(im.add_rating(rating), rating)
+            self.assertIs(im.get_rating(1, Game(pk=2)), rating)
+            self.assertIsNone(im.get_rating(2, 1))
+
+    def test_scope(self):
+        self.assertIsNone(identity_map())
+        with IdentityMap() as outer:
+            self.assertIs(identity_map(), outer)
+            with IdentityMap() as inner:
+                self.assertIs(identity_map(), inner)
+            self.assertIs(identity_map(), outer)
+        self.assertIsNone(identity_map())
+
+class PredictionTests(SimpleTestCase):
+    '''
+    The vectorised prediction of many sessions should match predicting each on its own.
+    '''
+    def test_predict(self):
+        # Session 0: three players, the favourite came last. Session 1: two teams of two.
+        group  = [0, 0, 0, 1, 1, 1, 1]
+        ranker = [0, 1, 2, 0, 0, 1, 1]
+        rank   = [1, 2, 3, 2, 2, 1, 1]
+        mu     = [20, 25, 30, 10, 10, 12, 12]
+        sigma  = [3, 4, 5, 1, 1, 1, 1]
+        weight = [1, 1, 1, 1, 0.5, 1, 1]
+        tau    = [0] * 7
+        beta   = [0] * 7
+
+        (order, MU, SIGMA, probability, accuracy) = predict(group, ranker, rank, mu, sigma, weight, tau, beta)
+
+        self.assertEqual(list(order[0]), [2, 1, 0])
+        self.assertEqual(list(order[1][:2]), [1, 0])
+        self.assertEqual(list(MU[1][:2]), [15, 24])
+        self.assertAlmostEqual(SIGMA[1][0], 1.25**0.5)
+
+        p0 = norm.cdf(5 / 41**0.5) * norm.cdf(5 / 25**0.5)
+        p1 = norm.cdf(9 / 3.25**0.5)
+        self.assertAlmostEqual(probability[0], p0)
+        self.assertAlmostEqual(probability[1], p1)
+
+        self.assertEqual(accuracy[0], 0)
+        self.assertEqual(accuracy[1], 1)
+
+class CompactLeaderboardTests(SimpleTestCase):
+    '''
+    The compact encoding sends player details once and leaderboards in columns.
+    '''
+    def test_compact_leaderboard(self):
+        row1 = (1, 7, "bgg", "Nick", "Full", "Full (Nick)", 12.34567, 25.0, 8.3333333, 3, 1, None, [1])
+        row2 = (2, 8, None, "Other", "Other Full", "Other Full (Other)", 10.0, 24.0, 8.0, 2, 0, None, [], 1)
+        snapshot = (1, "now", 5, 3, [7, 8], "header", "pre", "post", [row1, row2])
+
+        players = set()
+        game = compact_leaderboard((1, 99, "Game", [snapshot, snapshot]), players)
+        self.assertEqual(game[4], {7: ["bgg", "Nick", "Full", "Full (Nick)", [1]], 8: [None, "Other", "Other Full", "Other Full (Other)", []]})
+        self.assertEqual(game[3][0][8]['pk'], [7, 8])
+        self.assertEqual(game[3][0][8]['eta'], [12.346, 10.0])
+        self.assertEqual(game[3][0][8]['rank_prev'], [None, 1])
+        self.assertEqual(game[3][1][0:8], snapshot[0:8])
+
+        # Players are described only once in a response
+        self.assertEqual(compact_leaderboard((2, 98, "Game 2", [snapshot]), players)[4], {})
+
+class PrivacyTests(TestCase):
+    '''
+    Enforcing privacy on a batch of players should hide what enforcing it on each would.
+    '''
+    def test_batch_privacy(self):
+        leagues = [League.objects.create(name=f"League {i}") for i in range(2)]
+        viewer = User.objects.create(username="viewer")
+        Player.objects.create(name_nickname="Viewer", name_personal="Personal", name_family="Family", user=viewer).leagues.add(leagues[0])
+        for i in range(4):
+            player = Player.objects.create(name_nickname=f"Player {i}", name_personal=f"Personal {i}", name_family=f"Family {i}")
+            if i:
+                player.leagues.add(leagues[i % 2])
+
+        players = list(Player.objects.with_privacy(viewer))
+        self.assertEqual(len(players), 5)
+        for player in players:
+            self.assertEqual(player.hidden, player.fields_to_hide(viewer))
+        self.assertTrue(any(player.hidden for player in players))
+        self.assertTrue(any(player.name_nickname != "Viewer" and not player.hidden for player in players))
+
+class KeysetPaginationTests(TestCase):
+    '''
+    Paging through a list by seeking past the last object on each page should list every object once, in order.
+    '''
+    def page_through(self, queryset, ordering, page_size):
+        ordering = keyset_ordering(queryset.model, ordering)
+        queryset = queryset.order_by(*ordering)
+        listed = []
+        after = None
+        while True:
+            page = list((seek(queryset, ordering, after) if after else queryset)[:page_size])
+            listed += page
+            if len(page) < page_size:
+                return listed
+            after = page[-1].pk
+
+    def test_seek(self):
+        game = Game.objects.create(name="Game", BGGid=1)
+        sessions = [Session.objects.create(game=game) for s in range(3)]
+        for s, session in enumerate(sessions):
+            session.date_time = sessions[0].date_time  # Ties, broken by pk
+            session.save()
+            for p in range(3):
+                player = Player.objects.create(name_nickname=f"Player {s}.{p}", name_personal=f"Personal {p}", name_family=f"Family {s}")
+                Performance.objects.create(session=session, player=player)
+
+        # Relations are ordered by their Meta ordering, as Django does
+        self.assertEqual(keyset_ordering(Performance, ['session', 'player']), ['-session__date_time', 'player__name_nickname', 'pk'])
+
+        for model in (Session, Performance, Player):
+            reverse = [f[1:] if f.startswith('-') else '-' + f for f in model._meta.ordering]
+            for ordering in (None, model._meta.ordering, reverse):
+                everything = list(model.objects.order_by(*keyset_ordering(model, ordering)))
+                for page_size in (1, 2, 4):
+                    self.assertEqual(self.page_through(model.objects.all(), ordering, page_size), everything)
+
+class ListRenderingTests(TestCase):
+    '''
+    The compiled row renderer should render each object as odm_str does, with its links and index.
+    '''
+    def test_list_rows(self):
+        players = [Player.objects.create(name_nickname=f"Player {i}", name_personal=f"Personal {i}", name_family=f"Family {i}") for i in range(3)]
+
+        view = view_List()
+        view.request = RequestFactory().get('/')
+        view.request.user = AnonymousUser()
+        view.kwargs = {'model': 'Player'}
+        view.model = Player
+        view.queryset = Player.objects.filter(pk__in=[p.pk for p in players]).order_by('pk')
+        view.filterset = None
+        view.start = 10
+        view.format = list_display_format()
+        view.format.index = True
+
+        for elements in (osf.brief, osf.verbose, osf.rich):
+            view.format.elements = elements
+            rows = list(list_html_rows(view))
+            self.assertEqual(len(rows), 3)
+            for i, (row, player) in enumerate(zip(rows, players)):
+                self.assertIn(reverse('view', kwargs={'model': 'Player', 'pk': player.pk}), row)
+                self.assertIn(str(odm_str(player, view.format)), row)
+                self.assertIn(f"<span class='list_index_text'>{11 + i}</span>", row)
+
+class NeighbourTests(TestCase):
+    '''
+    An object's neighbours, row number and the list length should be as listed.
+    '''
+    def test_neighbours(self):
+        game = Game.objects.create(name="Game", BGGid=1)
+        sessions = [Session.objects.create(game=game) for s in range(4)]
+        Session.objects.filter(pk__in=[s.pk for s in sessions[1:3]]).update(date_time=sessions[0].date_time)  # Ties, broken by pk
+
+        listed = list(Session.objects.order_by(*keyset_ordering(Session, Session._meta.ordering)).values_list('pk', flat=True))
+        for i, pk in enumerate(listed):
+            prior = listed[i - 1] if i > 0 else None
+            next = listed[i + 1] if i + 1 < len(listed) else None
+            self.assertEqual(get_neighbour_pks(Session, pk), (prior, next, i + 1, len(listed)))
+            self.assertEqual(get_neighbour_pks(Session, pk, numbered=False), (prior, next, None, None))
+            self.assertEqual(get_neighbour_pks(Session, pk, row=99)[2], 99)
+
+        self.assertEqual(get_neighbour_pks(Session, max(listed) + 1), (None, None))
+
+class FieldPlanTests(SimpleTestCase):
+    '''
+    Field plans should be made once per model and selection of fields, and select what the flags ask for.
+    '''
+    def test_field_plan(self):
+        self.assertIs(field_plan(Game, odf._all), field_plan(Game, odf._all & ~odf.line))
+        self.assertIsNot(field_plan(Game, odf._all), field_plan(Game, odf._normal))
+
+        fields, properties, property_methods, summaries = field_plan(Game, odf._normal)
+        self.assertIn('name', [field.name for (field, bucket, kind, attname, label) in fields])
+        self.assertTrue(all(bucket == odf.model and kind != "list" for (field, bucket, kind, attname, label) in fields))
+        self.assertEqual((properties, property_methods, summaries), ([], [], []))
+
+        fields, properties, property_methods, summaries = field_plan(Game, odf._all)
+        self.assertIn("list", [kind for (field, bucket, kind, attname, label) in fields])
+        self.assertIn("__str__", summaries)
+
+class StreamedLeaderboardTests(TestCase):
+    '''
+    Streamed leaderboards are built after the middleware has run, but should still respect who's viewing them.
+    '''
+    def test_streamed_privacy(self):
+        league = League.objects.create(name="League")
+        game = Game.objects.create(name="Game", BGGid=1)
+        viewer = User.objects.create(username="viewer")
+        Player.objects.create(name_nickname="Viewer", name_personal="Personal", name_family="Family", user=viewer).leagues.add(league)
+
+        # Family names are visible to league members by default (not to everyone)
+        session = Session.objects.create(game=game, league=league)
+        for r in range(2):
+            player = Player.objects.create(name_nickname=f"Player {r}", name_personal=f"Personal {r}", name_family=f"Surname {r}")
+            player.leagues.add(league)
+            Rank.objects.create(session=session, rank=r + 1, player=player)
+            Performance.objects.create(session=session, player=player, game=game, date_time=session.date_time)
+            Rating.objects.create(player=player, game=game, plays=1)
+
+        url = reverse('json_leaderboards') + f"?games_ex={game.pk}&stream"
+
+        client = Client()
+        client.force_login(viewer)
+        board = b"".join(client.get(url).streaming_content).decode()
+        self.assertIn("Surname 0", board)
+
+        board = b"".join(Client().get(url).streaming_content).decode()
+        self.assertNotIn("Surname 0", board)
+
+    def test_streamed_list_privacy(self):
+        league = League.objects.create(name="League")
+        viewer = User.objects.create(username="viewer")
+        Player.objects.create(name_nickname="Viewer", name_personal="Personal", name_family="Family", user=viewer).leagues.add(league)
+        Player.objects.create(name_nickname="Player", name_personal="Personal", name_family="Surname").leagues.add(league)
+
+        url = reverse('get_list_html', kwargs={'model': 'Player'}) + "?verbose&page_size=0"
+
+        client = Client()
+        client.force_login(viewer)
+        self.assertIn("Surname", b"".join(client.get(url).streaming_content).decode())
+        self.assertNotIn("Surname", b"".join(Client().get(url).streaming_content).decode())
+
+class LeaderboardSnapshotTests(TestCase):
+    '''
+    Leaderboard snapshots should leave out the performances of deleted players.
+    '''
+    def test_deleted_player(self):
+        game = Game.objects.create(name="Game", BGGid=1)
+        session = Session.objects.create(game=game)
+        players = [Player.objects.create(name_nickname=f"Player {i}", name_personal=f"Personal {i}", name_family=f"Family {i}") for i in range(2)]
+        for (r, player) in enumerate(players):
+            Rank.objects.create(session=session, rank=r + 1, player=player)
+            Performance.objects.create(session=session, player=player, game=game, date_time=session.date_time, play_number=1)
+        players[1].delete()
+
+        snapshots, counts = Session.leaderboard_snapshots([session])
+        self.assertEqual([row[1] for row in snapshots[session.pk][8]], [players[0].pk])
+        self.assertEqual(counts[session.pk]['players'], 1)
+
+class PerformanceSyncTests(TransactionTestCase):
+    '''
+    A session's Performances should follow its game, time and ranks however they are edited.
+    '''
+    def setUp(self):
+        self.game = Game.objects.create(name="Game", BGGid=1)
+        self.players = [Player.objects.create(name_nickname=f"Player {i}", name_personal=f"Personal {i}", name_family=f"Family {i}") for i in range(3)]
+
+    def test_performances_follow_ranks(self):
+        session = Session.objects.create(game=self.game)
+        players = self.players[:2]
+        with transaction.atomic():
+            for player in players:
+                Performance.objects.create(session=session, player=player)
+            ranks = [Rank.objects.create(session=session, rank=r + 1, player=player) for (r, player) in enumerate(players)]
+
+        performance = Performance.objects.get(session=session, player=players[0])
+        self.assertEqual((performance.game, performance.date_time, performance.rank, performance.is_victory), (self.game, session.date_time, 1, True))
+
+        ranks[0].rank = 2
+        ranks[0].save()
+        ranks[1].delete()
+        session.date_time -= timedelta(days=1)
+        session.save()
+
+        performances = {p.player_id: p for p in Performance.objects.filter(session=session)}
+        self.assertEqual((performances[players[0].pk].rank, performances[players[0].pk].is_victory), (2, False))
+        self.assertEqual(performances[players[1].pk].rank, None)
+        self.assertEqual(performances[players[0].pk].date_time, session.date_time)
+
+    def test_performance_saved_alone(self):
+        session = Session.objects.create(game=self.game)
+        Rank.objects.create(session=session, rank=1, player=self.players[0])
+        performance = Performance.objects.create(session=session, player=self.players[0])
+        self.assertEqual((performance.game, performance.date_time, performance.rank, performance.is_victory), (self.game, session.date_time, 1, True))
+
+    def test_team_players_change(self):
+        session = Session.objects.create(game=self.game, team_play=True)
+        teams = [Team.objects.create() for t in range(2)]
+        for (t, team) in enumerate(teams):
+            team.players.add(self.players[t])
+            Rank.objects.create(session=session, rank=t + 1, team=team)
+        performance = Performance.objects.create(session=session, player=self.players[2])
+        self.assertEqual(performance.rank, None)
+
+        teams[0].players.add(self.players[2])
+        self.assertEqual(Performance.objects.get(pk=performance.pk).rank, 1)
+
+        self.players[2].member_of_teams.clear()
+        self.assertEqual(Performance.objects.get(pk=performance.pk).rank, None)
+
+    def test_synced_once_per_transaction(self):
+        session = Session.objects.create(game=self.game)
+        with patch.object(Session, 'update_performances', autospec=True) as update_performances:
+            with transaction.atomic():
+                session.save()
+                for (r, player) in enumerate(self.players):
+                    Rank.objects.create(session=session, rank=r + 1, player=player)
+            self.assertEqual(update_performances.call_count, 1)
+
+class LeaderboardCacheTests(TransactionTestCase):
+    '''
+    A game's cached leaderboards should be invalidated when a change to its ratings commits, not before.
+    '''
+    def test_version_changes_on_commit(self):
+        game = Game.objects.create(name="Game", BGGid=1)
+        version = game.leaderboard_cache_version
+        with transaction.atomic():
+            game.clear_leaderboard_cache()
+            self.assertEqual(game.leaderboard_cache_version, version)
+        self.assertNotEqual(game.leaderboard_cache_version, version)
+
+    def test_player_rename(self):
+        game = Game.objects.create(name="Game", BGGid=1)
+        session = Session.objects.create(game=game)
+        player = Player.objects.create(name_nickname="Before", name_personal="Personal", name_family="Family")
+        Rank.objects.create(session=session, rank=1, player=player)
+        Performance.objects.create(session=session, player=player, game=game, date_time=session.date_time, play_number=1)
+
+        snapshots, counts = Session.leaderboard_snapshots([session])
+        self.assertEqual(snapshots[session.pk][8][0][3], "Before")
+
+        # As the edit view does once the form's saved
+        player.name_nickname = "After"
+        player.save()
+        post_process_submitted_model(SimpleNamespace(model=Player, object=player))
+
+        snapshots, counts = Session.leaderboard_snapshots([Session.objects.get(pk=session.pk)])
+        self.assertEqual(snapshots[session.pk][8][0][3], "After")
+
+    def test_session_delete(self):
+        game = Game.objects.create(name="Game", BGGid=1)
+        session = Session.objects.create(game=game)
+        version = game.leaderboard_cache_version
+        session.delete()
+        self.assertNotEqual(game.leaderboard_cache_version, version)
+
+class ConditionalResponseTests(TransactionTestCase):
+    '''
+    A browser revalidating a list should be told it's not modified until a submitted form changes the data.
+    '''
+    def test_not_modified_until_data_changes(self):
+        league = League.objects.create(name="League")
+        url = reverse('get_list_html', kwargs={'model': 'League'})
+        client = Client()
+
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # As the edit view does once the form's saved
+        league.name = "Renamed"
+        league.save()
+        post_process_submitted_model(SimpleNamespace(model=League, object=league))
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_modified_when_csrf_cookie_changes(self):
+        url = reverse('leaderboards')
+        client = Client()
+        client.cookies[settings.CSRF_COOKIE_NAME] = "a" * 64
+
+        etag = client.get(url)['ETag']
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # As after logging out and in again, the page's token is no longer valid
+        client.cookies[settings.CSRF_COOKIE_NAME] = "b" * 64
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+class PlayCountTests(TestCase):
+    '''
+    Play counts should be recounted when a session is deleted.
+    '''
+    def test_session_delete(self):
+        game = Game.objects.create(name="Game", BGGid=1)
+        player = Player.objects.create(name_nickname="Player", name_personal="Personal", name_family="Family")
+        now = timezone.now()
+        sessions = [Session.objects.create(game=game, date_time=now - timedelta(days=2 - s)) for s in range(2)]
+        for (s, session) in enumerate(sessions):
+            Performance.objects.create(session=session, player=player, play_number=s + 1)
+        PlayCount.update(game)
+        self.assertEqual((PlayCount.as_at(game)['total'], PlayCount.as_at(game)['sessions']), (2, 2))
+
+        sessions[1].delete()
+        self.assertEqual((PlayCount.as_at(game)['total'], PlayCount.as_at(game)['sessions']), (1, 1))
+
+class RatingJobTests(TestCase):
+    '''
+    Rating jobs for a game should coalesce, and jobs abandoned by a worker should be queued again.
+    '''
+    def test_queue_and_recover(self):
+        game = Game.objects.create(name="Game", BGGid=1)
+        now = timezone.now()
+
+        job = RatingJob.queue(game, now)
+        self.assertEqual(RatingJob.queue(game, now - timedelta(days=1)).pk, job.pk)
+        self.assertEqual(RatingJob.objects.filter(status=RatingJob.QUEUED).count(), 1)
+
+        # A worker runs it (and holds its lock, on its own connection) for hours 
+        RatingJob.objects.filter(pk=job.pk).update(status=RatingJob.RUNNING, started=now - timedelta(hours=2))
+        RatingJob.queue(game, now)
+        self.assertEqual(RatingJob.pending(), [game.pk])
+
+        worker = connection.__class__(connection.settings_dict)
+        with worker.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s, %s)", [RatingJob.LOCK_SPACE, job.pk])
+        self.assertEqual(RatingJob.recover_stale(), 0)
+        self.assertEqual(RatingJob.objects.get(pk=job.pk).status, RatingJob.RUNNING)
+
+        # And then dies
+        worker.close()
+        self.assertEqual(RatingJob.recover_stale(), 1)
+        self.assertEqual(RatingJob.objects.get(pk=job.pk).status, RatingJob.FAILED)
+        queued = RatingJob.objects.get(status=RatingJob.QUEUED)
+        self.assertEqual(queued.since, now - timedelta(days=1))
+        self.assertEqual(RatingJob.recover_stale(), 0)
+
+    def test_moved_session(self):
+        games = [Game.objects.create(name=f"Game {g}", BGGid=g + 1) for g in range(2)]
+        session = Session.objects.create(game=games[0])
+        played = session.date_time
+
+        session.game = games[1]
+        session.save()
+        self.assertEqual(list(RatingJob.objects.filter(status=RatingJob.QUEUED).values_list('game', 'since')), [(games[0].pk, played)])
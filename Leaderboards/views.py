@@ -1,4 +1,4 @@
-import re, json
+import re, json, hashlib
 from re import RegexFlag as ref # Specifically to avoid a PyDev Error in the IDE. 
 import cProfile, pstats, io
 from datetime import datetime, date, timedelta
@@ -11,8 +11,9 @@ from django_generic_view_extensions.debug import print_debug
 
 from cuser.middleware import CuserMiddleware
 
-from Leaderboards.models import Team, Player, Game, League, Location, Session, Rank, Performance, Rating, ALL_LEAGUES, ALL_PLAYERS, ALL_GAMES
-from .leaderboards import leaderboard_options, NameSelections, LinkSelections 
+from Leaderboards.models import Team, Player, Game, League, Location, Session, Rank, Performance, Rating, PlayCount, RatingJob, ALL_LEAGUES, ALL_PLAYERS, ALL_GAMES, data_version, bump_data_version
+from .leaderboards import leaderboard_options, compact_leaderboard, NameSelections, LinkSelections 
+from .identity import IdentityMap
 
 from django.db.models import Count, Q
 from django.shortcuts import render
@@ -20,7 +21,9 @@ from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from django.utils.formats import localize
 from django.utils.timezone import is_aware, make_aware, activate, localtime
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
+from django.views.decorators.cache import cache_control
 #from django.http.response import HttpResponseRedirect
 from django.urls import reverse, reverse_lazy  #, resolve
 from django.contrib.auth.models import User, Group
@@ -97,9 +100,16 @@ def post_process_submitted_model(self):
     then throw an IntegrityError.   
     '''
     model = self.model._meta.model_name
-
-    if model == 'player':
-        pass # updated_user_from_form(...) # TODO: Need when saving users update the auth model too.
+    
+    if model == 'player' or model == 'league':
+        # updated_user_from_form(...) # TODO: Need when saving users update the auth model too.
+        
+        # League play counts depend on league membership, which may have changed, and cached 
+        # leaderboards record player names (with privacy applied) and leagues too.
+        players = [self.object] if model == 'player' else self.object.players.all() 
+        for game in Game.objects.filter(sessions__performances__player__in=players).distinct():
+            PlayCount.update(game)
+            game.clear_leaderboard_cache()
     elif model == 'session':
     # TODO: When saving sessions, need to do a confirmation step first, reporting the impacts.
     #       Editing a session will have to force recalculation of all the rating impacts of sessions
@@ -310,11 +320,13 @@ def post_process_submitted_model(self):
         #       We need to clean these up. I think this means we just have to recaluclate the trueskill 
         #       impacts but also all subsequent ones involving any of these players if it's an edit!
         
-        # Calculate and save the TrueSkill rating impacts to the Performance records
-        session.calculate_trueskill_impacts()
-        
-        # Then update the ratings for all players of this game
-        Rating.update(session)
+        # Queue an update of the TrueSkill rating impacts on the Performance records and the 
+        # ratings for all players of this game (from this session on). That can take a while
+        # (when a session is entered retrospectively later sessions need replaying too) and so 
+        # is left to a worker (manage.py process_rating_jobs), rather than have the registrar wait.
+        # The session's game, time and results were copied to its Performance records when its 
+        # form was saved (see sync_session_performances).
+        RatingJob.enqueue(session)
         
         # Now check the integrity of the save. For a sessions, this means that:
         #
@@ -334,6 +346,11 @@ def post_process_submitted_model(self):
         # TODO: Do these checks. Then do test of the transaction rollback and error catch by 
         #       simulating an integrity error.  
 
+    # Leaderboards and lists may have changed. Noted last, after the writes above: this runs after
+    # the form's transaction has committed and so the version changes at once, and a response 
+    # built before these writes must not carry the new version.
+    bump_data_version()
+
 def html_league_options(session):
     '''
     Returns a simple string of HTML OPTION tags for use in a SELECT tag in a template
@@ -485,17 +502,6 @@ class view_Login(LoginViewExtended):
         try:
             user = User.objects.get(username=username)
                         
-            # We have to lose a leaderboard cache after a login as 
-            # privacy setting change and lots of player name fields
-            # in particular will be missing data in the cache that
-            # is now available to the logged in user. This us 
-            # unfortunate and theremay be a better way:
-            # TODO: rather that deleting the cache, we could
-            #       rebuild only the names in the leaderboards 
-            #       but that would be some fiddly code.
-            if "leaderboard_cache" in self.request.session:
-                del self.request.session["leaderboard_cache"]
-            
             if hasattr(user, 'player') and user.player:
                 preferred_league = user.player.league
                                 
@@ -544,6 +550,11 @@ class view_Delete(LoginRequiredMixin, DeleteViewExtended):
     format = object_display_format()
     extra_context_provider = extra_context_provider
 
+    def delete(self, request, *args, **kwargs):
+        response = super().delete(request, *args, **kwargs)
+        bump_data_version()
+        return response
+
 class view_List(ListViewExtended):
     template_name = 'CoGs/list_data.html'
     operation = 'list'
@@ -556,19 +567,73 @@ class view_Detail(DetailViewExtended):
     format = object_display_format()
     extra_context_provider = extra_context_provider
 
+#===============================================================================
+# Conditional responses
+#===============================================================================
+
+def data_etag(request, *args, **kwargs):
+    '''
+    An ETag for responses built from the data (leaderboards and lists). 
+    
+    They depend on the data version (see Leaderboards.models.data_version) and on the request
+    (its URL, the session filters, the user, as names are subject to privacy settings, the
+    timezone, as times are localised, and the CSRF cookie, as pages embed a token that is only 
+    valid with it). So a hash of those all will do. It costs no database query, and so if the
+    data hasn't changed a browser revalidating its copy gets a 304 Not Modified response for 
+    nearly nothing.
+    '''
+    state = (data_version().isoformat(),
+             request.get_full_path(),
+             request.session.get('filter', {}),
+             request.session.get('preferred_league', 0),
+             request.session.get('debug_mode', False),
+             request.user.pk,
+             timezone.get_current_timezone_name(),
+             request.COOKIES.get(settings.CSRF_COOKIE_NAME, None))
+    return hashlib.md5(json.dumps(state, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+def data_last_modified(request, *args, **kwargs):
+    '''
+    The Last-Modified time of responses built from the data (see data_etag).
+    '''
+    return data_version()
+
+# A decorator for views that respond with data (leaderboards or lists). Browsers may keep
+# copies (which are private as they depend on the user) but must always revalidate them.
+def conditional_on_data(view):
+    return cache_control(private=True, no_cache=True)(condition(etag_func=data_etag, last_modified_func=data_last_modified)(view))
+
+def as_request_user(request, stream):
+    '''
+    Runs a generator (that feeds a StreamingHttpResponse) as the request user.
+    
+    A streaming response's generator runs after the response has been through the middleware,
+    and so after CuserMiddleware has forgotten the user. But the models ask it who's viewing, 
+    notably to apply privacy to player names, and so we remind it while the stream runs.
+    
+    :param request: The request the streamed response answers
+    :param stream:  A generator (not yet started)
+    '''
+    user = request.user
+    CuserMiddleware.set_user(user)
+    try:
+        yield from stream
+    finally:
+        CuserMiddleware.del_user()
+
 #===============================================================================
 # The Leaderboards view. What it's all about!
 #===============================================================================
 
 # Define defaults for the view inputs 
 
+@conditional_on_data
 def view_Leaderboards(request): 
     '''
     The raison d'etre of the whole site, this view presents the leaderboards. 
     '''
-    # Fetch the leaderboards
-    leaderboards = ajax_Leaderboards(request, raw=True)   
-
+    # The leaderboards are not delivered with the page, the page streams them in 
+    # (from ajax_Leaderboards) and renders them as they arrive.
     session_filter = request.session.get('filter',{})
     lo = leaderboard_options(session_filter, request.GET)    
     default = leaderboard_options(session_filter)
@@ -598,7 +663,7 @@ def view_Leaderboards(request):
          # For use in Javascript
          'options': json.dumps(lo.as_dict()),         
          'defaults': json.dumps(default.as_dict()),   
-         'leaderboards': json.dumps(leaderboards, cls=DjangoJSONEncoder),
+         'leaderboards': json.dumps([]),
          
          # For use in templates
          'leaderboard_options': lo,
@@ -620,6 +685,9 @@ def view_Leaderboards(request):
          # The preferred league if any
          'preferred_league': [pl_id, pl_lbl],
          
+         # Games with ratings still updating (that have rating jobs queued or running)
+         'updating': Game.objects.filter(pk__in=RatingJob.pending()).values_list('name', flat=True),
+         
          # Debug mode
          'debug_mode': request.session.get("debug_mode", False)         
          }
@@ -627,20 +695,163 @@ def view_Leaderboards(request):
     return render(request, 'CoGs/view_leaderboards.html', context=c)
 
 
+# The number of games built in one pass when streaming leaderboards (see game_leaderboards)
+LEADERBOARD_STREAM_BATCH = 5
+
+def game_leaderboards(lo, games, batch_size=None):
+    '''
+    A generator of the leaderboards of games (the Tier1 tuples described in ajax_Leaderboards), 
+    as specified by leaderboard options.
+    
+    The boards (sessions) of a batch of games are collected first, so that the snapshots and play 
+    counts for all of them can be built in one pass with a handful of queries, rather than a handful 
+    per board. By default all the games are one batch, streaming responses use smaller batches so 
+    that the first leaderboards are sent early.
+    
+    :param lo: leaderboard_options
+    :param games: the games to build leaderboards for (a list or queryset)
+    :param batch_size: the number of games to build in one pass, or None for all of them
+    '''
+    games = list(games)
+    if not batch_size:
+        batch_size = max(len(games), 1)
+
+    for b in range(0, len(games), batch_size):
+        game_boards = []
+        for game in games[b:b + batch_size]:
+            boards = list(lo.snapshot_queryset(game))
+            for board in boards:
+                board.game = game
+            game_boards.append((game, boards))
+            
+        with IdentityMap():
+            all_snapshots, all_counts = Session.leaderboard_snapshots([board for _, boards in game_boards for board in boards], 
+                                                                      leagues=lo.game_leagues)
+        
+        for game, boards in game_boards:
+            print_debug(f"Preparing leaderboard for: {game}")     
+
+            if boards:
+                #######################################################################################################
+                ## BUILD EACH SNAPSHOT BOARD - from the sessions we recorded in "boards"
+                #######################################################################################################
+                #
+                # From the list of boards (sessions) for this game build Tier2 and Tier 3 in the returned structure 
+                # now. That is assemble the actualy leaderbards after each of the collected sessions.
+            
+                print_debug(f"\tPreparing {len(boards)} boards/snapshots.")     
+            
+                # We want to build a list of snapshots to add to the leaderboards list
+                snapshots = []
+            
+                # We keep a dictionary of previous ranks for each player by PK so we can can
+                # insert them into the leaderboardd, enabling the client to highlight rank 
+                # changes from snapshot to snapshot. 
+                previous_rank = {}
+            
+                # For each board/snapshot of this game ...
+                # In temporral order so we can construct the "previous rank" 
+                # element on the fly, but we're reverse it back when we add the 
+                # collected snapshots to the leaderboards list.        
+                for board in reversed(boards):
+                    # IF as_at is now, the first time should be the last session time for the game 
+                    # and thus should translate to the same as what's in the Rating model. 
+                    # TODO: Perform an integrity check around that and indeed if it's an ordinary
+                    #       leaderboard presentation check on performance between asat=time (which 
+                    #       reads Performance) and asat=None (which reads Rating).
+                
+                    print_debug(f"\tBoard/Snapshot for session at {localize(localtime(board.date_time))}.")                     
+
+                    # First fetch the global (unfiltered) snapshot for this board/session
+                    # (built in bulk above, or from the server wide cache).
+                    full_snapshot = all_snapshots[board.pk]
+
+                    # TODO, consider not relying on a firm index here, either providing 
+                    # indexes as a an enumeration or using a dict? snapshot would habe 
+                    # to be turned into a tuple or lsit of dict values to be inserted into
+                    # a the leaderboards tuple for this game though. Unless the whole 
+                    # structure moved more toward dicts (and dicts passed well as JSON 
+                    # to context and AJAX callers?
+                    #
+                    # Alternately make snapshots  class with attrs? What are the 
+                    # consequences of that for caching, JSONifying to context and 
+                    # AJAX callers?
+                    print_debug(f"\tGot the full board/snapshot. It has {len(full_snapshot[8])} players on it.")
+                
+                    # Then filter and annotate it in context of lo
+                    if full_snapshot:
+                        lb = full_snapshot[8]
+                    
+                        snapshot = lo.apply(full_snapshot)
+                        lbf = snapshot[8]
+
+                        print_debug(f"\tGot the filtered/annotated board/snapshot. It has {len(snapshot[8])} players on it.")
+            
+                        # Counts supplied in the full_snapshot are global and we want to constrain them to
+                        # the leagues in question.
+                        #
+                        # Playcounts are always across all the leagues specified.
+                        #   if we filter games on any leagues, the we list games played by any of the leagues
+                        #        and play count across all the leagues makes sense.
+                        #   if we filter games on all leagues, then list only games played by all the leagues present
+                        #        and it still makes sense to list a playcount across all those leagues.
+                    
+                        counts = all_counts[board.pk]
+                    
+                        # We add the previous rank if available to each players tuple in the leaderboard
+                        if lbf and previous_rank:
+                            for p in range(len(lbf)):
+                                player_tuple = lbf[p]
+                                pk = player_tuple[1]
+                                if pk in previous_rank:
+                                    lbf[p] = player_tuple + (previous_rank[pk],)
+
+                    
+                        # snapshot 0 and 1 are the session PK and localized time
+                        # snapshot 2 and 3 are the counts we updated with lo.league sensitivity
+                        # snapshot 4, 5, 6 and 7 are session players, HTML header and HTML analyis pre and post respectively
+                        # snapshot 8 is the leaderboard (a tuple of player tuples
+                        # The HTML header and analyses use flex player naming and expect client side to render 
+                        # appropriately. See Player.name() for flexi naming standard.
+                        snapshot = (snapshot[0:2] 
+                                 +  (counts['total'], counts['sessions']) 
+                                 +  snapshot[4:8] 
+                                 +  (lbf,))
+                                    
+                        # Clear and rebuild the previouse_rank dictionary with this boards' lb values
+                        # We use the wholeleaderboard hear (lb) not the player filtered leaderboard (lbf)
+                        previous_rank = {}
+                        for p in lb:
+                            rank = p[0]
+                            pk = p[1]
+                            previous_rank[pk] = rank
+                        
+                        snapshots.append(snapshot)                
+
+                # For this game we now have all the snapshots and we can save a game tuple
+                # to the leaderboards list. We must have at least one snapshot, because we
+                # ignored all games with 0 recorded sessions already in buiulding our list 
+                # games. So if we don't have any something really bizarre has happened/  
+                assert len(snapshots) > 0, "Internal error: Game was in list for which no leaderboard snapshot was found. It should not have been in the list."
+
+                # We reverse the snapshots back to newest first oldest last                                
+                snapshots.reverse()
+            
+                # Then build the game tuple with all its snapshots
+                yield (game.pk, game.BGGid, game.name, snapshots)
+
 #===============================================================================
 # AJAX providers
 #===============================================================================
 
-def ajax_Leaderboards(request, raw=False):
+@conditional_on_data
+def ajax_Leaderboards(request):
     '''
     A view that returns a JSON string representing requested leaderboards.
     
-    This is used with raw=True as well by view_Leaderboards to get the leaderboard data,
-    not JSON encoded.
-    
-    Should only validly be called from view_Leaderboards when a view is rendered
-    or as an AJAX call when requesting a leaderboard refresh because the player name 
-    presentation for example has changed. 
+    Should only validly be called as an AJAX call from the leaderboards view, when it is 
+    loaded or when requesting a leaderboard refresh because the player name presentation 
+    for example has changed. 
     
     Caution: This does not have any way of adjusting the context that the original 
     view received, so any changes to leaderboard content that warrant an update to 
@@ -673,12 +884,16 @@ def ajax_Leaderboards(request, raw=False):
     
     Links to games and players in the leaderboard are built in the template, wrapping a player name in
     a link to nothing or a URL based on player.pk or player.BGGname as per the request.
+    
+    With a "stream" GET parameter the response is streamed as NDJSON (newline delimited JSON) 
+    rather than one JSON list: a first line with [title, subtitle, options] and then one line 
+    per game (Tier1 tuple), sent as soon as it is built so that the page can render leaderboards 
+    as they arrive. 
+    
+    With a "compact" GET parameter the leaderboards are encoded compactly, with each player's 
+    details sent once and each snapshot's leaderboard in columns (see compact_leaderboard).
     '''
 
-    # For DEBUGGING    
-    # if "leaderboard_cache" in request.session:
-    #     del request.session["leaderboard_cache"]    
-    
     # Fetch the options submitted (and the defaults)
     session_filter = request.session.get('filter',{})
     lo = leaderboard_options(session_filter, request.GET)
@@ -686,13 +901,10 @@ def ajax_Leaderboards(request, raw=False):
     # Create a page title, based on the leaderboard options (lo).
     (title, subtitle) = lo.titles()
     
-    # Get the cache if available
-    #
-    # It should contain leaderboard snapshots already produced.
-    # Each snapshot is uniquely identified by the session.pk 
-    # that it belongs to. And so we can store them in cache in 
-    # a dict keyed on session.pk
-    lb_cache = request.session.get("leaderboard_cache", {}) 
+    # Leaderboard snapshots are cached server wide (by Session.leaderboard_snapshot)
+    # and so no longer in the session. Drop any stale cache an older version of this
+    # view left in the session.
+    request.session.pop("leaderboard_cache", None)
     
     # Fetch the queryset of games that thes options specify
     # This is lazy and should not have caused a database hit just return an unevaluated queryset 
@@ -702,152 +914,28 @@ def ajax_Leaderboards(request, raw=False):
     ## FOR ALL THE GAMES WE SELECTED build a leaderboard (with any associated snapshots)
     #######################################################################################################
     print_debug(f"Preparing leaderboards for {len(games)} games.")     
-    leaderboards = []
-    for game in games:
-        print_debug(f"Preparing leaderboard for: {game}")     
 
-        # FIXME: Here is a sweet spot. Some or all sessions are available in the
-        #        cache already. We need the session only for:
-        #
-        #  1) it's datetime - cheap
-        #  2) to build the three headerrs
-        #     a) session player list     - cheap
-        #     b) analisys pre            - expensive
-        #     c) analysis post           - expensive
-        #
-        # We want to know if the session is already in a cached snapshot.
-        #
-        # FIXME: For that it's best to use PK, so we want to put Session.PK into
-        #        the snapshot tuple!        
-        
-        boards = lo.snapshot_queryset(game)
+    # A streaming response sends an NDJSON (newline delimited JSON) stream: the title, subtitle 
+    # and options first, then each game's leaderboard as soon as it's built.
+    # A compact response encodes the leaderboards with compact_leaderboard().
+    compact = 'compact' in request.GET
+    players = set()
+    
+    if 'stream' in request.GET:
+        def stream():
+            yield json.dumps((title, subtitle, lo.as_dict()), cls=DjangoJSONEncoder) + "\n"
+            for leaderboard in game_leaderboards(lo, games, LEADERBOARD_STREAM_BATCH):
+                if compact:
+                    leaderboard = compact_leaderboard(leaderboard, players)
+                yield json.dumps(leaderboard, cls=DjangoJSONEncoder) + "\n"
         
-        if boards:
-            #######################################################################################################
-            ## BUILD EACH SNAPSHOT BOARD - from the sessions we recorded in "boards"
-            #######################################################################################################
-            #
-            # From the list of boards (sessions) for this game build Tier2 and Tier 3 in the returned structure 
-            # now. That is assemble the actualy leaderbards after each of the collected sessions.
-            
-            print_debug(f"\tPreparing {len(boards)} boards/snapshots.")     
-            
-            # We want to build a list of snapshots to add to the leaderboards list
-            snapshots = []
-            
-            # We keep a dictionary of previous ranks for each player by PK so we can can
-            # insert them into the leaderboardd, enabling the client to highlight rank 
-            # changes from snapshot to snapshot. 
-            previous_rank = {}
-            
-            # For each board/snapshot of this game ...
-            # In temporral order so we can construct the "previous rank" 
-            # element on the fly, but we're reverse it back when we add the 
-            # collected snapshots to the leaderboards list.        
-            for board in reversed(boards):
-                # IF as_at is now, the first time should be the last session time for the game 
-                # and thus should translate to the same as what's in the Rating model. 
-                # TODO: Perform an integrity check around that and indeed if it's an ordinary
-                #       leaderboard presentation check on performance between asat=time (which 
-                #       reads Performance) and asat=None (which reads Rating).
-                # TODO: Consider if performance here improves with a prefetch or such noting that
-                #       game.play_counts and game.session_list might run faster with one query rather 
-                #       than two.
-                
-                # FIXME: Here is the sweet spot.
-                #        From here we build a snapshot tuple. This is what we can find in the cache rather 
-                #        than build so it boils down here to getting the snapshot from chache or building 
-                #        it. 
-                
-                print_debug(f"\tBoard/Snapshot for session at {localize(localtime(board.date_time))}.")                     
-
-                # First fetch the global (unfiltered) snapshot for this board/session
-                if board.pk in lb_cache:
-                    full_snapshot = lb_cache[board.pk]
-                    print_debug(f"\tFound it in cache!")                     
-                else:
-                    full_snapshot = board.leaderboard_snapshot()
-                    if full_snapshot:
-                        lb_cache[board.pk] = full_snapshot
-
-                # TODO, consider not relying on a firm index here, either providing 
-                # indexes as a an enumeration or using a dict? snapshot would habe 
-                # to be turned into a tuple or lsit of dict values to be inserted into
-                # a the leaderboards tuple for this game though. Unless the whole 
-                # structure moved more toward dicts (and dicts passed well as JSON 
-                # to context and AJAX callers?
-                #
-                # Alternately make snapshots  class with attrs? What are the 
-                # consequences of that for caching, JSONifying to context and 
-                # AJAX callers?
-                print_debug(f"\tGot the full board/snapshot. It has {len(full_snapshot[8])} players on it.")
-                
-                # Then filter and annotate it in context of lo
-                if full_snapshot:
-                    lb = full_snapshot[8]
-                    
-                    snapshot = lo.apply(full_snapshot)
-                    lbf = snapshot[8]
-
-                    print_debug(f"\tGot the filtered/annotated board/snapshot. It has {len(snapshot[8])} players on it.")
-            
-                    # Counts supplied in the full_snapshot are global and we want to constrain them to
-                    # the leagues in question.
-                    #
-                    # Playcounts are always across all the leagues specified.
-                    #   if we filter games on any leagues, the we list games played by any of the leagues
-                    #        and play count across all the leagues makes sense.
-                    #   if we filter games on all leagues, then list only games played by all the leagues present
-                    #        and it still makes sense to list a playcount across all those leagues.
-                    
-                    counts = game.play_counts(leagues=lo.game_leagues, asat=board.date_time)                    
-                    
-                    # We add the previous rank if available to each players tuple in the leaderboard
-                    if lbf and previous_rank:
-                        for p in range(len(lbf)):
-                            player_tuple = lbf[p]
-                            pk = player_tuple[1]
-                            if pk in previous_rank:
-                                lbf[p] = player_tuple + (previous_rank[pk],)
-
-                    
-                    # snapshot 0 and 1 are the session PK and localized time
-                    # snapshot 2 and 3 are the counts we updated with lo.league sensitivity
-                    # snapshot 4, 5, 6 and 7 are session players, HTML header and HTML analyis pre and post respectively
-                    # snapshot 8 is the leaderboard (a tuple of player tuples
-                    # The HTML header and analyses use flex player naming and expect client side to render 
-                    # appropriately. See Player.name() for flexi naming standard.
-                    snapshot = (snapshot[0:2] 
-                             +  (counts['total'], counts['sessions']) 
-                             +  snapshot[4:8] 
-                             +  (lbf,))
-                                    
-                    # Clear and rebuild the previouse_rank dictionary with this boards' lb values
-                    # We use the wholeleaderboard hear (lb) not the player filtered leaderboard (lbf)
-                    previous_rank = {}
-                    for p in lb:
-                        rank = p[0]
-                        pk = p[1]
-                        previous_rank[pk] = rank
-                        
-                    snapshots.append(snapshot)                
-
-            # For this game we now have all the snapshots and we can save a game tuple
-            # to the leaderboards list. We must have at least one snapshot, because we
-            # ignored all games with 0 recorded sessions already in buiulding our list 
-            # games. So if we don't have any something really bizarre has happened/  
-            assert len(snapshots) > 0, "Internal error: Game was in list for which no leaderboard snapshot was found. It should not have been in the list."
-
-            # We reverse the snapshots back to newest first oldest last                                
-            snapshots.reverse()
-            
-            # Then build the game tuple with all its snapshots
-            leaderboards.append((game.pk, game.BGGid, game.name, snapshots))
-
-    request.session["leaderboard_cache"] = lb_cache
+        return StreamingHttpResponse(as_request_user(request, stream()), content_type='application/x-ndjson')
+    
+    leaderboards = list(game_leaderboards(lo, games))
+    if compact:
+        leaderboards = [compact_leaderboard(leaderboard, players) for leaderboard in leaderboards]
 
-    # raw is asked for on a standard page load, when a true AJAX request is underway it's false.
-    return leaderboards if raw else HttpResponse(json.dumps((title, subtitle, lo.as_dict(), leaderboards), cls=DjangoJSONEncoder))
+    return HttpResponse(json.dumps((title, subtitle, lo.as_dict(), leaderboards), cls=DjangoJSONEncoder))
 
 def ajax_Game_Properties(request, pk):
     '''
@@ -865,11 +953,55 @@ def ajax_Game_Properties(request, pk):
       
     return HttpResponse(json.dumps(props))
 
+def ajax_Rating_Jobs(request):
+    '''
+    A view that returns the status of rating jobs that are queued or running, so that a 
+    page can report which games' leaderboards are still updating.
+    '''
+    jobs = RatingJob.objects.filter(status__in=[RatingJob.QUEUED, RatingJob.RUNNING]).select_related('game')
+    
+    status = [{'game': job.game.pk, 
+               'game_name': job.game.name, 
+               'since': job.since, 
+               'status': job.status, 
+               'queued': job.queued} for job in jobs]
+      
+    return HttpResponse(json.dumps(status, cls=DjangoJSONEncoder))
+
+def ajax_Rating_History(request):
+    '''
+    A view that streams the rating history of a game as JSON, for charting skill and leaderboard
+    positions over time (see Game.rating_history). 
+    
+    Takes GET parameters:
+        game:     the pk of the game
+        players:  an optional comma separated list of player pks, else all players are reported
+        
+    Returns a JSON list of [date_time, player, mu, sigma, eta, rank] lists, in time order.
+    '''
+    try:
+        game = Game.objects.get(pk=int(request.GET.get('game', '')))
+    except (ValueError, Game.DoesNotExist):
+        return HttpResponse(json.dumps("No such game."), status=404)
+
+    players = [int(p) for p in request.GET.get('players', '').split(',') if p.strip().isdigit()]
+
+    def stream():
+        yield '['
+        for i, row in enumerate(game.rating_history(players)):
+            yield (',' if i else '') + json.dumps(row, cls=DjangoJSONEncoder)
+        yield ']'
+
+    return StreamingHttpResponse(stream(), content_type='application/json')
+
+@conditional_on_data
 def ajax_List(request, model):
     '''
     Support AJAX rendering of lists of objects on the list view. 
     
-    To achieve this we instantiate a view_List and fetch its queryset then emit its html view. 
+    To achieve this we instantiate a view_List and fetch its queryset then emit its html view.
+    
+    The HTML is streamed, a row at a time, inside the JSON response. 
     ''' 
     view = view_List()
     view.request = request
@@ -878,11 +1010,18 @@ def ajax_List(request, model):
     
     view_url = reverse("list", kwargs={"model":view.model.__name__})
     json_url = reverse("get_list_html", kwargs={"model":view.model.__name__})
-    html = view.as_html()
     
-    response = {'view_URL':view_url, 'json_URL':json_url, 'HTML':html}
+    # Lists are delivered a page at a time, next is the cursor for the next page (None on the last) 
+    response = {'view_URL':view_url, 'json_URL':json_url, 'next': view.next, 'count': view.count}
+
+    def stream():
+        # The response object, less its closing brace, then the HTML as a JSON string, in pieces
+        yield json.dumps(response, cls=DjangoJSONEncoder)[:-1] + ', "HTML": "'
+        for chunk in view.as_html_stream():
+            yield json.dumps(chunk)[1:-1]
+        yield '", "listed": {}}}'.format(view.start + len(view.queryset))
      
-    return HttpResponse(json.dumps(response))
+    return StreamingHttpResponse(as_request_user(request, stream()), content_type='application/json')
 
 def ajax_Detail(request, model, pk):
     '''
@@ -1060,6 +1199,13 @@ def view_CheckIntegrity(request):
     return HttpResponse("Passed All Integrity Tests")
 
 def view_RebuildRatings(request):
+    '''
+    Rebuild all ratings. 
+    
+    Always serially, in this process and in one transaction. A rebuild in parallel is only 
+    available from the management command (manage.py rebuild_ratings --processes n), as the 
+    worker processes are spawned by running sys.executable, which under uwsgi is not python.
+    '''
     CuserMiddleware.set_user(request.user)
     html = rebuild_ratings()
     return HttpResponse(html)
@@ -1337,17 +1483,22 @@ def rebuild_ratings():
     pr = cProfile.Profile()
     pr.enable()
     
-    Rating.rebuild_all()
+    timings = Rating.rebuild_all()
     pr.disable()
     
     s = io.StringIO()
     ps = pstats.Stats(pr, stream=s).sort_stats('cumulative')
     ps.print_stats()
     result = s.getvalue()
+    
+    games = "<table><tr><th>Game</th><th>Ratings</th><th>Duration</th></tr>"
+    for game, (ratings, duration) in timings.items():
+        games += "<tr><td>{}</td><td>{}</td><td>{}</td></tr>".format(game.name, ratings, duration)
+    games += "</table>"
         
     now = datetime.now()
 
-    return "<html><body<p>{0}</p><p>It is now {1}.</p><p><pre>{2}</pre></p></body></html>".format(title, now, result)
+    return "<html><body<p>{0}</p><p>It is now {1}.</p><p>{2}</p><p><pre>{3}</pre></p></body></html>".format(title, now, games, result)
 
 def force_unique_session_times():
     '''
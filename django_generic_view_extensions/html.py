@@ -9,12 +9,15 @@ but also supporting numerous options that can be passed in through a request (vi
 # Python imports
 import html
 import re
+from functools import lru_cache
+from urllib.parse import quote
 from re import RegexFlag as ref # Specifically to avoid a PyDev Error in the IDE.
 from datetime import datetime 
 
 # Django imports
 from django.conf import settings
 from django.urls import reverse
+from django.utils.http import RFC3986_SUBDELIMS
 from django.utils import six
 from django.utils.html import conditional_escape
 from django.utils.encoding import force_text
@@ -189,33 +192,100 @@ def odm_str(obj, fmt, safe=False):
 # Function to provide rendering methods compatible Django Generic Forms (and then some) 
 #======================================================================================
 
-def list_html_output(self, LDF=None):
-    ''' Helper function for outputting HTML lists of objects (intended for ListViews). 
-    
-        Used by as_table(), as_ul(), as_p(), as_br().
+def odm_str_renderer(model, OSF, LT):
+    '''
+    Returns a function that renders an object of the given model as odm_str(obj, LDF) does 
+    for a list_display_format with elements OSF and link LT. 
     
-        an object display mode (ODM) can be specified to override the one in self.format if desired 
-        as this is what as_table etc do (providing compatible entry points with the Django Generic Forms).
-        
-        self is an instance of ListViewExtended (or any view that wants HTML rendering of a list of objects).
-        
-        Relies on:
-            odm_str:  which displays an object respecting the object_summary_format specified in self.format
-                      which in turn should be populated by get_list_display_format() which parses the request 
-                      for options.
-                      
-            self.queryset:    Which must be initialised by the calling form, defining the list of objects to format in HTML
-            
-            self.format:      Which should be of type list_display_format 
+    odm_str decides which __<detail>_str__ method to use and whether to wrap it in a link 
+    for every object it's given. For a list of objects of one model those decisions depend 
+    only on the model and format, and so are made once here.  
     '''
+    def has(method):
+        return callable(getattr(model, method, None))
     
-    if LDF is None:
-        LDF = self.format.complete
-        
-    LMF = self.format.menus
-    LIF = self.format.index
-    LKF = self.format.key
+    def escaped_verbose_str(obj):
+        return html.escape(obj.__verbose_str__())
+    
+    if OSF == osf.detail:
+        if has('__detail_str__'):
+            strobj = lambda obj: obj.__detail_str__(LT)
+        elif has('__rich_str__'):
+            strobj = lambda obj: obj.__rich_str__(LT)
+        elif has('__verbose_str__'):
+            strobj = escaped_verbose_str
+        else: 
+            strobj = fmt_str
+    elif OSF == osf.rich:
+        if has('__rich_str__'):
+            strobj = lambda obj: obj.__rich_str__(LT)
+        elif has('__verbose_str__'):
+            strobj = escaped_verbose_str
+        else: 
+            strobj = fmt_str
+    elif OSF & osf.verbose:
+        if has('__verbose_str__'):
+            strobj = escaped_verbose_str
+        else: 
+            strobj = fmt_str
+    else:
+        strobj = fmt_str
+
+    # Rich and Detail views on an object are responsible for their own linking.
+    # Verbose and Brief views don't so we apply a link wrapper if requested.   
+    if OSF == osf.detail or OSF == osf.rich:
+        return strobj
+    elif LT == flt.internal and hasattr(model, "link_internal"):
+        link = "link_internal"
+    elif LT == flt.external and hasattr(model, "link_external"):
+        link = "link_external"
+    else:
+        return strobj
+    
+    Awrapper = "<A href='{}' class='" + FIELD_LINK_CLASS + "'>{}</A>"
+    
+    def linked_str(obj):
+        url = getattr(obj, link, None)
+        return Awrapper.format(url, strobj(obj)) if url else strobj(obj)
+    
+    return linked_str
+
+# A placeholder for the pk in URLs, which are reversed once per list (not once per object)
+PK_PLACEHOLDER = "PK_PLACEHOLDER"
+
+def url_template(name, model_name, query=""):
+    '''
+    Returns a format string for the URL of the named view of an object of the named 
+    model, with a {pk} field to fill in and the query (GET parameters) appended. 
+    '''
+    url = reverse(name, kwargs={'model': model_name, 'pk': PK_PLACEHOLDER}) + query
+    return url.replace('{', '{{').replace('}', '}}').replace(PK_PLACEHOLDER, '{pk}')
 
+@lru_cache(maxsize=256)
+def list_row_renderer(model, model_name, LDF, OSF, LT, LMF, LIF, LKF, query, authenticated):
+    '''
+    Compiles a renderer for the rows of a list of objects (intended for ListViews). That is
+    everything that is the same for every row (the layout, the menu, index and key HTML, 
+    the URLs and the choice of __<detail>_str__ method) is worked out once, and the rows 
+    are rendered by filling in just what differs per object.
+    
+    Returns a generator function taking an iterable of objects and the index of the first
+    (less one, so the number of objects that came before them) that yields one row of HTML
+    per object.  
+    
+    Renderers are cached on their arguments:
+    
+    :param model:         The model of the objects that will be listed
+    :param model_name:    The name of the model as it appears in URLs
+    :param LDF:           The layout (an object_display_modes value)
+    :param OSF:           The object summary format (list_display_format.elements)
+    :param LT:            The link target (list_display_format.link)
+    :param LMF:           The menu format (list_display_format.menus)
+    :param LIF:           Whether to include an index (list_display_format.index)
+    :param LKF:           Whether to include the pk (list_display_format.key)
+    :param query:         The query string (filters) to append to the links to the objects
+    :param authenticated: Whether the user is authenticated (and gets edit and delete menu items)
+    '''
     # Define the standard HTML strings for supported formats    
     if LDF == odm.as_table:
         normal_row = "<tr>{menu:s}{index:s}{key:s}<td class='list_item'>{value:s}</td></tr>"
@@ -232,21 +302,27 @@ def list_html_output(self, LDF=None):
     #    View for a DetailView
     #    Edit for an UpdateView
     #    Delete for a DeleteView
+    #
+    # The view url is special. It should conserve filters and ordering so that the 
+    # detail view browses (prior/next links) within the ordered filtered view.
+    url_view = url_template('view', model_name, query)
+    url_edit = url_template('edit', model_name)
+    url_delete = url_template('delete', model_name)
 
     if LMF == lmf.none:
         menu = ""
     elif LMF == lmf.text:
         text = "<span class='list_menu_text'>[<a href={} class='list_menu_link'>{}</a>] </span>"
-        menu = text.format("'{view:s}'", 'view')
-        if self.request.user.is_authenticated:
-            menu += text.format("'{edit:s}'", 'edit') + text.format("'{delete:s}'", 'delete')
+        menu = text.format("'{}'".format(url_view), 'view')
+        if authenticated:
+            menu += text.format("'{}'".format(url_edit), 'edit') + text.format("'{}'".format(url_delete), 'delete')
         if LDF == odm.as_table:
             menu = "<td class='list_menu_cell'>{}</td>".format(menu)                    
     elif LMF == lmf.buttons:
         button = "<input type='button' onclick='location.href={};' value='{}' class='list_menu_button' /> "
-        menu = button.format('"{view:s}"', 'view')
-        if self.request.user.is_authenticated:
-            menu += button.format('"{edit:s}"', 'edit') + button.format('"{delete:s}"', 'delete')
+        menu = button.format('"{}"'.format(url_view), 'view')
+        if authenticated:
+            menu += button.format('"{}"'.format(url_edit), 'edit') + button.format('"{}"'.format(url_delete), 'delete')
         if LDF == odm.as_table:
             menu = "<td class='list_menu_cell'>{}</td>".format(menu)                    
 
@@ -266,37 +342,57 @@ def list_html_output(self, LDF=None):
     else:
         key = ""
 
-    # Collect output lines in a list
-    output = []
+    # One format string for the whole row, with only {pk}, {key}, {index} and {value} left to fill 
+    row = normal_row.format(menu=menu, index=index, key=key, value="{value}")
+    value = odm_str_renderer(model, OSF, LT)
+    
+    def render(objects, start=0):
+        for i, o in enumerate(objects, start + 1):
+            yield row.format(pk=quote(str(o.pk), safe=RFC3986_SUBDELIMS + '~:@'), key=o.pk, index=i, value=value(o))
+        
+    return render
 
-    # This evaluates the queryset
-    i = 1
-    for o in self.queryset:
-        url_view = reverse('view', kwargs={'model': self.kwargs['model'], 'pk': o.pk})
-        url_edit = reverse('edit', kwargs={'model': self.kwargs['model'], 'pk': o.pk})
-        url_delete = reverse('delete', kwargs={'model': self.kwargs['model'], 'pk': o.pk})
+def list_html_rows(self, LDF=None):
+    ''' Generator of the HTML rows of a list of objects (intended for ListViews), one per object.
+    
+        an object display mode (ODM) can be specified to override the one in self.format if desired 
+        as this is what as_table etc do (providing compatible entry points with the Django Generic Forms).
         
-        # The view url is special. It should conserve filters and ordering so that the 
-        # detail view browses (prior/next links) within the ordered filtered view.
-        if getattr(self, 'filterset', False):
-            filters = format_filterset(self.filterset, as_text=False)
-            url_view += "?" + "&".join(filters)                
+        self is an instance of ListViewExtended (or any view that wants HTML rendering of a list of objects).
         
-        if self.request.user.is_authenticated:
-            html_menu = menu.format(view=url_view, edit=url_edit, delete=url_delete)
-        else:        
-            html_menu = menu.format(view=url_view)
+        Relies on:
+            list_row_renderer: which renders objects respecting self.format, which in turn should be 
+                               populated by get_list_display_format() which parses the request for options.
+                      
+            self.queryset:    Which must be initialised by the calling form, defining the list of objects to format in HTML
+            
+            self.format:      Which should be of type list_display_format 
             
-        html_index = index.format(index=i)
-        i += 1
+            self.start:       Optionally, the number of objects listed before these (on earlier pages) 
+    '''
+    if LDF is None:
+        LDF = self.format.complete
 
-        html_key = key.format(key=o.pk)
-        
-        html_value = six.text_type(odm_str(o, self.format))
-        row = normal_row.format(menu=html_menu, index=html_index, key=html_key, value=html_value)
-        output.append(row)
+    if getattr(self, 'filterset', False):
+        query = "?" + "&".join(format_filterset(self.filterset, as_text=False))
+    else:
+        query = ""
+    
+    render = list_row_renderer(self.model, self.kwargs['model'], LDF, 
+                               self.format.elements, self.format.link, self.format.menus, self.format.index, self.format.key, 
+                               query, self.request.user.is_authenticated)
 
-    return mark_safe('\n'.join(output))
+    # This evaluates the queryset (the index continues from earlier pages, if any) 
+    return render(self.queryset, getattr(self, 'start', 0))
+
+def list_html_output(self, LDF=None):
+    ''' Helper function for outputting HTML lists of objects (intended for ListViews). 
+    
+        Used by as_table(), as_ul(), as_p(), as_br().
+    
+        Just the rows from list_html_rows (which see) joined up.
+    '''
+    return mark_safe('\n'.join(list_html_rows(self, LDF)))
 
 def object_html_output(self, ODM=None):
     ''' Helper function for outputting HTML formatted objects (intended for DetailViews). 
@@ -573,3 +669,27 @@ def object_as_html(self):
         return mark_safe("<p>" + object_as_br(self) + "</p>")
     else:
         raise ValueError("Internal Error: self.format must always contain one of the HTML layouts.")                
+
+def list_as_html_stream(self):
+    ''' A generator version of object_as_html for ListViews, which yields the list in
+        chunks (the wrapper and a row at a time) so that it can feed a streaming response.
+    '''
+    fmt = self.format.complete
+    
+    if fmt == odm.as_table:
+        wrapper = ("<table>", "</table>")
+    elif fmt == odm.as_ul:
+        wrapper = ("<ul>", "</ul>")
+    elif fmt == odm.as_p:
+        wrapper = ("", "")
+    elif fmt == odm.as_br:
+        wrapper = ("<p>", "</p>")
+    else:
+        raise ValueError("Internal Error: self.format must always contain one of the HTML layouts.")                
+    
+    yield wrapper[0]
+    separator = ""
+    for row in list_html_rows(self):
+        yield separator + row
+        separator = "\n"
+    yield wrapper[1]
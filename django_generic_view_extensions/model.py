@@ -56,7 +56,8 @@ __detail_str__,    are properties like __str__ that permit a model to supply dif
 TODO: Add __table_str__ which returns a TR, and if an arg is specified or if it's a class method perhaps a header TR 
 '''
 # Python imports
-import html, collections, inspect
+import html, collections, inspect, types
+from functools import lru_cache
 
 # Django imports
 from django.db import models
@@ -269,103 +270,141 @@ def object_in_list_format(obj, context):
     
     return field_render(obj, flt, fmt)
 
-def collect_rich_object_fields(view):
+def is_list_field(field):
     '''
-    Passed a view instance (a detail view or delete view is expected, but any view could call this) 
-    which has an object already (view.obj) (so after or in get_object), will define view.fields with 
-    a dictionary of fields that a renderer can walk through later.
-    
-    Additionally view.fields_bucketed is a copy of view.fields in the buckets specified in object_display_format
-    and view.fields_flat and view.fields_list also contain all the view.fields split into the scalar (flat) values
-    and the list values respectively (which are ToMany relations to other models).
-    
-    Expects ManyToMany relationships to be set up bi-directionally, in both involved models, 
-    i.e. makes no special effort to find the reverse relationships and if they are not set up 
-    bi-directionally may miss the indirect, or reverse relationship).
-    
-    Converts foreign keys to the string representation of that related object using the level of
-    detail specified view.format and respecting privacy settings where applicable (values are 
-    obtained through odm_str where privacy constraints are checked. 
+    True if a field has a list value (is a relation to many objects).  
     '''
-    # Build the list of fields 
-    # fields_for_model includes ForeignKey and ManyToMany fields in the model definition
+    return hasattr(field,'is_relation') and field.is_relation and (field.one_to_many or field.many_to_many)
 
-    # Fields are categorized as follows for convenience and layout and performance decisions
-    #    flat or list  
-    #    model, internal, related or properties
-    #
-    # By default we will populate view.fields only with flat model fields.
-    
-    def is_list(field):
-        return hasattr(field,'is_relation') and field.is_relation and (field.one_to_many or field.many_to_many)
+# The object_display_flags that select fields. The others are layout flags.
+FIELD_SELECTION_FLAGS = odf.flat | odf.list | odf.model | odf.internal | odf.related | odf.properties | odf.methods | odf.summaries
+
+def field_plan(model, flags):
+    '''
+    Returns a plan for collect_rich_object_fields, that is the fields, properties, property_methods 
+    and summaries of a model that the object_display_flags select, as a tuple of four lists:
     
+        fields:             tuples of (field, bucket, kind, attname, label) where kind is one of "list", 
+                            "bitfield" or "flat", and attname the attribute holding a list's objects
+        properties:         names of properties
+        property_methods:   names of property_methods
+        summaries:          names of summary methods
+
+    Finding them means walking the model's fields, its dir() and the annotations on its properties 
+    and methods, none of which changes while the process runs. So plans are cached, per model and 
+    selection of fields (the layout flags don't matter), and can be warmed (made) at startup. 
+
+    :param model:    A Django model
+    :param flags:    object_display_flags
+    '''
+    return _field_plan(model, flags & FIELD_SELECTION_FLAGS)
+
+@lru_cache(maxsize=None)
+def _field_plan(model, ODF):
     def is_property(name):
-        return isinstance(getattr(view.model, name), property)
+        return isinstance(getattr(model, name, None), property)
     
     def is_bitfield(field):
         return type(field).__name__=="BitField"
 
-    ODF = view.format.flags
-
-    all_fields = view.obj._meta.get_fields()                    # All fields
+    def is_selected(return_type):
+        return (isListType(return_type) and ODF & odf.list) or (not isListType(return_type) and ODF & odf.flat)
 
-    model_fields = collections.OrderedDict()                    # Editable fields in the model
-    internal_fields = collections.OrderedDict()                 # Non-editable fields in the model
-    related_fields = collections.OrderedDict()                  # Fields in other models related to this one
-    
-    # Categorize all fields into one of the three buckets above (model, internal, related)
-    for field in all_fields:
-        if (is_list(field) and ODF & odf.list) or (not is_list(field) and ODF & odf.flat):
+    # Categorize all fields into one of three buckets (model, internal, related)
+    fields = []
+    for field in model._meta.get_fields():
+        if (is_list_field(field) and ODF & odf.list) or (not is_list_field(field) and ODF & odf.flat):
             if field.is_relation:
-                if ODF & odf.related:
-                    related_fields[field.name] = field
-            else: 
-                if ODF & odf.model and field.editable and not field.auto_created:
-                    model_fields[field.name] = field
-                elif ODF & odf.internal:
-                    internal_fields[field.name] = field
+                bucket = odf.related if ODF & odf.related else None
+            elif ODF & odf.model and field.editable and not field.auto_created:
+                bucket = odf.model
+            elif ODF & odf.internal:
+                bucket = odf.internal
+            else:
+                bucket = None
+            
+            if not bucket is None:
+                if is_list_field(field):
+                    attname = field.name if hasattr(field,'attname') else field.name+'_set' if field.related_name is None else field.related_name   # If it's a model field it has an attname attribute, else it's a _set atttribute
+                    fields.append((field, bucket, "list", attname, safetitle(attname.replace('_', ' '))))
+                elif is_bitfield(field):
+                    fields.append((field, bucket, "bitfield", None, safetitle(field.verbose_name)))
+                else:
+                    fields.append((field, bucket, "flat", None, safetitle(field.verbose_name)))
 
     # List properties, but respect the format request (list and flat selectors)  
     properties = []
     if ODF & odf.properties:
-        for name in dir(view.model):
+        for name in dir(model):
             if is_property(name):
-                # Function annotations appear in Python 3.6. In 3.5 and earlier they aren't present.
                 # Use the annotations provided on model properties to classify properties and include 
                 # them based on the classification. The classification is for list and flat respecting 
                 # the object_display_flags selected. That is all we need here.
-                if hasattr(getattr(view.model,name).fget, "__annotations__"):
-                    annotations = getattr(view.model,name).fget.__annotations__
-                    if "return" in annotations:
-                        return_type = annotations["return"]
-                        if (isListType(return_type) and ODF & odf.list) or (not isListType(return_type) and ODF & odf.flat):
-                            properties.append(name)
-                    else:
-                        properties.append(name)
-                else:
+                annotations = getattr(getattr(model, name).fget, "__annotations__", {})
+                if not "return" in annotations or is_selected(annotations["return"]):
                     properties.append(name)
 
     # List properties_methods, but respect the format request (list and flat selectors)  
-    # Look for property_methods (those decorated with property_method and having defaults for all parameters)
+    # Look for property_methods (those decorated with property_method and having defaults for 
+    # all parameters). They are bound to the model to check that (as they would be to an object).
     property_methods = []
     if ODF & odf.methods:
-        for method in inspect.getmembers(view.obj, predicate=is_property_method):
-            name = method[0]
-            if hasattr(getattr(view.model,name), "__annotations__"):
-                annotations = getattr(view.model,name).__annotations__
-                if "return" in annotations:
-                    return_type = annotations["return"]
-                    if (isListType(return_type) and ODF & odf.list) or (not isListType(return_type) and ODF & odf.flat):
-                        property_methods.append(name)
-                else:
+        for name, member in inspect.getmembers(model, predicate=inspect.isfunction):
+            if is_property_method(types.MethodType(member, model)):
+                annotations = getattr(member, "__annotations__", {})
+                if not "return" in annotations or is_selected(annotations["return"]):
                     property_methods.append(name)
 
     # List summaries (these are always flat) 
     summaries = []
     if ODF & odf.summaries:
         for summary in summary_methods:
-            if hasattr(view.model, summary) and callable(getattr(view.model, summary)):
+            if hasattr(model, summary) and callable(getattr(model, summary)):
                 summaries.append(summary)
+                
+    return (fields, properties, property_methods, summaries)
+
+def warm_field_plans(models, flags=(odf._normal, odf._all_model, odf._all)):
+    '''
+    Makes the field plans (see field_plan) for the given models and object_display_flags,
+    so that the first requests to view objects needn't. Intended for AppConfig.ready().
+    '''
+    for model in models:
+        for f in flags:
+            field_plan(model, f)
+
+def collect_rich_object_fields(view):
+    '''
+    Passed a view instance (a detail view or delete view is expected, but any view could call this) 
+    which has an object already (view.obj) (so after or in get_object), will define view.fields with 
+    a dictionary of fields that a renderer can walk through later.
+    
+    Additionally view.fields_bucketed is a copy of view.fields in the buckets specified in object_display_format
+    and view.fields_flat and view.fields_list also contain all the view.fields split into the scalar (flat) values
+    and the list values respectively (which are ToMany relations to other models).
+    
+    Expects ManyToMany relationships to be set up bi-directionally, in both involved models, 
+    i.e. makes no special effort to find the reverse relationships and if they are not set up 
+    bi-directionally may miss the indirect, or reverse relationship).
+    
+    Converts foreign keys to the string representation of that related object using the level of
+    detail specified view.format and respecting privacy settings where applicable (values are 
+    obtained through odm_str where privacy constraints are checked. 
+    '''
+    # Build the list of fields 
+    # fields_for_model includes ForeignKey and ManyToMany fields in the model definition
+
+    # Fields are categorized as follows for convenience and layout and performance decisions
+    #    flat or list  
+    #    model, internal, related or properties
+    #
+    # By default we will populate view.fields only with flat model fields.
+    
+    ODF = view.format.flags
+
+    # The fields, properties, property_methods and summaries to collect. What they are depends 
+    # only on the model and format, and so the introspection is done once (see field_plan). 
+    fields, properties, property_methods, summaries = field_plan(view.model, ODF)
 
     # Define some (empty) buckets for all the fields so we can group them on 
     # display (by model, internal, related, property, scalars and lists)
@@ -406,76 +445,40 @@ def collect_rich_object_fields(view):
     # and we want to fetch the actual string representation of that reference an save 
     # that not the pk. The question is which string (see object_list_format() for the
     # types of string we support).
-    for field in all_fields:
-        # All fields in other models that point to this one should have an is_relation flag
-
-        # These are the field types we can expect:
-        #    flat
-        #        simple:            a simple database field in this model
-        #        many_to_one:       this is a ForeignKey field pointing to another model
-        #        one_to_one:        this is a OneToOneField
-        #    list:
-        #        many_to_many:      this is a ManyToManyField, so this object could be pointing at many making a list of items
-        #        one_to_many        this is an _set field (i.e. has a ForeignKey in another model pointing to this model and this field is the RelatedManager)
-        #
-        # We want to build a fields dictionaries here with field values
-        # There are two types of field_value we'd like to report in the result:
-        #    flat values:    fields_flat contains these
-        #                            if the field is scalar, just its value
-        #                            if the field is a relation (a foreign object) its string representation
-        #    list values:    fields_list contains these
-        #                            if the field is a relation to many objects, a list of their string representations
-        #
-        # We also build fields_model and fields_other
-
+    for (field, bucket, kind, attname, label) in fields:
         print_debug(f"Collecting Rich Object Field: {field.name}")
-        bucket = (odf.model if field.name in model_fields
-            else odf.internal if field.name in internal_fields
-            else odf.related if field.name in related_fields
-            else None)
-
-        if not bucket is None:
-            if is_list(field):
-                if ODF & odf.list:
-                    attname = field.name if hasattr(field,'attname') else field.name+'_set' if field.related_name is None else field.related_name   # If it's a model field it has an attname attribute, else it's a _set atttribute
-                    
-                    field.is_list = True
-                    field.label = safetitle(attname.replace('_', ' '))
-        
-                    ros = apply_sort_by(getattr(view.obj, attname).all())
         
-                    if len(ros) > 0:
-                        field.value = [odm_str(item, view.format.mode) for item in ros]
-                    else:
-                        field.value = NONE
+        field.label = label
+        field.is_list = kind == "list"
         
-                    view.fields_list[bucket][field.name] = field
-            elif is_bitfield(field):
-                if ODF & odf.flat:
-                    flags = []
-                    for f in field.flags:
-                        bit = getattr(getattr(view.obj, field.name), f)
-                        if bit.is_set:
-                            flags.append(getattr(view.obj, field.name).get_label(f))
-                    field.is_list = False
-                    field.label = safetitle(field.verbose_name)
-                    
-                    if len(flags) > 0:
-                        field.value = odm_str(", ".join(flags), view.format.mode)
-                    else:
-                        field.value = NONE
-                                    
-                    view.fields_flat[bucket][field.name] = field
+        if kind == "list":
+            ros = apply_sort_by(getattr(view.obj, attname).all())
+
+            if len(ros) > 0:
+                field.value = [odm_str(item, view.format.mode) for item in ros]
             else:
-                if ODF & odf.flat:
-                    field.is_list = False
-                    field.label = safetitle(field.verbose_name)
-                    
-                    field.value = odm_str(getattr(view.obj, field.name), view.format.mode)
-                    if not str(field.value):
-                        field.value = NOT_SPECIFIED
-                        
-                    view.fields_flat[bucket][field.name] = field
+                field.value = NONE
+
+            view.fields_list[bucket][field.name] = field
+        elif kind == "bitfield":
+            flags = []
+            for f in field.flags:
+                bit = getattr(getattr(view.obj, field.name), f)
+                if bit.is_set:
+                    flags.append(getattr(view.obj, field.name).get_label(f))
+            
+            if len(flags) > 0:
+                field.value = odm_str(", ".join(flags), view.format.mode)
+            else:
+                field.value = NONE
+                            
+            view.fields_flat[bucket][field.name] = field
+        else:
+            field.value = odm_str(getattr(view.obj, field.name), view.format.mode)
+            if not str(field.value):
+                field.value = NOT_SPECIFIED
+                
+            view.fields_flat[bucket][field.name] = field
 
     # Capture all the property, property_method and summary values as needed (these are not fields)
     if ODF & odf.properties or ODF & odf.methods or ODF & odf.summaries:
@@ -34,7 +34,8 @@ defaults = { 'object_summary_format': 'brief',
              'object_display_modes': 'as_table',
              'index': False, 
              'key': False,
-             'ordering': ''
+             'ordering': '',
+             'page_size': 100
             }
 
 # The URL parameters that select the defaults above
@@ -47,7 +48,8 @@ urldefaults = { 'object_summary_format': 'brief',
              'object_display_flags': 'TODO',
              'object_display_modes': 'as_table',
              'index': 'noindex',
-             'key': 'nokey'
+             'key': 'nokey',
+             'page_size': 100
             }
 
 def default(obj):
@@ -277,6 +279,7 @@ class list_display_format():
     index = default('index')                    # A bool with request an index, counting 1, 2, 3, 4 down the list.
     key = default('key')                        # A bool with request the object's primary key to displayed
     ordering = default('ordering')              # The list of fields ot order by if any
+    page_size = default('page_size')            # The number of objects to list at a time (0 for all of them)
 
 def get_list_display_format(request):
     '''
@@ -306,6 +309,12 @@ def get_list_display_format(request):
 
     if 'ordering' in request:
         LDF.ordering = request['ordering']
+
+    if 'page_size' in request:
+        try:
+            LDF.page_size = max(0, int(request['page_size']))
+        except ValueError:
+            LDF.page_size = list_display_format().page_size
              
     return LDF
 
@@ -4,7 +4,32 @@ Django Generic View Extensions
 QuerySet Extensions
 
 '''
-from django.db import connection
+import hashlib
+import uuid
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.core.cache import caches
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+
+# The cache that counts (and their version) are kept in. It should be one that all processes
+# share (not a LocMemCache), else a write in one process can't invalidate the counts cached in
+# another (until they time out).
+COUNT_CACHE = getattr(settings, 'GENERIC_VIEW_COUNT_CACHE', 'default')
+
+# How long (in seconds) a cached count lives, an upper bound on how stale one can be if
+# the count cache is not shared.
+COUNT_CACHE_TIMEOUT = 300
+COUNT_VERSION_KEY = "count_version"
+
+# Writes to the models of these apps, or to these models (by label, as in "app.Model"), don't
+# invalidate cached counts. Django's own bookkeeping (sessions, logins and the like) and any
+# models a site names in GENERIC_VIEW_COUNT_IGNORE, that no list counts depend on. Else the 
+# counts would hardly survive a request.
+COUNT_IGNORED_APPS = {'sessions', 'auth', 'admin', 'contenttypes'}
+COUNT_IGNORED_MODELS = set(getattr(settings, 'GENERIC_VIEW_COUNT_IGNORE', []))
 
 def get_SQL(queryset, explain=False):
     '''
@@ -133,3 +158,171 @@ def top(queryset, number_of_rows, use_slice=True):
         
         # And we can return the raw queryset we've built
         return queryset.model.objects.raw(sql, params)
+
+
+def expand_ordering(model, name):
+    '''
+    Expands an ordering field name as Django does when ordering by it. That is, a
+    relation is ordered by the related model's Meta ordering (not its primary key).
+
+    Returns a list of field names (with "-" prefixes for descending).
+
+    :param model:   The model being ordered
+    :param name:    A field name, optionally with a "-" prefix and "__" lookups
+    '''
+    descending = name.startswith('-')
+    path = name.lstrip('-').split('__')
+
+    related = model
+    try:
+        for p in path:
+            field = related._meta.pk if p == 'pk' else related._meta.get_field(p)
+            if field.is_relation:
+                related = field.related_model
+    except FieldDoesNotExist:
+        return [name]
+
+    if field.is_relation and related._meta.ordering and path[-1] != field.attname:
+        prefix = '__'.join(path) + '__'
+        expanded = []
+        for o in related._meta.ordering:
+            for e in expand_ordering(related, o):
+                flip = e.startswith('-') != descending
+                expanded.append(('-' if flip else '') + prefix + e.lstrip('-'))
+        return expanded
+    else:
+        return [name]
+
+
+def keyset_ordering(model, ordering):
+    '''
+    Returns an ordering (list of field names, with "-" prefixes for descending) that
+    is unique, that is, which ends with the primary key as a tie breaker if it doesn't
+    already include it. Keyset pagination relies on a unique ordering.
+
+    Relations are expanded (see expand_ordering) so that the values seek() compares
+    are those the database ordered by.
+
+    :param model:       The model being ordered
+    :param ordering:    A list of field names (or None)
+    '''
+    expanded = []
+    for name in ordering or []:
+        expanded += expand_ordering(model, name)
+
+    pk_names = ('pk', model._meta.pk.name)
+    if not any(f.lstrip('-') in pk_names for f in expanded):
+        expanded.append('pk')
+    return expanded
+
+
+def reverse_ordering(ordering):
+    '''
+    Returns an ordering reversed (every field's direction flipped). In PostgreSQL that
+    also moves NULLs to the other end, so that it is exactly the reverse.
+    '''
+    return [f[1:] if f.startswith('-') else '-' + f for f in ordering]
+
+
+def ordering_values(model, ordering, pk):
+    '''
+    Returns a dict of the values of the ordering fields in the object with the given
+    primary key (None if there is no such object). These are the keys seek() compares.
+    '''
+    return model.objects.filter(pk=pk).values(*[f.lstrip('-') for f in ordering]).first()
+
+
+def seek(queryset, ordering, after, values=None):
+    '''
+    Keyset (seek) pagination. Returns the queryset filtered to the objects that come
+    after a given object in the given ordering.
+
+    Unlike an OFFSET, which has the database read and discard every row before the page,
+    this filter lets the database start reading at the page (from an index on the ordering
+    fields ideally) and so every page costs the same, the last as cheap as the first.
+
+    For ordering fields (f1, f2, ... fn) with values (v1, v2, ... vn) in the object
+    after which we seek, the filter is:
+
+        f1 > v1 OR (f1 = v1 AND f2 > v2) OR ... OR (f1 = v1 AND ... AND fn > vn)
+
+    with < in place of > for descending fields. NULLs are placed as PostgreSQL does,
+    last in ascending and first in descending order.
+
+    :param queryset:    The queryset, ordered by ordering
+    :param ordering:    A unique ordering (see keyset_ordering) of simple field names
+    :param after:       The primary key of the object to seek past
+    :param values:      Optionally the ordering_values() of that object, if they're known
+    '''
+    if values is None:
+        values = ordering_values(queryset.model, ordering, after)
+
+    # The object was deleted. Its position is lost, and with it the rest of the list.
+    if values is None:
+        return queryset.none()
+
+    seek = Q()
+    equal = Q()
+    for f in ordering:
+        field = f.lstrip('-')
+        value = values[field]
+        descending = f.startswith('-')
+
+        if value is None:
+            # NULLs are last ascending (nothing follows them) and first descending
+            following = Q(**{f"{field}__isnull": False}) if descending else None
+            same = Q(**{f"{field}__isnull": True})
+        else:
+            if descending:
+                following = Q(**{f"{field}__lt": value})
+            else:
+                following = Q(**{f"{field}__gt": value}) | Q(**{f"{field}__isnull": True})
+            same = Q(**{field: value})
+
+        if not following is None:
+            seek |= equal & following
+        equal &= same
+
+    # If nothing follows the object, Q() would match everything.
+    return queryset.filter(seek) if seek else queryset.none()
+
+
+def count_version():
+    '''
+    The version of cached counts. Any write to the database changes it, invalidating
+    them all (which is coarse, but counts filtered on related models are then safe).
+    
+    Versions are random, so that if this is evicted from the cache it is not reused.
+    '''
+    return caches[COUNT_CACHE].get_or_set(COUNT_VERSION_KEY, lambda: uuid.uuid4().hex, None)
+
+
+def invalidate_counts(sender, **kwargs):
+    '''
+    A signal receiver that invalidates all cached counts, on a write to any model that is not
+    ignored (see COUNT_IGNORED_APPS and COUNT_IGNORED_MODELS).
+    
+    Inside a transaction this happens when it commits. Else a count of the data before the
+    write, taken while the transaction runs, is cached under the new version.
+    '''
+    meta = sender._meta
+    if meta.app_label in COUNT_IGNORED_APPS or meta.label in COUNT_IGNORED_MODELS:
+        return
+    
+    transaction.on_commit(lambda: caches[COUNT_CACHE].set(COUNT_VERSION_KEY, uuid.uuid4().hex, None))
+
+post_save.connect(invalidate_counts, dispatch_uid="invalidate_counts_on_save")
+post_delete.connect(invalidate_counts, dispatch_uid="invalidate_counts_on_delete")
+m2m_changed.connect(invalidate_counts, dispatch_uid="invalidate_counts_on_m2m_change")
+
+
+def cached_count(queryset):
+    '''
+    Returns queryset.count(), from the cache if it has been counted since the last write.
+
+    A count() is cheaper than len() (which loads every row) but still scans the table or
+    an index, and a list view needs two on every page (the filtered and the total count).
+    '''
+    sql, params = queryset.query.sql_with_params()
+    key = "count_" + hashlib.md5(repr((queryset.db, sql, params)).encode()).hexdigest()
+    return caches[COUNT_CACHE].get_or_set(key, queryset.count, COUNT_CACHE_TIMEOUT, version=count_version())
@@ -44,14 +44,15 @@ from dal import autocomplete
 
 # Package imports
 from .util import app_from_object, class_from_string
-from .html import list_html_output, object_html_output, object_as_html, object_as_table, object_as_ul, object_as_p, object_as_br
+from .html import list_html_output, list_as_html_stream, object_html_output, object_as_html, object_as_table, object_as_ul, object_as_p, object_as_br
 from .context import add_model_context, add_timezone_context, add_format_context, add_filter_context, add_ordering_context, add_debug_context
 from .options import get_list_display_format, get_object_display_format
 from .neighbours import get_neighbour_pks
 from .model import collect_rich_object_fields, inherit_fields, add_related
 from .debug import print_debug
 from .forms import get_related_forms, save_related_forms
-from .filterset import format_filterset, is_filter_field 
+from .filterset import format_filterset, is_filter_field
+from .queryset import keyset_ordering, seek, cached_count 
 
 
 def get_filterset(self):
@@ -179,6 +180,7 @@ class ListViewExtended(ListView):
     as_p = object_as_p
     as_br = object_as_br
     as_html = object_as_html  # Chooses one of the first three based on request parameters
+    as_html_stream = list_as_html_stream  # The same, in chunks for a streaming response
 
     # Fetch all the objects for this model
     def get_queryset(self, *args, **kwargs):
@@ -207,7 +209,34 @@ class ListViewExtended(ListView):
         if (self.ordering): 
             self.queryset = self.queryset.order_by(*self.ordering)
             
-        self.count = len(self.queryset)
+        self.count = cached_count(self.queryset)
+        
+        # Lists are delivered a page at a time (if a page size is set). Pages are found by 
+        # seeking past the last object on the previous one (keyset pagination), which needs
+        # a unique ordering. "after" is the pk of that object and "start" its index.
+        try:
+            self.after = int(self.request.GET['after'])
+        except (KeyError, ValueError):
+            self.after = None
+        try:
+            self.start = max(0, int(self.request.GET.get('start', 0)))
+        except ValueError:
+            self.start = 0
+            
+        self.next = None
+        if self.format.page_size:
+            ordering = keyset_ordering(self.model, self.ordering)
+            self.queryset = self.queryset.order_by(*ordering)
+            
+            if not self.after is None:
+                self.queryset = seek(self.queryset, ordering, self.after)
+            
+            self.queryset = self.queryset[:self.format.page_size]
+            
+            # This evaluates the queryset (and caches the page for rendering)
+            page = list(self.queryset)
+            if len(page) == self.format.page_size:
+                self.next = page[-1].pk
         
         return self.queryset
 
@@ -221,7 +250,10 @@ class ListViewExtended(ListView):
         add_filter_context(self, context)
         add_ordering_context(self, context)
         add_debug_context(self, context)
-        context["total"] = self.model.objects.all().count        
+        context["count"] = self.count
+        context["total"] = cached_count(self.model.objects.all())
+        context["next"] = self.next
+        context["start"] = self.start
         if callable(getattr(self, 'extra_context_provider', None)): context.update(self.extra_context_provider())
         return context
 
@@ -263,22 +295,33 @@ class DetailViewExtended(DetailView):
         # Get Neighbour info for the object browser
         self.filterset = get_filterset(self)
         
-        neighbours = get_neighbour_pks(self.model, self.pk, filterset=self.filterset, ordering=self.ordering)            
+        # A browser that knows the object's row number (it browsed here from a neighbour) 
+        # can say so, and spare us counting the objects before it. 
+        try:
+            row = int(self.request.GET['row']) if 'row' in self.request.GET else None
+        except ValueError:
+            row = None
+
+        neighbours = get_neighbour_pks(self.model, self.pk, filterset=self.filterset, ordering=self.ordering, row=row)            
     
         # Support for incoming next/prior requests via a GET
         if 'next' in self.request.GET or 'prior' in self.request.GET:
             self.ref = get_object_or_404(self.model, pk=self.pk)
             
-            # If requesting the next or prior object look for that      
-            # FIXME: Totally fails for Ranks, the get dictionary fails when there are ties!
-            #        Doesn't generalise well at all. Must find a general way to do this for
-            #        arbitrary orders. Still should specify orders in models that create unique 
-            #        ordering not reliant on pk break ties. 
-            if neighbours:
+            # If requesting the next or prior object look for that (ties in the
+            # ordering are broken by pk, so neighbours are always well defined). 
+            if len(neighbours) == 4:
+                step = 0
                 if 'next' in self.request.GET and not neighbours[1] is None:
-                    self.pk = self.object_browser[1]
+                    self.pk = neighbours[1]
+                    step = 1
                 elif 'prior' in self.request.GET and not neighbours[0] is None:
-                    self.pk = self.object_browser[0]
+                    self.pk = neighbours[0]
+                    step = -1
+                
+                if step:
+                    row = neighbours[2] + step if neighbours[2] else None
+                    neighbours = get_neighbour_pks(self.model, self.pk, filterset=self.filterset, ordering=self.ordering, row=row)
                                     
             self.obj = get_object_or_404(self.model, pk=self.pk)
             self.kwargs["pk"] = self.pk                             
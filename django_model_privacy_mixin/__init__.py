@@ -4,17 +4,253 @@ Created on 8Mar.,2018
 @author: Bernd Wechner
 @status: Alpha - works and is in use on a dedicated project. Is not complete, and needs testing for generalities.
 
-Provides one class PrivacyMixIn which adds Privacy support for model fields in a Django model.
+Provides one class PrivacyMixIn which adds Privacy support for model fields in a Django model,
+and PrivacyQuerySet which enforces it on all the objects a query loads together.
 
 TODO: Document here
 
 '''
 
 import inspect
-from django.core.exceptions import PermissionDenied
+import threading
+from django.db import models
+from django.core.exceptions import PermissionDenied, FieldDoesNotExist
 from django.forms.models import fields_for_model
 from cuser.middleware import CuserMiddleware
 
+_local = threading.local()
+
+def app_from_object(o):
+    '''Given an object returns the name of the Django app that it's declared in'''
+    return type(o).__module__.split('.')[0]    
+
+def model_from_object(o):
+    '''Given an object returns the name of the Django model that it is an instance of'''
+    return o._meta.model.__name__    
+
+def unique_object_id(obj):
+    if hasattr(obj, "pk"):
+        return "{}.{}.{}".format(app_from_object(obj), model_from_object(obj), obj.pk)
+
+def get_User_extensions(user):
+    '''
+    Returns a list of attributes that are in request.user which represent User model extensions. That 
+    is have a OneToOne relationship with User. 
+    '''            
+    ext = []
+    if not user is None and hasattr(user, 'is_authenticated'):
+        if user.is_authenticated:
+            for field in user._meta.get_fields():
+                if field.one_to_one:
+                    ext.append(field.name)
+    return ext
+
+def get_User_membership(user, extensions, field_name):
+    '''
+    Given a user (from request.user, and extensions (from get_User_extensions) will check them for
+    an attribute of field_name and for each one it finds will attempt to add its value or values 
+    to the membership set that it will return.
+    '''
+    membership = set()
+    if hasattr(user, field_name):
+        field = getattr(user, field_name, None)
+        if hasattr(field, 'all') and callable(field.all):
+            membership.add((str(o) for o in field.all())) 
+        elif not field is None: 
+            membership.add(str(field))
+
+    for e in extensions:
+        obj = getattr(user, e, None)
+        if hasattr(obj, field_name):
+            field = getattr(obj, field_name)
+            if hasattr(field, 'all') and callable(field.all):
+                membership.update([unique_object_id(o) for o in field.all()])
+            elif not field is None: 
+                membership.add(unique_object_id(field))
+                
+    return membership
+
+def get_User_flag(user, extensions, field_name):
+    '''
+    Given a user (from request.user, and extensions (from get_User_extensions) will check them for
+    an attribute of field_name and if it's a bool return the value of the first one it finds. Gives
+    priority to User model extensions but in no guaranteed order.
+    '''
+    for e in extensions:
+        obj = getattr(user, e)
+        if hasattr(obj, field_name):
+            field = getattr(obj, field_name)
+            if type(field) == bool:
+                return field
+
+    if hasattr(user, field_name):
+        field = getattr(user, field_name)
+        if type(field) == bool:
+            return field
+
+def get_Owner(obj):
+    '''
+    A generic attempt to find an owner for the object passed. Basically checks the object for a field 
+    called owner which returns a user that is the objects owner. Simple really ;-) Best implemented as 
+    property in the model as in:
+    
+        @property
+        def owner(self) -> User:
+            return <a field in the object that is of type "models.OneToOneField(User)>           
+    '''
+    if hasattr(obj, 'owner'):
+        return obj.owner
+    else:
+        return None
+
+_privacy_rules = {}
+def privacy_rules(model):
+    '''
+    Returns a list of (rule field, look field) tuples for a model, naming each visibility_* field 
+    and the field it specifies visibility rules for. 
+    '''
+    if not model in _privacy_rules:
+        prefix = 'visibility_'
+        _privacy_rules[model] = [(field.name, field.name[len(prefix):]) for field in model._meta.get_fields() if field.name.startswith(prefix)]
+    return _privacy_rules[model]
+
+class PrivacyContext():
+    '''
+    What privacy rules need to know about a (viewing) user, their User model extensions, flags and 
+    memberships, derived once (as rules need them) and not for every object tested.
+    
+    Kept on the user object (see of()) and so, as request.user is, it lasts one request.  
+    '''
+    def __init__(self, user):
+        self.user = user
+        self.extensions = get_User_extensions(user)
+        self.flags = {}
+        self.memberships = {}
+
+    @classmethod
+    def of(cls, user):
+        '''
+        Returns the PrivacyContext of a user.
+        '''
+        context = getattr(user, '_privacy_context', None)
+        if context is None:
+            context = cls(user)
+            if not user is None:
+                user._privacy_context = context
+        return context
+        
+    def flag(self, field_name):
+        '''
+        The user's flag of field_name (see get_User_flag)
+        '''
+        if not field_name in self.flags:
+            self.flags[field_name] = get_User_flag(self.user, self.extensions, field_name)
+        return self.flags[field_name]
+
+    def membership(self, field_name):
+        '''
+        The user's membership set of field_name (see get_User_membership)
+        '''
+        if not field_name in self.memberships:
+            self.memberships[field_name] = get_User_membership(self.user, self.extensions, field_name)
+        return self.memberships[field_name]
+
+def get_memberships(model, objects):
+    '''
+    Returns the membership sets of a number of objects of one model, for the share_* rules of its 
+    visibility, in one query per rule. That is, a dict keyed on object pk of dicts keyed on field 
+    name of membership sets (as fields_to_hide would build them).
+    
+    Only many to many fields are covered, others are left to fields_to_hide.
+    '''
+    memberships = {obj.pk: {} for obj in objects}
+    
+    prefix = 'share_'
+    for rule in getattr(model, 'visibility', ()):
+        if rule[0].startswith(prefix):
+            check_field = rule[0][len(prefix):]
+            try:
+                field = model._meta.get_field(check_field)
+            except FieldDoesNotExist:
+                continue
+            
+            if field.many_to_many:
+                related = field.related_model
+                label = "{}.{}".format(related.__module__.split('.')[0], related.__name__)
+                
+                for membership in memberships.values():
+                    membership[check_field] = set()
+                
+                for (pk, related_pk) in model._base_manager.filter(pk__in=list(memberships)).values_list('pk', check_field):
+                    if not related_pk is None:
+                        memberships[pk][check_field].add("{}.{}".format(label, related_pk))
+                    
+    return memberships
+
+def apply_privacy(objects, user):
+    '''
+    Enforces the privacy constraints on a number of objects (using PrivacyMixIn models) as a batch. 
+    The same as each enforcing its own, but with the memberships of all of them fetched together 
+    (see get_memberships). 
+    '''
+    models = {}
+    for obj in objects:
+        models.setdefault(type(obj), []).append(obj)
+        
+    for model, objs in models.items():
+        memberships = get_memberships(model, objs)
+        for obj in objs:
+            obj.apply_privacy(user, memberships.get(obj.pk, None))
+
+class deferred_privacy():
+    '''
+    A context manager inside which objects loaded from the database don't enforce their privacy 
+    constraints but are collected, so that they can all be enforced as a batch when they're all
+    loaded. 
+    
+        with deferred_privacy() as deferred:
+            ...
+        apply_privacy(deferred.objects, user)
+    '''
+    def __enter__(self):
+        self.previous = getattr(_local, 'deferred', None)
+        self.objects = []
+        _local.deferred = self.objects
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.deferred = self.previous
+
+class PrivacyQuerySet(models.QuerySet):
+    '''
+    A QuerySet for models using the PrivacyMixIn, which enforces privacy on the objects it loads as 
+    a batch (see apply_privacy), rather than one by one as they load. The result is the same, just 
+    with a few queries in place of a few per object.
+    '''
+    _privacy_user = None
+    
+    def with_privacy(self, user):
+        '''
+        Enforces privacy for a given user (by default it's the user CuserMiddleware has, the request.user).
+        '''
+        clone = self._chain()
+        clone._privacy_user = user
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._privacy_user = self._privacy_user
+        return clone
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            with deferred_privacy() as deferred:
+                super()._fetch_all()
+            user = self._privacy_user if not self._privacy_user is None else CuserMiddleware.get_user()
+            apply_privacy(deferred.objects, user)
+        else:
+            super()._fetch_all()
+
 class PrivacyMixIn():
     '''
     A MixIn that adds database load overrides which populates the "hidden" attribute of
@@ -24,7 +260,7 @@ class PrivacyMixIn():
     HIDDEN = "<Hidden>"
     HIDE_EMPTY_FIELD = False    # A flag that we cans et to enable or prevent replacing empty field values (None or empty string rep) with HIDDEN
     
-    def fields_to_hide(self, user):
+    def fields_to_hide(self, user, memberships=None):
         '''
         Given an object and a user (from request.user typically) will return a list of fields in that object
         that should be hidden. Does this by checking for any attributes in that object that are named visibility_*
@@ -43,152 +279,82 @@ class PrivacyMixIn():
                   where * indicates one or more memberships of a user and of the object and if there's
                   an overlap the field will be visible. In an apocryphal case,* might be "group" and users
                   could be in one or more groups and objects could belong to one or more groups and if the
-                  user and the object are both members of at least one group the field will be visible.                  
+                  user and the object are both members of at least one group the field will be visible.
+                  
+        memberships optionally provides this object's membership sets, keyed on field name (see get_memberships).                  
         '''
-        def app_from_object(o):
-            '''Given an object returns the name of the Django app that it's declared in'''
-            return type(o).__module__.split('.')[0]    
-        
-        def model_from_object(o):
-            '''Given an object returns the name of the Django model that it is an instance of'''
-            return o._meta.model.__name__    
-        
-        def get_User_extensions(user):
-            '''
-            Returns a list of attributes that are in request.user which represent User model extensions. That 
-            is have a OneToOne relationship with User. 
-            '''            
-            ext = []
-            if not user is None and hasattr(user, 'is_authenticated'):
-                if user.is_authenticated:
-                    for field in user._meta.get_fields():
-                        if field.one_to_one:
-                            ext.append(field.name)
-            return ext
-    
-        def unique_object_id(obj):
-            if hasattr(obj, "pk"):
-                return "{}.{}.{}".format(app_from_object(obj), model_from_object(obj), obj.pk)
-        
-        def get_User_membership(user, extensions, field_name):
-            '''
-            Given a user (from request.user, and extensions (from get_User_extensions) will check them for
-            an attribute of field_name and for each one it finds will attempt to add its value or values 
-            to the membership set that it will return.
-            '''
-            membership = set()
-            if hasattr(user, field_name):
-                field = getattr(user, field_name, None)
-                if hasattr(field, 'all') and callable(field.all):
-                    membership.add((str(o) for o in field.all())) 
-                elif not field is None: 
-                    membership.add(str(field))
-    
-            for e in extensions:
-                obj = getattr(user, e, None)
-                if hasattr(obj, field_name):
-                    field = getattr(obj, field_name)
-                    if hasattr(field, 'all') and callable(field.all):
-                        membership.update([unique_object_id(o) for o in field.all()])
-                    elif not field is None: 
-                        membership.add(unique_object_id(field))
-                        
-            return membership
-    
-        def get_User_flag(user, extensions, field_name):
-            '''
-            Given a user (from request.user, and extensions (from get_User_extensions) will check them for
-            an attribute of field_name and if it's a bool return the value of the first one it finds. Gives
-            priority to User model extensions but in no guaranteed order.
-            '''
-            for e in extensions:
-                obj = getattr(user, e)
-                if hasattr(obj, field_name):
-                    field = getattr(obj, field_name)
-                    if type(field) == bool:
-                        return field
-    
-            if hasattr(user, field_name):
-                field = getattr(user, field_name)
-                if type(field) == bool:
-                    return field
-    
-        def get_Owner(obj):
-            '''
-            A generic attempt to find an owner for the object passed. Basically checks the object for a field 
-            called owner which returns a user that is the objects owner. Simple really ;-) Best implemented as 
-            property in the model as in:
-            
-                @property
-                def owner(self) -> User:
-                    return <a field in the object that is of type "models.OneToOneField(User)>           
-            '''
-            if hasattr(obj, 'owner'):
-                return obj.owner
-            else:
-                return None
-        
         hide = []
         if hasattr(self, 'visibility'):
             if isinstance(self.visibility, tuple):
-                # Get the User model extensions (we'll check those for visibility tests)
-                extensions = get_User_extensions(user)
-                
-                # We need attributes of the logged in user that the all_ and share_ flags can apply to.
+                # What we need to know about the logged in user, for the all_ and share_ flags. 
                 # Given the attribute we can look for it on:
                 #    request.user
                 #    request.user.player            
+                context = PrivacyContext.of(user)
                 
-                for field in self._meta.get_fields():
-                    prefix = 'visibility_'
-                    if field.name.startswith(prefix):
-                        rule_field = field
-                        look_field = field.name[len(prefix):]
-                        
-                        # Begin by assuming it is hidden
-                        hidden = True
-                        
-                        # Don't ever hide this field from an admin (superuser) or its owner, no tests needed
-                        if not user is None and ((hasattr(user, 'is_superuser') and user.is_superuser) or user == get_Owner(self)): 
-                            hidden = False 
-                        else:
-                            rule_flags = getattr(self, rule_field.name)
-                            for flag in rule_flags:
-                                if flag[1]: # flag is set
-                                    rule_name = flag[0]
-                                    if rule_name == 'all':
-                                        hidden = False # Don't hide this field for anyone, no tests needed
-                                    elif rule_name.startswith('all_'):
-                                        # hide this field from anyone who has not got True for the following field in the User (or False if not_)
-                                        target_value = True
-                                        check_field = rule_name[len('all_'):]
-                                        if check_field.startswith('not_'):
-                                            check_field = check_field[len('not_'):]
-                                            target_value = False
+                for (rule_field, look_field) in privacy_rules(type(self)):
+                    # Begin by assuming it is hidden
+                    hidden = True
+                    
+                    # Don't ever hide this field from an admin (superuser) or its owner, no tests needed
+                    if not user is None and ((hasattr(user, 'is_superuser') and user.is_superuser) or user == get_Owner(self)): 
+                        hidden = False 
+                    else:
+                        rule_flags = getattr(self, rule_field)
+                        for flag in rule_flags:
+                            if flag[1]: # flag is set
+                                rule_name = flag[0]
+                                if rule_name == 'all':
+                                    hidden = False # Don't hide this field for anyone, no tests needed
+                                elif rule_name.startswith('all_'):
+                                    # hide this field from anyone who has not got True for the following field in the User (or False if not_)
+                                    target_value = True
+                                    check_field = rule_name[len('all_'):]
+                                    if check_field.startswith('not_'):
+                                        check_field = check_field[len('not_'):]
+                                        target_value = False
+                                    
+                                    check_value = context.flag(check_field)
+                                    
+                                    if check_value == target_value:
+                                        hidden = False 
+                                elif rule_name.startswith('share_'):
+                                    # hide this field from anyone who has does not share one element in the following field
+                                    # This is for ManyToMany relations, essentially groups you may share membership of. 
+                                    check_field = rule_name[len('share_'):]
+                                    
+                                    if memberships and check_field in memberships:
+                                        a_membership_set = memberships[check_field]
+                                    elif hasattr(self, check_field):
+                                        a_membership_field = getattr(self, check_field)
+                                        if hasattr(a_membership_field, 'all') and callable(a_membership_field.all):
+                                            a_membership_set = set((unique_object_id(o) for o in a_membership_field.all()))
+                                        else:
+                                            a_membership_set = set(unique_object_id(a_membership_field))
+                                    else:
+                                        continue
                                         
-                                        check_value = get_User_flag(user, extensions, check_field)
-                                        
-                                        if check_value == target_value:
-                                            hidden = False 
-                                    elif rule_name.startswith('share_'):
-                                        # hide this field from anyone who has does not share one element in the following field
-                                        # This is for ManyToMany relations, essentially groups you may share membership of. 
-                                        check_field = rule_name[len('share_'):]
-                                        
-                                        if hasattr(self, check_field):
-                                            a_membership_field = getattr(self, check_field)
-                                            if hasattr(a_membership_field, 'all') and callable(a_membership_field.all):
-                                                a_membership_set = set((unique_object_id(o) for o in a_membership_field.all()))
-                                            else:
-                                                a_membership_set = set(unique_object_id(a_membership_field))
-                                                
-                                            b_membership_set = get_User_membership(user, extensions, check_field)
-                                            if a_membership_set.intersection(b_membership_set):
-                                                hidden = False 
-                        if hidden:
-                            hide.append(look_field)
+                                    b_membership_set = context.membership(check_field)
+                                    if a_membership_set.intersection(b_membership_set):
+                                        hidden = False 
+                    if hidden:
+                        hide.append(look_field)
                                
             return hide    
+
+    def apply_privacy(self, user, memberships=None):
+        '''
+        Checks for and enforces privacy constraints for a user, hiding the fields they may not see. 
+        
+        memberships optionally provides this object's membership sets (see fields_to_hide).
+        '''
+        self.hidden = self.fields_to_hide(user, memberships)
+        if len(self.hidden) > 0:
+            self.save = self.safe_save
+            for f in self.hidden:
+                val = getattr(self, f, None)
+                if self.HIDE_EMPTY_FIELD or not (val is None or str(val) == ""):
+                    setattr(self, f, self.HIDDEN)
     
     def fields_for_model(self, *args, **kwargs):
         '''
@@ -215,14 +381,7 @@ class PrivacyMixIn():
         Runs the standard model create() then checks for and enforces privacy constraints.
         '''
         obj = super().create(title)
-        user = CuserMiddleware.get_user()
-        obj.hidden = obj.fields_to_hide(user)
-        if len(obj.hidden) > 0:
-            obj.save = obj.safe_save
-            for f in obj.hidden:
-                val = getattr(obj, f, None)
-                if cls.HIDE_EMPTY_FIELD or not (val is None or str(val) == ""):
-                    setattr(obj, f, cls.HIDDEN)
+        obj.apply_privacy(CuserMiddleware.get_user())
         return obj
 
     @classmethod
@@ -230,16 +389,16 @@ class PrivacyMixIn():
         '''
         Override the from_db method. 
         Runs the standard model from_db() then checks for and enforces privacy constraints.
+        
+        Unless privacy is deferred (see deferred_privacy), in which case it is collected to
+        have its privacy constraints enforced later as part of a batch.  
         '''
         obj = super().from_db(db, field_names, values)
-        user = CuserMiddleware.get_user()
-        obj.hidden = obj.fields_to_hide(user)
-        if len(obj.hidden) > 0:
-            obj.save = obj.safe_save
-            for f in obj.hidden:
-                val = getattr(obj, f, None)
-                if cls.HIDE_EMPTY_FIELD or not (val is None or str(val) == ""):
-                    setattr(obj, f, cls.HIDDEN)
+        deferred = getattr(_local, 'deferred', None)
+        if deferred is None:
+            obj.apply_privacy(CuserMiddleware.get_user())
+        else:
+            deferred.append(obj)
         return obj
 
     def refresh_from_db(self, using=None, fields=None, **kwargs):
@@ -248,14 +407,7 @@ class PrivacyMixIn():
         Runs the standard model refresh_from_db() then checks for and enforces privacy constraints.
         '''
         super().refresh_from_db(using, fields, **kwargs)
-        user = CuserMiddleware.get_user()
-        self.hidden = self.fields_to_hide(user)
-        if len(self.hidden) > 0:
-            self.save = self.safe_save
-            for f in self.hidden:
-                val = getattr(self, f, None)
-                if self.HIDE_EMPTY_FIELD or not (val is None or str(val) == ""):
-                    setattr(self, f, self.HIDDEN)
+        self.apply_privacy(CuserMiddleware.get_user())
         
     def safe_save(self, *args, **kwargs):
         '''